@@ -38,12 +38,20 @@ WSServer (listen) => WSClient (thread) -> WSDecoder (one per WSClient)
     |                       |                  |
     |                       |                  v
     |-------multicast-------|------------- WSEncoder
+
+With --asyncio, WSAsyncServer and WSAsyncClient replace WSServer and WSClient:
+clients are coroutines sharing the event loop of the server thread.
 """
 
 from backend.LoggerFormater import (LoggerFormatter, loggingWebsocket)
 from websocket.WSEncoder import WSEncoder
 from backend.WSHandler import WSHandler
+from websocket.WSAsyncServer import WSAsyncServer
 from websocket.WSServer import WSServer
+from websocket.WSSettings import WSSettings
+from websocket.WSSendQueue import WSSendQueue
+from backend.Scheduler import Scheduler
+from backend.MetricsServer import MetricsServer
 from backend.Flow import Flow
 import threading
 import argparse
@@ -56,6 +64,22 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument('-v', '--verbose', help='Show all logs', action='store_true')
   parser.add_argument('-l', '--location', help='Location of saved files, default is where you launch the command')
+  parser.add_argument('-a', '--asyncio', help='Serve all clients from one asyncio event loop instead of one thread per client', action='store_true')
+  parser.add_argument('--max-clients', help='Max clients connected at the same time, default is 20 (10000 with --asyncio)', type=int)
+  parser.add_argument('--backlog', help='Number of pending connections the server socket can queue, default is 1 (128 with --asyncio)', type=int)
+  parser.add_argument('--max-message-size', help='Largest message accepted from a client in bytes, default is 16MB', type=int)
+  parser.add_argument('--no-compression', help='Refuse permessage-deflate compression offers from clients', action='store_true')
+  parser.add_argument('--traffic-interval', help='Seconds between two traffic messages, default is 1', type=float)
+  parser.add_argument('--warmup', help='Threads importing the components not used by the saved flow in background, default is 0 (imported when first used)', type=int)
+  parser.add_argument('--workers', help='Threads delivering data between components, default is 4 (0 delivers in the sending thread)', type=int)
+  parser.add_argument('--processes', help='Worker processes running the components with the process executor, default is the number of CPUs', type=int)
+  parser.add_argument('--queue-capacity', help='Deliveries waiting in the inbox of a component, default is %d' % Scheduler.QUEUE_CAPACITY, type=int)
+  parser.add_argument('--queue-policy', help='What to do when the inbox of a component is full, default is %s' % Scheduler.QUEUE_POLICY, choices=Scheduler.POLICIES)
+  parser.add_argument('--send-queue-size', help='Max messages waiting to be written to a client, default is %d' % WSSettings.SEND_QUEUE_SIZE, type=int)
+  parser.add_argument('--send-policy', help='What to do when the send queue of a client is full, default is %s' % WSSettings.SEND_POLICY, choices=WSSendQueue.POLICIES)
+  parser.add_argument('--no-timing', help='Do not measure the durations of the data handlers of the components', action='store_true')
+  parser.add_argument('--metrics-port', help='Serve the metrics in the Prometheus format on this port, at /metrics (disabled by default)', type=int)
+  parser.add_argument('--metrics-host', help='Address of the metrics endpoint, default is 127.0.0.1')
   args = parser.parse_args()
 
   # Configuring logging
@@ -75,17 +99,52 @@ if __name__ == "__main__":
   else:
     location = './'
 
+  flow = None
+  metrics = None
   try:
     pid = os.getpid()
-    _WSServer = WSServer(host='', port=5001, maxclients=20)
-    flow = Flow(_WSServer, WSEncoder(), location)
+    if args.asyncio:
+      _WSServer = WSAsyncServer(host='', port=5001,
+        maxclients=args.max_clients if args.max_clients else 10000,
+        backlog=args.backlog if args.backlog else 128,
+        maxmessagesize=args.max_message_size if args.max_message_size else WSSettings.MAX_MESSAGE_SIZE,
+        compression=not args.no_compression,
+        sendqueuesize=args.send_queue_size if args.send_queue_size else WSSettings.SEND_QUEUE_SIZE,
+        sendpolicy=args.send_policy if args.send_policy else WSSettings.SEND_POLICY)
+    else:
+      _WSServer = WSServer(host='', port=5001,
+        maxclients=args.max_clients if args.max_clients else 20,
+        backlog=args.backlog if args.backlog else 1,
+        maxmessagesize=args.max_message_size if args.max_message_size else WSSettings.MAX_MESSAGE_SIZE,
+        compression=not args.no_compression,
+        sendqueuesize=args.send_queue_size if args.send_queue_size else WSSettings.SEND_QUEUE_SIZE,
+        sendpolicy=args.send_policy if args.send_policy else WSSettings.SEND_POLICY)
+    flow = Flow(_WSServer, WSEncoder(), location,
+      trafficInterval=args.traffic_interval if args.traffic_interval else 1.0,
+      warmup=args.warmup if args.warmup else 0,
+      workers=args.workers if args.workers is not None else 4,
+      processes=args.processes,
+      queueCapacity=args.queue_capacity if args.queue_capacity else Scheduler.QUEUE_CAPACITY,
+      queuePolicy=args.queue_policy if args.queue_policy else Scheduler.QUEUE_POLICY,
+      timing=not args.no_timing)
     _WSHandler = WSHandler(_WSServer, flow)
     _WSServer.start()
+    if args.metrics_port:
+      metrics = MetricsServer(flow, _WSServer, args.metrics_host if args.metrics_host else '127.0.0.1', args.metrics_port)
+      metrics.start()
     input('Server listening, press any key to abort...\n')
     logging.info('--- KEYBOARD INTERRUPT ---')
     _WSServer.stop()
+    if metrics is not None:
+      metrics.stop()
+    if flow is not None:
+      flow.stop()
     os.kill(pid, 9)
   except KeyboardInterrupt as e:
     logging.info('--- KEYBOARD INTERRUPT ---')
     _WSServer.stop()
+    if metrics is not None:
+      metrics.stop()
+    if flow is not None:
+      flow.stop()
     os.kill(pid, 9)
@@ -1,8 +1,16 @@
-from .Payload import Payload
+from .Payload import Payload, Envelope
+from .Histogram import Histogram
 from .Messages import *
 import logging
+import time
+import os
 
 class Component:
+  # Events whose handler durations are recorded, when the timings of the flow are enabled
+  TIMED = ('data', 'batch')
+  # The thread CPU time (a system call) is measured for one call out of CPU_SAMPLE
+  CPU_SAMPLE = 8
+
   def __init__(self, attrs, libraryOpts, flowInstance):
     self.id = attrs['id']
     self.x = attrs['x']
@@ -29,21 +37,64 @@ class Component:
 
     # Save link to flow instance
     self.flow = flowInstance
+    self.library = libraryOpts
 
     # Component events
     self.events = {}
 
     # Connections
     self.connections = attrs['connections'] if 'connections' in attrs else {}
+    # Routing index compiled by the flow from the connections, see Flow.compileRoutes:
+    # targets (component, input index, counted) by output index, and of all outputs but the error one
+    self.routes = {}
+    self.broadcast = ()
+    # Data sent through all outputs reaches several targets: they get read-only views
+    self.broadcastShared = False
 
     # Traffic
     self.countInputs = 0
     self.countOutputs = 0
-    self.outputComponentAlreadyListed = {}
+
+    # Wall and thread CPU durations of the data handlers, and their values when last published
+    self.latency = Histogram()
+    self.cpuTime = Histogram()
+    self.timingsPublished = (Histogram(), Histogram())
+    self.timedCalls = 0
 
     # Errors
     self.errors = {}
 
+  def filepath(self):
+    return os.path.join(self.flow.componentsPath, self.library['filename'] + '.py')
+
+  def batchOptions(self):
+    # 'batch' of the instance options, or else of the library exports: {'count': ..., 'window': seconds}
+    if isinstance(self.options, dict) and 'batch' in self.options:
+      return self.options['batch']
+    return self.library.get('batch', {})
+
+  def queueOptions(self):
+    # 'queue' of the instance options, or else of the library exports: {'capacity': ..., 'policy': ..., 'sample': ...}
+    if isinstance(self.options, dict) and 'queue' in self.options:
+      return self.options['queue']
+    return self.library.get('queue', {})
+
+  def pressure(self, index=None):
+    # Fill ratio of the fullest inbox downstream, from 0 to 1: sources can check it before generating more data
+    pressure = 0
+    for conn, targets in self.broadcast:
+      if index is not None and conn != str(index):
+        continue
+      for ist, toIdx, counted in targets:
+        pressure = max(pressure, self.flow.scheduler.pressure(ist))
+    return pressure
+
+  def runsInProcess(self):
+    # 'executor' of the instance options, or else of the library exports
+    if isinstance(self.options, dict) and 'executor' in self.options:
+      return self.options['executor'] == 'process'
+    return self.library.get('executor') == 'process'
+
   def setPos(self, x, y):
     self.x = x
     self.y = y
@@ -73,7 +124,26 @@ class Component:
       logging.warn('Event not registered for this component [%s, %s] -> dropping...' % (self.id, eventName))
       return
 
-    self.events[eventName](self, args)
+    if eventName not in Component.TIMED or not self.flow.timing:
+      self.events[eventName](self, args)
+      return
+
+    self.timedCalls += 1
+    if self.timedCalls % Component.CPU_SAMPLE:
+      start = time.perf_counter_ns()
+      try:
+        self.events[eventName](self, args)
+      finally:
+        self.latency.record(time.perf_counter_ns() - start)
+      return
+
+    start = time.perf_counter_ns()
+    cpu = time.thread_time_ns()
+    try:
+      self.events[eventName](self, args)
+    finally:
+      self.cpuTime.record(time.thread_time_ns() - cpu)
+      self.latency.record(time.perf_counter_ns() - start)
 
   def debug(self, data, style=None, group=None, id=None):
     MESSAGE_DEBUG['group'] = group
@@ -94,31 +164,31 @@ class Component:
 
   def updateConnections(self, conn):
     self.connections = conn if conn is not None else {}
-
-  def send(self, data, index=None):
-    if not isinstance(data, Payload):
-      data = Payload(data, self.id)
-
-    if index is not None:
-      index = str(index)
-
-    # Reset list
-    self.outputComponentAlreadyListed = {}
+    self.flow.compileRoutes([self])
+
+  def send(self, data, index=None, batch=False, size=None):
+    # With batch, data is a list of payloads sent at once, traffic is counted once.
+    # size: bytes of each payload when known by the component, measured once otherwise
+    payloads = data if batch else [data]
+    payloads = [p if isinstance(p, (Payload, Envelope)) else Payload(p, self.id, size=size) for p in payloads]
+    if not len(payloads):
+      return
+    size = sum(p.getSize() for p in payloads)
 
     if index is None:
-      # Send through all outputs
-      # {'0': [{'index': '0', 'id': '1578503223401'}]}
-      for conn in self.connections:
-        if conn != '99': # Ignore bug output
-          self.flow.updateTraffic(self.id, 'output', None, conn, size=data.getSize())
-          self.sendToIndex(data, conn)
+      # Send through all outputs but the error one
+      for conn, targets in self.broadcast:
+        self.flow.updateTraffic(self.id, 'output', None, conn, size=size, messages=len(payloads))
+        self.sendToIndex(payloads, conn, targets, size, self.broadcastShared)
     else:
-      self.flow.updateTraffic(self.id, 'output', None, index, size=data.getSize())
-      if index not in self.connections:
+      index = str(index)
+      self.flow.updateTraffic(self.id, 'output', None, index, size=size, messages=len(payloads))
+      targets = self.routes.get(index)
+      if targets is None:
         logging.warn('No output connection with this index [%s] -> dropping...' % (index,))
         return
 
-      self.sendToIndex(data, index)
+      self.sendToIndex(payloads, index, targets, size, len(targets) > 1)
 
     # self.flow.sendTrafficMessage()
 
@@ -149,43 +219,20 @@ class Component:
   def throw(self, data):
     self.send(data, 99)
 
-  def sendToIndex(self, data, index):
-    targets = self.connections[str(index)]
-    data.fromIdx = index
-    # targets -> [{'index': '0', 'id': '1578503223401'}]
-    for t in targets:
-      if t['id'] not in self.flow.instances:
-        logging.warn('Sending to unknown component [%s] -> dropping...' % (t['id'],))
-        continue
-      
-      ist = self.flow.instances[t['id']]
-
-      # Update payload infos
-      data.toID = ist.id
-
-      # Disable inputs
-      if t['index'] in ist.disabledio['input']:
-        continue
-
-      # Update traffic
-      ist.countInputs += 1
-
-      if ist.id not in self.outputComponentAlreadyListed:
-        self.outputComponentAlreadyListed[ist.id] = True
-        self.flow.updateTraffic(ist.id, 'input', False, size=data.getSize())
-
-      if ist.id in self.flow.traffic:
-        self.flow.traffic[ist.id]['ci'] = ist.countInputs
-
-      self.flow.sendTrafficMessage()
-
-      # Keep trace of data send
-      self.flow.onGoing += 1
-      data.toIdx = t['index']
-      ist.emit('data', data)
-      self.flow.onGoing -= 1
-      if self.flow.onGoing == 0:
-        self.flow.resetTraffic()
+  def sendToIndex(self, payloads, index, targets, size, shared):
+    # shared: the data reaches several targets of the send, through this output or others, read-only for all of them
+    priority = index == '99'
+    messages = len(payloads)
+    # targets -> ((component, input index, counted), ...)
+    for ist, toIdx, counted in targets:
+      # Update traffic of the edge, input size counted once per target component
+      ist.countInputs += messages
+      self.flow.traffic.deliver(self.id, index, ist.id, toIdx, size, messages, counted)
+      self.flow.traffic.set(ist.id, 'ci', ist.countInputs)
+
+      # Each target gets its own envelope, delivered later by the scheduler
+      deliveries = [Envelope(data, ist.id, index, toIdx, shared) for data in payloads]
+      self.flow.scheduler.deliver(ist, deliveries, priority=priority)
 
   def save(self):
     objToSave = {
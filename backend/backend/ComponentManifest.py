@@ -0,0 +1,65 @@
+from .Journal import Journal
+import hashlib
+import logging
+import json
+import os
+
+class ComponentManifest:
+  # Metadata of the component files, to build the library without importing them.
+  # An entry is valid while the file has the same mtime, or else the same hash.
+  def __init__(self, path):
+    self.path = path
+    self.entries = {}
+    self.changed = False
+
+    if os.path.isfile(path):
+      try:
+        with open(path, 'r') as file:
+          self.entries = json.loads(file.read())
+      except ValueError:
+        logging.warn('Invalid component manifest, rebuilding...')
+
+  @staticmethod
+  def hash(filepath):
+    with open(filepath, 'rb') as file:
+      return hashlib.sha1(file.read()).hexdigest()
+
+  def get(self, filepath):
+    if filepath not in self.entries:
+      return None
+    entry = self.entries[filepath]
+    mtime = os.path.getmtime(filepath)
+    if entry['mtime'] != mtime:
+      if entry['hash'] != ComponentManifest.hash(filepath):
+        return None
+      entry['mtime'] = mtime
+      self.changed = True
+    return dict(entry['component'])
+
+  def put(self, filepath, component):
+    try:
+      # Metadata changed by JSON (tuples, keys not str, ...) would be registered changed from the manifest
+      serializable = json.loads(json.dumps(component)) == component
+    except (TypeError, ValueError):
+      serializable = False
+    if not serializable:
+      # The component is always imported
+      self.entries.pop(filepath, None)
+      return False
+    self.entries[filepath] = {
+      'mtime': os.path.getmtime(filepath),
+      'hash': ComponentManifest.hash(filepath),
+      'component': component
+    }
+    self.changed = True
+    return True
+
+  def prune(self, filepaths):
+    for filepath in [p for p in self.entries if p not in filepaths]:
+      del self.entries[filepath]
+      self.changed = True
+
+  def save(self):
+    if self.changed:
+      Journal.writeAtomic(self.path, json.dumps(self.entries))
+      self.changed = False
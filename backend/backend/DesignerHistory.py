@@ -0,0 +1,24 @@
+from collections import deque
+
+class DesignerHistory:
+  # Versions of the designer state, with the last patches kept to resynchronise clients
+  def __init__(self, size=256):
+    self.version = 0
+    self.patches = deque(maxlen=size)
+
+  def push(self, changes):
+    self.version += 1
+    patch = {
+      'version': self.version,
+      'changes': changes
+    }
+    self.patches.append(patch)
+    return patch
+
+  def since(self, version):
+    # Patches to apply on top of a version, None if they are not all kept anymore
+    if version == self.version:
+      return []
+    if version > self.version or not self.patches or self.patches[0]['version'] > version + 1:
+      return None
+    return [p for p in self.patches if p['version'] > version]
@@ -1,6 +1,18 @@
+from .TrafficPublisher import TrafficPublisher
+from .TrafficStore import TrafficStore
+from .Histogram import Histogram
+from .Profiler import Profiler
+from .DesignerHistory import DesignerHistory
+from .Journal import Journal
+from .Scheduler import Scheduler
+from .ProcessExecutor import ProcessExecutor
+from .ComponentManifest import ComponentManifest
+from concurrent.futures import ThreadPoolExecutor
+from .FlowMessage import FlowMessage
+from .Protocol import Protocol
 from .Component import Component
 from ast import literal_eval
-from threading import Timer
+from threading import Lock, RLock
 from pathlib import Path
 from .Messages import *
 import dateutil.parser
@@ -10,10 +22,14 @@ import requests
 import logging
 import psutil
 import json
+import time
 import os
 
 class Flow:
-  def __init__(self, server, encoder, appPath):
+  # Journal records between two snapshots
+  JOURNAL_COMPACT = 1000
+
+  def __init__(self, server, encoder, appPath, trafficInterval=1.0, warmup=0, workers=4, processes=None, queueCapacity=Scheduler.QUEUE_CAPACITY, queuePolicy=Scheduler.QUEUE_POLICY, timing=True):
     self._WSServer = server
     self.encoder = encoder
     self.appPath = os.path.join(appPath, '.flow/')
@@ -31,7 +47,14 @@ class Flow:
     self.variablesBody = ''
 
     # Component library
+    self.componentsPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'components/')
     self.componentLibrary = {}
+    # Position of the components in the designer database
+    self.databaseIndex = {}
+    # Components registered from the manifest, imported when first instantiated
+    self.manifest = ComponentManifest(os.path.join(self.appPath, 'manifest'))
+    self.lazyComponents = {}
+    self.importLocks = {}
 
     # Components instances
     self.instances = {}
@@ -39,46 +62,119 @@ class Flow:
     # Tabs
     self.tabs = []
 
+    # Designer state: saved instances by id, patched on changes, and its versions
+    self.designerComponents = {}
+    self.designer = DesignerHistory()
+
+    # Uploads in progress (target component by client)
+    self.uploads = {}
+    # Profiling session in progress, one at a time
+    self.profiler = None
+
     # Traffic
-    self.traffic = {
-      'count': 0
-    }
+    self.traffic = TrafficStore()
+    # Deliveries queued or being processed
     self.onGoing = 0
+    # Next traffic message with all the components, counters reset after it
+    self.trafficFull = True
+    self.trafficReset = False
+    self.process = psutil.Process(os.getpid())
+    # Handler durations recorded by the components, and process CPU time when last published
+    self.timing = timing
+    self.cpuPublished = sum(self.process.cpu_times()[:2])
+
+    # Data deliveries between components
+    self.scheduler = Scheduler(self, workers, queueCapacity, queuePolicy)
+    # Worker processes of the components with the 'process' executor, started when first needed
+    self.processExecutor = ProcessExecutor(processes)
+
+    # Changes saved since the last snapshot, appended and snapshotted under journalLock
+    self.journal = Journal(os.path.join(self.appPath, 'journal'))
+    self.journalLock = RLock()
+    self.journal.start()
 
     logging.info('-- Loading designer --')
     self.load()
     logging.info('------- Loaded -------')
 
+    # Import the remaining components in background
+    if warmup > 0 and len(self.lazyComponents):
+      executor = ThreadPoolExecutor(warmup)
+      for id in list(self.lazyComponents):
+        executor.submit(self.importComponent, id)
+      executor.shutdown(wait=False)
+
     # Send traffic messages
-    Timer(1.0, lambda: Flow.sendTrafficMessage(self)).start()
+    self.trafficPublisher = TrafficPublisher(self, trafficInterval)
+    self.trafficPublisher.start()
 
   def sendTrafficMessage(self):
-    MESSAGE_TRAFFIC['body'] = self.traffic
-    MESSAGE_TRAFFIC['memory'] = str(psutil.Process(os.getpid()).memory_info()[0] / float(2 ** 20)) + 'MB'
-    MESSAGE_TRAFFIC['counter'] += 1
+    reset = self.trafficReset and self.onGoing == 0
+    body, edges, count = self.traffic.publish(self.trafficFull, reset)
+    full = self.trafficFull
+    self.trafficFull = False
+    if reset:
+      self.trafficReset = False
+    if not len(body) and not len(edges) and not full:
+      return
+
+    body['count'] = count
+    MESSAGE_TRAFFIC['body'] = body
+    MESSAGE_TRAFFIC['edges'] = edges
+    if self.timing:
+      MESSAGE_TRAFFIC['tabs'] = self.publishTimings(body, full)
+    MESSAGE_TRAFFIC['memory'] = str(self.process.memory_info()[0] / float(2 ** 20)) + 'MB'
+    MESSAGE_TRAFFIC['counter'] = 1 if reset else MESSAGE_TRAFFIC['counter'] + 1
 
     self.sendMessage(MESSAGE_TRAFFIC)
 
-    # Reset inputs, outputs
-    for key in self.traffic:
-      if key == 'count':
+  def publishTimings(self, body, full):
+    # Handler durations since the last traffic message, of the components in body and of each tab:
+    # mean and percentiles in ms, share of the CPU time of the process in %
+    cpu = sum(self.process.cpu_times()[:2])
+    elapsed = max(cpu - self.cpuPublished, 1e-9)
+    self.cpuPublished = cpu
+
+    def timings(latency, cpuTime):
+      return {
+        'duration': round(latency.sum / max(latency.count, 1) / 1e6, 3),
+        'p50': round(latency.percentile(50) * 1e3, 3),
+        'p95': round(latency.percentile(95) * 1e3, 3),
+        'p99': round(latency.percentile(99) * 1e3, 3),
+        'cpu': round(cpuTime.sum * Component.CPU_SAMPLE / 1e9 / elapsed * 100, 2)
+      }
+
+    tabs = {}
+    idle = None
+    for ist in list(self.instances.values()):
+      previous = ist.timingsPublished
+      if ist.latency.count == previous[0].count and ist.cpuTime.count == previous[1].count:
+        # Nothing recorded since the last message: no copy
+        if ist.id in body:
+          idle = idle if idle is not None else timings(Histogram(), Histogram())
+          body[ist.id].update(idle)
+        if full and ist.tab not in tabs:
+          tabs[ist.tab] = (Histogram(), Histogram())
+        continue
+
+      latency, cpuTime = ist.latency.copy(), ist.cpuTime.copy()
+      ist.timingsPublished = (latency, cpuTime)
+      latency, cpuTime = latency.since(previous[0]), cpuTime.since(previous[1])
+      if ist.id in body:
+        body[ist.id].update(timings(latency, cpuTime))
+      if latency.count == 0 and not full:
         continue
-      item = self.traffic[key]
-      for k in item:
-        if k.startswith('no'):
-          item[k] = 0
-
-    #   if item['ni']:
-    #     item['input'] -= item['ni']
-    #   if item['no']:
-    #     item['output'] -= item['no']
-      item['ni'] = 0
-      item['no'] = 0
+
+      if ist.tab not in tabs:
+        tabs[ist.tab] = (Histogram(), Histogram())
+      tabs[ist.tab][0].merge(latency)
+      tabs[ist.tab][1].merge(cpuTime)
+
+    return { tab: dict(timings(*tabs[tab]), count=tabs[tab][0].count) for tab in tabs }
 
   def resetTraffic(self):
-    self.traffic = { 'count':  0 }
-    MESSAGE_TRAFFIC['body'] = self.traffic
-    MESSAGE_TRAFFIC['counter'] = 0
+    # Counters are reset once published
+    self.trafficReset = True
 
   def selfRegisterComponent(self, mod, file):
     try:
@@ -91,10 +187,6 @@ class Flow:
       else:
         installFN = None
 
-      # Storing component into component library
-      if exports['id'] in self.componentLibrary:
-        logging.warn('Component ID already registered [%s] -> replacing' % (file,))
-
       # Create component obj
       obj = dict(exports)
       obj['component'] = file.split('.py')[0]
@@ -119,33 +211,66 @@ class Flow:
       obj['traffic'] = False if 'traffic' in exports and not exports['traffic'] else True
       obj['variables'] = True if 'variables' in exports and exports['variables'] else False
       obj['filename'] = file.split('.py')[0]
-      self.componentLibrary[exports['id']] = obj
-
-      data = dict(obj)
-      data['fn'] = None
-      data['readme'] = None
-      data['html'] = None
-      data['install'] = None
-      data['uninstall'] = None
-      if 'options' in data:
-        data['options']['install'] = None
-        data['options']['uninstall'] = None
-
-      index = next(
-        (i for i, item in enumerate(MESSAGE_DESIGNER['database']) if item['id'] == exports['id']),
-        -1
-      )
-
-      if index == -1:
-        MESSAGE_DESIGNER['database'].append(data)
-      else:
-        MESSAGE_DESIGNER['database'][index] = data
+      self.registerComponent(obj, file)
+      self.lazyComponents.pop(obj['id'], None)
+
+      # Metadata for the manifest, without the functions
+      meta = dict(obj)
+      meta['fn'] = None
+      meta['install'] = None
+      meta['uninstall'] = None
+      self.manifest.put(os.path.join(self.componentsPath, file), meta)
     except Exception as e:
       logging.warn('Exception while loading component [%s]: %s -> droppping...' % (file,e))
       return False
 
     return True
 
+  def registerComponent(self, obj, file):
+    # Storing component into component library
+    if obj['id'] in self.componentLibrary:
+      logging.warn('Component ID already registered [%s] -> replacing' % (file,))
+    self.componentLibrary[obj['id']] = obj
+
+    data = dict(obj)
+    data['fn'] = None
+    data['readme'] = None
+    data['html'] = None
+    data['install'] = None
+    data['uninstall'] = None
+    if 'options' in data:
+      data['options']['install'] = None
+      data['options']['uninstall'] = None
+
+    if obj['id'] not in self.databaseIndex:
+      self.databaseIndex[obj['id']] = len(MESSAGE_DESIGNER['database'])
+      MESSAGE_DESIGNER['database'].append(data)
+    else:
+      MESSAGE_DESIGNER['database'][self.databaseIndex[obj['id']]] = data
+
+  def importModule(self, filepath):
+    spec = importlib.util.spec_from_file_location('components', filepath)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+  def importComponent(self, id):
+    # Install function of a component, its module is imported on first use
+    lock = self.importLocks.get(id)
+    if lock is None:
+      return self.componentLibrary[id]['fn']
+    with lock:
+      if id in self.lazyComponents:
+        filepath = self.lazyComponents[id]
+        logging.info('Importing %s component' % (os.path.basename(filepath),))
+        try:
+          exports = self.importModule(filepath).EXPORTS
+          self.componentLibrary[id]['fn'] = exports['install'] if 'install' in exports else None
+        except Exception as e:
+          logging.error('Exception while importing component [%s]: %s' % (filepath, e))
+        del self.lazyComponents[id]
+    return self.componentLibrary[id]['fn']
+
   def load(self):
     variableFile = os.path.join(self.appPath, 'variables')
     tabsFile = os.path.join(self.appPath, 'tabs')
@@ -153,18 +278,29 @@ class Flow:
 
     # Loading component library
     nbComponentsLoaded = 0
-    componentsPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'components/')
-    for file in os.listdir(componentsPath):
+    filepaths = []
+    for file in os.listdir(self.componentsPath):
       if file.endswith('.py'):
+        filepath = os.path.join(self.componentsPath, file)
+        filepaths.append(filepath)
+        obj = self.manifest.get(filepath)
+        if obj is not None:
+          logging.info('Loading %s component from manifest' % (file,))
+          self.registerComponent(obj, file)
+          self.lazyComponents[obj['id']] = filepath
+          self.importLocks[obj['id']] = Lock()
+          nbComponentsLoaded += 1
+          continue
+
         logging.info('Loading %s component' % (file,))
         # Load component
-        spec = importlib.util.spec_from_file_location('components', os.path.join(componentsPath, file))
-        mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(mod)
+        mod = self.importModule(filepath)
 
         if self.selfRegisterComponent(mod, file):
           nbComponentsLoaded += 1
     logging.info('%d components loaded' % (nbComponentsLoaded,))
+    self.manifest.prune(filepaths)
+    self.manifest.save()
 
     # Testing files
     if not os.path.exists(variableFile):
@@ -182,17 +318,13 @@ class Flow:
       raise Exception('Saved folder error')
 
     # Opening files
+    instances = {}
     with open(componentsFile, 'r') as file:
       data = file.read()
       file.close()
       if data is not None and data != '':
-        instances = json.loads(data)
-        # Recreate all components and add into MESSAGE_DESIGNER the new components
-        MESSAGE_DESIGNER['components'] = []
-        for ist in instances:
-          newIst = self.addInstance(ist)
-          if newIst is not None:
-            MESSAGE_DESIGNER['components'].append(newIst.save())
+        for ist in json.loads(data):
+          instances[ist['id']] = ist
 
     if os.path.exists(tabsFile):
       # Load existing tabs
@@ -200,45 +332,118 @@ class Flow:
         data = file.read()
         file.close()
         self.tabs = json.loads(data)
-        MESSAGE_DESIGNER['tabs'] = self.tabs
-    
-    # Variables last because it save the designer state
+
     with open(variableFile, 'r') as file:
-      data = file.read()
+      variablesBody = file.read()
       file.close()
-      self.updateVariables(data)
+
+    # Replay the changes saved after the snapshot
+    for record in Journal.replay(self.journal.path):
+      if record['op'] == 'put':
+        instances[record['com']['id']] = record['com']
+      elif record['op'] == 'del':
+        instances.pop(record['id'], None)
+      elif record['op'] == 'tabs':
+        self.tabs = record['tabs']
+      elif record['op'] == 'variables':
+        variablesBody = record['body']
+
+    # Recreate all components and add them into the designer state
+    for ist in instances.values():
+      newIst = self.addInstance(ist, compile=False)
+      if newIst is not None:
+        self.designerComponents[newIst.id] = newIst.save()
+    self.compileRoutes()
+    MESSAGE_DESIGNER['tabs'] = self.tabs
+
+    self.updateVariables(variablesBody)
+
+    # New snapshot with the replayed changes
+    self.save()
 
   def save(self):
+    # Snapshot of the whole flow, written in background
     logging.info('---- BEGIN SAVE -----')
-    with open(os.path.join(self.appPath, 'variables'), 'w') as file:
-      file.write(self.variablesBody)
-      file.close()
-
-    if len(self.tabs) != 0:
-      with open(os.path.join(self.appPath, 'tabs'), 'w') as file:
-        file.write(json.dumps(self.tabs))
-        file.close()
-
-    with open(os.path.join(self.appPath, 'instances'), 'w') as file:
-      toSave = []
-      for istID in self.instances:
-        toSave.append(self.instances[istID].save())
-      file.write(json.dumps(toSave))
-      file.close()
+    # No record queued between the text of the snapshot and the snapshot, the journal drops it
+    with self.journalLock:
+      files = {
+        os.path.join(self.appPath, 'variables'): self.variablesBody,
+        os.path.join(self.appPath, 'instances'): json.dumps([self.instances[istID].save() for istID in self.instances])
+      }
+      if len(self.tabs) != 0:
+        files[os.path.join(self.appPath, 'tabs')] = json.dumps(self.tabs)
+      self.journal.snapshot(files)
     logging.info('---- ENDED SAVE -----')
 
-  def formatMessage(self, obj):
-    try:
-      return self.encoder.text(urllib.parse.quote(json.dumps(obj)), mask=0)
-    except Exception as e:
-      obj['body'] = str(obj['body'])
-      return self.encoder.text(urllib.parse.quote(json.dumps(obj)), mask=0)
+  def record(self, record):
+    # Save one change, the journal is compacted into a snapshot from time to time
+    with self.journalLock:
+      self.journal.append(record)
+      if self.journal.records >= Flow.JOURNAL_COMPACT:
+        self.save()
+
+  def recordChanges(self, changes):
+    for change in changes:
+      if change['op'] == 'tabs':
+        self.record({ 'op': 'tabs', 'tabs': change['tabs'] })
+      elif change['op'] == 'rem':
+        self.record({ 'op': 'del', 'id': change['id'] })
+      elif change['op'] == 'add':
+        self.record({ 'op': 'put', 'com': change['com'] })
+      elif change['id'] in self.designerComponents:
+        self.record({ 'op': 'put', 'com': self.designerComponents[change['id']] })
+
+  def stop(self):
+    if self.profiler is not None:
+      self.profiler.stop()
+    self.scheduler.stop()
+    self.processExecutor.shutdown()
+    self.trafficPublisher.stop()
+    self.journal.close()
+
+  def formatMessage(self, obj, clients=None):
+    # Packed now for the clients of the binary protocol among the recipients, all the clients by default
+    clients = clients if clients is not None else list(self._WSServer.clients)
+    return FlowMessage(self.encoder, obj, binary=any(c.protocol == Protocol.BINARY for c in clients))
 
   def sendMessage(self, obj):
     self._WSServer.send(self.formatMessage(obj))
 
-  def onConnect(self):
-    self.sendMessage(MESSAGE_DESIGNER)
+  def designerSnapshot(self):
+    MESSAGE_DESIGNER['components'] = list(self.designerComponents.values())
+    MESSAGE_DESIGNER['version'] = self.designer.version
+    return MESSAGE_DESIGNER
+
+  def sendDesignerPatch(self, changes):
+    # Clients of the legacy protocol do not know patches, they get the whole designer
+    patch = self.designer.push(changes)
+    MESSAGE_DESIGNER_PATCH['version'] = patch['version']
+    MESSAGE_DESIGNER_PATCH['changes'] = changes
+
+    legacy = None
+    clients = list(self._WSServer.clients)
+    if any(c.protocol in (None, Protocol.QUOTED) for c in clients):
+      legacy = self.designerSnapshot()
+    self._WSServer.send(FlowMessage(self.encoder, MESSAGE_DESIGNER_PATCH, legacy, binary=any(c.protocol == Protocol.BINARY for c in clients)))
+
+  def sendDesigner(self, client, version=None):
+    # Patches since the version of the client, or the whole designer on connection or version gap
+    patches = self.designer.since(version) if version is not None and client.protocol != Protocol.QUOTED else None
+    if patches is None:
+      client.send(self.formatMessage(self.designerSnapshot(), [client]))
+      return
+    for patch in patches:
+      MESSAGE_DESIGNER_PATCH['version'] = patch['version']
+      MESSAGE_DESIGNER_PATCH['changes'] = patch['changes']
+      client.send(self.formatMessage(MESSAGE_DESIGNER_PATCH, [client]))
+
+  def onConnect(self, client=None):
+    if client is not None:
+      self.sendDesigner(client)
+    else:
+      self.sendMessage(self.designerSnapshot())
+    # New client has no traffic yet
+    self.trafficFull = True
 
     if 'count' not in MESSAGE_ONLINE:
       MESSAGE_ONLINE['count'] = 0
@@ -264,6 +469,9 @@ class Flow:
 
     if message['type'] == 'variables':
       self.updateVariables(message['body'])
+    elif message['type'] == 'getdesigner':
+      # Client missed patches
+      self.sendDesigner(client, message['version'] if 'version' in message else None)
     elif message['type'] == 'getvariables':
       MESSAGE_VARIABLES['body'] = self.variablesBody
       self.sendMessage(MESSAGE_VARIABLES)
@@ -276,7 +484,7 @@ class Flow:
         return
       MESSAGE_STATIC['id'] = message['id']
       MESSAGE_STATIC['body'] = self.componentLibrary[comName]['readme']
-      client.send(self.formatMessage(MESSAGE_STATIC))
+      client.send(self.formatMessage(MESSAGE_STATIC, [client]))
     elif message['type'] == 'html':
       if message['target'] not in self.componentLibrary:
         logging.warn('Component not found in library [%s] -> dropping...' % (message['target'],))
@@ -284,7 +492,7 @@ class Flow:
       com = self.componentLibrary[message['target']]
       MESSAGE_STATIC['id'] = message['id']
       MESSAGE_STATIC['body'] = com['html']
-      client.send(self.formatMessage(MESSAGE_STATIC))
+      client.send(self.formatMessage(MESSAGE_STATIC, [client]))
     elif message['type'] == 'options':
       if message['target'] not in self.instances:
         logging.warn('Options target not existing [%s] -> dropping...' % (message['target'],))
@@ -319,23 +527,87 @@ class Flow:
       'options' in com.events and com.emit('options', com.options, old_options)
 
       # TODO: Refresh connections
-      self.save()
+      self.designerComponents[com.id] = com.save()
+      self.record({ 'op': 'put', 'com': self.designerComponents[com.id] })
     elif message['type'] == 'clearerrors':
       for ist in self.instances:
         self.instances[ist].errors = {}
 
-      self.save()
       self.sendMessage(MESSAGE_CLEARERRORS)
+    elif message['type'] == 'upload':
+      # Next binary message of the client is streamed to the target
+      if message['target'] not in self.instances:
+        logging.warn('Upload target not existing [%s] -> dropping...' % (message['target'],))
+        return
+      self.uploads[client] = self.instances[message['target']]
     elif message['type'] == 'install':
       # New component
       if 'body' not in message:
         message['body'] = None
       self.install(message['filename'], message['body'])
+    elif message['type'] == 'profile':
+      self.profile(client, message)
     else:
       logging.warn('Message type unknown [%s] -> dropping...' % (message['type'],))
 
+  def onUpload(self, chunk, fin, client):
+    if client not in self.uploads:
+      logging.warn('Binary message without upload target, dropping...')
+      return
+
+    ist = self.uploads[client]
+    if fin:
+      del self.uploads[client]
+
+    if 'upload' not in ist.events:
+      logging.warn('Upload not handled by component [%s] -> dropping...' % (ist.id,))
+      return
+    ist.emit('upload', chunk, fin)
+
+  def profile(self, client, message):
+    # Starts or stops a sampling profiler session, its report is only sent to the requesting client
+    if message.get('action') == 'stop':
+      if self.profiler is not None:
+        self.profiler.stop()
+      return
+
+    scope = message.get('scope', 'process')
+    target = message.get('target')
+    error = None
+    if scope not in Profiler.SCOPES:
+      error = 'Unknown profiling scope [%s]' % (scope,)
+    elif scope == 'component' and target not in self.instances:
+      error = 'Component to profile not existing [%s]' % (target,)
+    elif scope == 'tab' and not any(ist.tab == target for ist in list(self.instances.values())):
+      error = 'No component in the tab to profile [%s]' % (target,)
+    elif self.profiler is not None and self.profiler.is_alive():
+      error = 'Profiling already running'
+    if error is not None:
+      logging.warn('%s -> dropping...' % (error,))
+      client.send(self.formatMessage(dict(MESSAGE_PROFILE, status='error', body=error), [client]))
+      return
+
+    self.profiler = Profiler(self, client, scope, target,
+      duration=float(message.get('duration', Profiler.DURATION)),
+      interval=max(0.001, float(message.get('interval', Profiler.INTERVAL))),
+      collapsed=bool(message.get('collapsed', False)))
+    self.profiler.start()
+    client.send(self.formatMessage(dict(MESSAGE_PROFILE, status='started', scope=scope, target=target, duration=self.profiler.duration), [client]))
+
+  def sendProfile(self, profiler):
+    # Report of a finished profiler session, with the stacks for the flame graphs in .flow/ when asked
+    message = dict(MESSAGE_PROFILE, status='done', body=profiler.report())
+    if profiler.collapsed:
+      path = os.path.join(self.appPath, 'profile-%s.folded' % (time.strftime('%Y%m%d-%H%M%S'),))
+      try:
+        profiler.writeCollapsed(path)
+        message['file'] = path
+      except OSError as e:
+        logging.error('Profile write failed: %s' % (str(e),))
+    profiler.client.send(self.formatMessage(message, [profiler.client]))
+
   def install(self, filename, body):
-    componentsPath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'components/')
+    componentsPath = self.componentsPath
 
     # Check if the filename is an URL
     if filename[:6] == 'http:/' or filename == 'https:':
@@ -361,9 +633,7 @@ class Flow:
 
     # Check if exports of the file contains install func
     try:
-      spec = importlib.util.spec_from_file_location('components', filepath)
-      mod = importlib.util.module_from_spec(spec)
-      spec.loader.exec_module(mod)
+      mod = self.importModule(filepath)
 
       if not hasattr(mod, 'EXPORTS') or 'install' not in mod.EXPORTS:
         logging.warn('Imported module not in the right format. No install function...')
@@ -376,11 +646,13 @@ class Flow:
         return
 
       self.selfRegisterComponent(mod, filename)
+      self.manifest.save()
 
       if saved:
         os.remove(filepath + '-save')
 
-      self.sendMessage(MESSAGE_DESIGNER)
+      data = MESSAGE_DESIGNER['database'][self.databaseIndex[mod.EXPORTS['id']]]
+      self.sendDesignerPatch([{ 'op': 'database', 'component': data }])
     except Exception as e:
       logging.error('Error while importing file [%s]: %s' % (filename, e))
       MESSAGE_ERROR['body'] = str(e)
@@ -434,7 +706,7 @@ class Flow:
       logging.info('----- End refreshing -----')
 
       # Save designer
-      self.save()
+      self.record({ 'op': 'variables', 'body': body })
       self.sendMessage({
         'type': 'variables-saved'
       })
@@ -447,6 +719,7 @@ class Flow:
   def applyChanges(self, body):
     componentsToAdd = []
     componentsToRemove = []
+    changes = []
     for change in body:
       if 'type' not in change:
         logging.warn('No type for change, dropping...')
@@ -461,18 +734,23 @@ class Flow:
       elif type == 'tabs':
         self.tabs = change['tabs']
         MESSAGE_DESIGNER['tabs'] = change['tabs']
+        changes.append({ 'op': 'tabs', 'tabs': self.tabs })
       elif type == 'mov':
         target = change['com']['id']
         if target not in self.instances:
           logging.warn('Component to move not in instances [%s] -> dropping...' % (target,))
           continue
         self.instances[target].setPos(change['com']['x'], change['com']['y'])
+        self.designerComponents[target] = self.instances[target].save()
+        changes.append({ 'op': 'mov', 'id': target, 'x': change['com']['x'], 'y': change['com']['y'] })
       elif type == 'conn':
         if change['id'] not in self.instances:
           logging.warn('New connection target not in instances [%s] -> dropping...' % (change['id'],))
           continue
 
         self.instances[change['id']].updateConnections(change['conn'])
+        self.designerComponents[change['id']] = self.instances[change['id']].save()
+        changes.append({ 'op': 'conn', 'id': change['id'], 'conn': change['conn'] })
       else:
         logging.warn('Type not handled for change [%s] -> dropping...' % (type,))
 
@@ -481,22 +759,29 @@ class Flow:
       if id not in self.instances:
         logging.warn('ID to remove not in instances [%s] -> dropping...' % (id,))
         continue
+      self.scheduler.remove(self.instances[id])
       del self.instances[id]
+      self.designerComponents.pop(id, None)
+      changes.append({ 'op': 'rem', 'id': id })
 
     for com in componentsToAdd:
-      self.addInstance(com)
+      newIst = self.addInstance(com, compile=False)
+      if newIst is not None:
+        self.designerComponents[newIst.id] = newIst.save()
+        changes.append({ 'op': 'add', 'com': self.designerComponents[newIst.id] })
+
+    if len(componentsToRemove) or len(componentsToAdd):
+      self.compileRoutes()
 
     # Save after changes
-    self.save()
+    self.recordChanges(changes)
 
-    # Redo MESSAGE_DESIGNER['components']
-    MESSAGE_DESIGNER['components'] = []
-    for instID in self.instances:
-      MESSAGE_DESIGNER['components'].append(self.instances[instID].save())
-    # Send to all other users
-    self.sendMessage(MESSAGE_DESIGNER)
+    # Send the changes to all other users
+    if len(changes):
+      self.sendDesignerPatch(changes)
 
-  def addInstance(self, com):
+  def addInstance(self, com, compile=True):
+    # compile: update the routes to and from the new instance, else compileRoutes() is left to the caller
     comID = com['id']
     if comID not in self.instances:
       # New instance
@@ -506,44 +791,57 @@ class Flow:
         return None
       libraryOpts = self.componentLibrary[component]
       newInst = Component(com, libraryOpts, self)
-      if 'fn' in libraryOpts or 'install' in libraryOpts:
-        libraryOpts['fn'](newInst)
+      installFN = self.importComponent(component)
+      if installFN is not None:
+        installFN(newInst)
       self.instances[comID] = newInst
+      if compile:
+        sources = [ist for ist in self.instances.values() if any(t['id'] == comID for targets in ist.connections.values() for t in targets)]
+        self.compileRoutes(sources + [newInst])
 
       return newInst
     else:
         logging.warn('Component already existing [%s] -> dropping...' % (comID,))
         return None
 
-  def updateTraffic(self, id, type, count, index=None, size=1):
-    if not id in self.traffic:
-      self.traffic[id] = {
-        'input': 0,
-        'output': 0,
-        'pending': 0,
-        'duration': 0,
-        'ci': 0,
-        'co': 0,
-        'ni': 0,
-        'no': 0
-      }
-
-    if type == 'pending' or type == 'duration' or type == 'ci' or type == 'co':
-      self.traffic[id][type] = count
+  def compileRoutes(self, components=None):
+    # Routing index of the components (all by default) from their connections: direct references to the
+    # targets, without the unknown components and the disabled inputs, so that sending only iterates tuples
+    disabled = {}
+    for ist in (components if components is not None else list(self.instances.values())):
+      routes = {}
+      broadcast = []
+      # The input traffic of a target is counted once per send, through one output or through all of them
+      broadcastListed = set()
+      for conn in ist.connections:
+        targets = []
+        broadcastTargets = []
+        listed = set()
+        for t in ist.connections[conn]:
+          target = self.instances.get(t['id'])
+          if target is None:
+            logging.warn('Connection to unknown component [%s] -> pruning...' % (t['id'],))
+            continue
+          if target.id not in disabled:
+            disabled[target.id] = set(target.disabledio['input'])
+          if t['index'] in disabled[target.id]:
+            continue
+          targets.append((target, t['index'], target.id not in listed))
+          broadcastTargets.append((target, t['index'], target.id not in broadcastListed))
+          listed.add(target.id)
+          broadcastListed.add(target.id)
+
+        routes[str(conn)] = tuple(targets)
+        if str(conn) != '99':
+          broadcast.append((str(conn), tuple(broadcastTargets)))
+      ist.routes = routes
+      ist.broadcast = tuple(broadcast)
+      ist.broadcastShared = sum(len(targets) for conn, targets in broadcast) > 1
+
+  def updateTraffic(self, id, type, count, index=None, size=1, messages=1):
+    if type in TrafficStore.GAUGES:
+      self.traffic.set(id, type, count)
     elif type == 'output':
-      self.traffic[id][type] += size # 1
-      self.traffic[id]['no'] += 1
-
-      if index is not None:
-        k = 'no' + str(index)
-        if k not in self.traffic[id]:
-          self.traffic[id][k] = 0
-        self.traffic[id][k] += 1
-
-      self.traffic['count'] += 1
-    elif type == 'input':
-      if count is not True:
-        self.traffic[id][type] += size # 1
-      self.traffic[id]['ni'] += 1
+      self.traffic.output(id, index, size, messages)
     else:
-      self.traffic[id][type] += 1
+      self.traffic.add(id, type, size if count is not True else 0, messages)
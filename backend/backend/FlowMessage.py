@@ -0,0 +1,63 @@
+from websocket.WSMessage import WSMessage
+from .Protocol import Protocol
+from .Payload import Envelope
+import json
+
+class FlowMessage(WSMessage):
+  # Messages only showing the latest state: a newer one replaces the queued one for slow clients
+  COALESCED = {
+    'traffic': lambda obj: 'traffic',
+    'designer': lambda obj: 'designer',
+    'online': lambda obj: 'online',
+    'status': lambda obj: ('status', obj.get('target')),
+    'errors': lambda obj: ('errors', obj.get('id'))
+  }
+
+  def __init__(self, encoder, obj, legacy=None, binary=False):
+    super().__init__(encoder, 0x1, b'')
+
+    # Serialize now: MESSAGE_* objects are shared and can change before the message is sent
+    self.text = FlowMessage.serialize(obj)
+    # Message sent instead to the clients of the legacy protocol
+    self.legacyText = FlowMessage.serialize(legacy) if legacy is not None else None
+
+    if obj.get('type') in FlowMessage.COALESCED:
+      self.key = FlowMessage.COALESCED[obj['type']](obj)
+
+    # Payloads by protocol, encoded once for all the clients using it
+    self.payloads = {}
+    # Packed now from the object for the binary clients: later, only the text still has the state of the message
+    if binary:
+      self.payloads[Protocol.BINARY] = FlowMessage.pack(obj, self.text)
+
+  @staticmethod
+  def serialize(obj):
+    try:
+      return json.dumps(obj, default=FlowMessage.plain)
+    except Exception as e:
+      obj['body'] = str(obj['body'])
+      return json.dumps(obj)
+
+  @staticmethod
+  def pack(obj, text):
+    try:
+      return Protocol.pack(obj, FlowMessage.plain)
+    except Exception as e:
+      # Same content as the text, with the body that could not be serialized
+      return Protocol.encode(text, Protocol.BINARY)
+
+  @staticmethod
+  def plain(value):
+    # Read-only views of the delivered data
+    value = Envelope.plain(value)
+    if isinstance(value, (dict, list)):
+      return value
+    raise TypeError('Not serializable: %s' % (type(value).__name__,))
+
+  def payload(self, client):
+    protocol = client.protocol if client.protocol is not None else Protocol.QUOTED
+    if protocol not in self.payloads:
+      text = self.legacyText if protocol == Protocol.QUOTED and self.legacyText is not None else self.text
+      self.payloads[protocol] = Protocol.encode(text, protocol)
+    opcode, data = self.payloads[protocol]
+    return protocol, opcode, data
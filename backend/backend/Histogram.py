@@ -0,0 +1,93 @@
+from array import array
+import math
+
+class Histogram:
+  # Durations in nanoseconds counted in log-scaled buckets: SUBBUCKETS buckets per power of 2 from 2 ** MIN_BITS ns
+  # (about 1 microsecond), so a percentile is known within 1 / SUBBUCKETS of its value, in a fixed memory.
+  # Not locked: the durations of a component are recorded by the worker processing it.
+  MIN_BITS = 10
+  MIN = 2 ** MIN_BITS * 1e-9
+  SUBBUCKETS = 4
+  # Powers of 2 after MIN, the last bucket counts the longer durations (from MIN * 2 ** 30, about 18 minutes)
+  OCTAVES = 30
+  LAST = OCTAVES * SUBBUCKETS
+
+  def __init__(self):
+    self.counts = array('q', bytes(8 * (Histogram.LAST + 1)))
+    self.count = 0
+    # Sum of the durations, in nanoseconds
+    self.sum = 0
+
+  @staticmethod
+  def bucket(ns):
+    # Integer arithmetic only: the power of 2 from the bit length, the sub-bucket from the next 2 bits
+    bits = ns.bit_length() - Histogram.MIN_BITS
+    if bits <= 0:
+      return 0
+    bucket = (bits - 1) * Histogram.SUBBUCKETS + ((ns >> (bits + Histogram.MIN_BITS - 3)) & 3)
+    return bucket if bucket < Histogram.LAST else Histogram.LAST
+
+  @staticmethod
+  def upper(bucket):
+    # Upper bound of the durations of a bucket, in seconds
+    if bucket >= Histogram.LAST:
+      return math.inf
+    octave, sub = divmod(bucket + 1, Histogram.SUBBUCKETS)
+    return Histogram.MIN * (2 ** octave) * (1 + sub / Histogram.SUBBUCKETS)
+
+  def record(self, ns):
+    # bucket() inlined with MIN_BITS = 10 and SUBBUCKETS = 4, called for each handled message
+    bits = ns.bit_length() - 10
+    if bits > 0:
+      bucket = (bits << 2) - 4 + ((ns >> (bits + 7)) & 3)
+      self.counts[bucket if bucket < 120 else 120] += 1
+    else:
+      self.counts[0] += 1
+    self.count += 1
+    self.sum += ns
+
+  def copy(self):
+    histogram = Histogram()
+    histogram.counts = array('q', self.counts)
+    histogram.count = sum(histogram.counts)
+    histogram.sum = self.sum
+    return histogram
+
+  def since(self, previous):
+    # Durations recorded after a copy of the histogram
+    histogram = Histogram()
+    histogram.counts = array('q', (count - old for count, old in zip(self.counts, previous.counts)))
+    histogram.count = sum(histogram.counts)
+    histogram.sum = self.sum - previous.sum
+    return histogram
+
+  def merge(self, other):
+    for bucket, count in enumerate(other.counts):
+      if count:
+        self.counts[bucket] += count
+    self.count += other.count
+    self.sum += other.sum
+
+  def percentile(self, p):
+    # Upper bound of the bucket of the p-th percentile (p from 0 to 100) in seconds, 0 without durations
+    if self.count == 0:
+      return 0
+    rank = max(1, math.ceil(self.count * p / 100))
+    seen = 0
+    for bucket, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank:
+        return Histogram.upper(bucket)
+    return math.inf
+
+  def cumulative(self, bounds):
+    # Number of durations lower than or equal to each bound (seconds), for the cumulative buckets of an exposition format
+    counts = []
+    seen = 0
+    bucket = 0
+    for bound in bounds:
+      while bucket < len(self.counts) and Histogram.upper(bucket) <= bound:
+        seen += self.counts[bucket]
+        bucket += 1
+      counts.append(seen)
+    return counts
@@ -0,0 +1,92 @@
+from threading import Thread
+import logging
+import queue
+import json
+import os
+
+class Journal(Thread):
+  # Changes of the flow appended to a journal file by a background thread.
+  # Records waiting while the file is synced are written together (group commit).
+  # A snapshot replaces the saved files atomically and starts an empty journal.
+  def __init__(self, path):
+    super().__init__(daemon=True)
+    self.path = path
+    self.queue = queue.Queue()
+    # Records appended since the last snapshot
+    self.records = 0
+
+  @staticmethod
+  def replay(path):
+    records = []
+    if not os.path.isfile(path):
+      return records
+    with open(path, 'r') as file:
+      for line in file:
+        try:
+          records.append(json.loads(line))
+        except ValueError:
+          # Last record torn by a crash
+          logging.warn('Invalid journal record, ignoring the end of the journal...')
+          break
+    return records
+
+  @staticmethod
+  def writeAtomic(path, text):
+    with open(path + '.tmp', 'w') as file:
+      file.write(text)
+      file.flush()
+      os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+
+  def append(self, record):
+    # Serialized now, the record can change once queued
+    self.records += 1
+    self.queue.put(('record', json.dumps(record) + '\n'))
+
+  def snapshot(self, files):
+    # files: text of each saved file by path, serialized by the caller
+    self.records = 0
+    self.queue.put(('snapshot', files))
+
+  def close(self):
+    self.queue.put(('close', None))
+    self.join()
+
+  def run(self):
+    file = open(self.path, 'a')
+    closed = False
+    while not closed:
+      batch = [self.queue.get()]
+      while True:
+        try:
+          batch.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+
+      lines = []
+      for kind, data in batch:
+        if kind == 'record':
+          lines.append(data)
+        elif kind == 'snapshot':
+          # Records before the snapshot are part of it
+          try:
+            for path in data:
+              Journal.writeAtomic(path, data[path])
+            file.close()
+            Journal.writeAtomic(self.path, '')
+            lines = []
+          except OSError as e:
+            logging.error('Snapshot write failed: %s' % (str(e),))
+          file.close()
+          file = open(self.path, 'a')
+        else:
+          closed = True
+
+      if len(lines):
+        try:
+          file.write(''.join(lines))
+          file.flush()
+          os.fsync(file.fileno())
+        except OSError as e:
+          logging.error('Journal write failed: %s' % (str(e),))
+    file.close()
@@ -31,3 +31,12 @@ MESSAGE_ERROR = {
 MESSAGE_CLEARERRORS = {
   'type': 'clearerrors'
 }
+MESSAGE_PROTOCOL = {
+  'type': 'protocol'
+}
+MESSAGE_DESIGNER_PATCH = {
+  'type': 'designer-patch'
+}
+MESSAGE_PROFILE = {
+  'type': 'profile'
+}
@@ -0,0 +1,104 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .Histogram import Histogram
+from .Component import Component
+from threading import Thread
+import logging
+
+class MetricsHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    try:
+      body = self.server.metrics.exposition().encode('UTF-8')
+    except Exception as e:
+      logging.error('Metrics exposition failed: %s' % (str(e),))
+      self.send_error(500)
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', MetricsServer.CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    logging.websocket('Metrics request:', format % args)
+
+class MetricsServer(Thread):
+  # Metrics of the flow and of the WebSocket server in the Prometheus text format, on GET /metrics.
+  # Counters are taken since the start, they are never reset by the traffic messages.
+  CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+  # Upper bounds (seconds) of the buckets of the handler durations, powers of 4 from Histogram.MIN
+  LATENCY_BOUNDS = [Histogram.MIN * 4 ** i for i in range(14)]
+
+  def __init__(self, flow, server, host='127.0.0.1', port=9100):
+    super().__init__(daemon=True)
+    self.flow = flow
+    self.server = server
+    self.http = ThreadingHTTPServer((host, port), MetricsHandler)
+    self.http.daemon_threads = True
+    self.http.metrics = self
+
+  @staticmethod
+  def labels(**labels):
+    escaped = ['%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels.items()]
+    return '{' + ','.join(escaped) + '}'
+
+  def exposition(self):
+    lines = []
+    def family(name, type, help, samples):
+      lines.append('# HELP %s %s' % (name, help))
+      lines.append('# TYPE %s %s' % (name, type))
+      for suffix, labels, value in samples:
+        lines.append('%s%s %s' % (name + suffix, labels, repr(float(value)) if isinstance(value, float) else value))
+
+    instances = dict(self.flow.instances)
+    components, edges = self.flow.traffic.totals()
+    def component(id):
+      ist = instances.get(id)
+      return MetricsServer.labels(component=id, name=ist.name if ist is not None else '', tab=ist.tab if ist is not None else '')
+
+    family('flow_component_input_messages_total', 'counter', 'Messages received by the component.', [('', component(id), item['ni']) for id, item in components.items()])
+    family('flow_component_input_bytes_total', 'counter', 'Bytes received by the component.', [('', component(id), item['input']) for id, item in components.items()])
+    family('flow_component_output_messages_total', 'counter', 'Messages sent by the component.', [('', component(id), item['no']) for id, item in components.items()])
+    family('flow_component_output_bytes_total', 'counter', 'Bytes sent by the component.', [('', component(id), item['output']) for id, item in components.items()])
+    family('flow_component_dropped_messages_total', 'counter', 'Messages dropped by the inbox of the component.', [('', component(id), item['dropped']) for id, item in components.items()])
+    family('flow_component_queue_depth', 'gauge', 'Deliveries waiting in the inbox of the component.', [('', component(id), int(item['pending'])) for id, item in components.items()])
+    family('flow_component_errors_total', 'counter', 'Errors reported by the component.', [('', component(id), sum(error['count'] for error in list(ist.errors.values()))) for id, ist in instances.items()])
+
+    samples = []
+    for id, ist in instances.items():
+      histogram = ist.latency
+      for bound, count in zip(MetricsServer.LATENCY_BOUNDS, histogram.cumulative(MetricsServer.LATENCY_BOUNDS)):
+        samples.append(('_bucket', MetricsServer.labels(component=id, name=ist.name, tab=ist.tab, le='%g' % bound), count))
+      samples.append(('_bucket', MetricsServer.labels(component=id, name=ist.name, tab=ist.tab, le='+Inf'), histogram.count))
+      samples.append(('_sum', component(id), histogram.sum / 1e9))
+      samples.append(('_count', component(id), histogram.count))
+    family('flow_component_handler_seconds', 'histogram', 'Duration of the data handlers of the component.', samples)
+    family('flow_component_cpu_seconds_total', 'counter', 'Thread CPU time of the data handlers of the component, estimated from sampled calls.', [('', component(id), ist.cpuTime.sum * Component.CPU_SAMPLE / 1e9) for id, ist in instances.items()])
+
+    family('flow_edge_messages_total', 'counter', 'Messages sent through a connection.', [('', MetricsServer.labels(source=key[0], output=key[1], target=key[2], input=key[3]), value[0]) for key, value in edges.items()])
+    family('flow_edge_bytes_total', 'counter', 'Bytes sent through a connection.', [('', MetricsServer.labels(source=key[0], output=key[1], target=key[2], input=key[3]), value[1]) for key, value in edges.items()])
+    family('flow_ongoing_deliveries', 'gauge', 'Deliveries queued or being processed.', [('', '', self.flow.onGoing)])
+
+    family('websocket_clients', 'gauge', 'Connected WebSocket clients.', [('', '', len(self.server.clients))])
+    family('websocket_broadcast_bytes_total', 'counter', 'Payload bytes multicast to the clients.', [('', '', self.server.broadcastBytes)])
+    family('websocket_dropped_frames_total', 'counter', 'Messages dropped by the send queues of slow clients.', [('', '', self.server.dropped())])
+
+    process = self.flow.process
+    cpu = process.cpu_times()
+    family('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.', [('', '', process.memory_info().rss)])
+    family('process_cpu_seconds_total', 'counter', 'User and system CPU time in seconds.', [('', '', cpu.user + cpu.system)])
+    family('process_threads', 'gauge', 'Threads of the process.', [('', '', process.num_threads())])
+
+    lines.append('')
+    return '\n'.join(lines)
+
+  def run(self):
+    logging.info('Metrics served on http://%s:%d/metrics' % self.http.server_address[:2])
+    self.http.serve_forever()
+
+  def stop(self):
+    self.http.shutdown()
+    self.http.server_close()
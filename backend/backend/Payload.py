@@ -1,16 +1,140 @@
+from collections.abc import Sequence
+from types import MappingProxyType
+import copy
 import sys
 
+class PayloadSize:
+  # Strategies measuring the size of payload data, in bytes
+
+  # Items measured in a container, the others are estimated from them
+  SAMPLE = 16
+  # Nested containers measured
+  DEPTH = 3
+
+  @staticmethod
+  def shallow(data):
+    return sys.getsizeof(data)
+
+  @staticmethod
+  def sampled(data, depth=DEPTH):
+    # Exact length of bytes, strings and buffers, sampled deep size of containers
+    if isinstance(data, (bytes, bytearray)):
+      return len(data)
+    if isinstance(data, memoryview):
+      return data.nbytes
+    if isinstance(data, str):
+      return len(data)
+    if depth == 0 or not isinstance(data, (dict, list, tuple, set, frozenset, MappingProxyType, ListView)):
+      return sys.getsizeof(data)
+
+    if isinstance(data, ListView):
+      data = data.items
+    items = list(data.items()) if isinstance(data, (dict, MappingProxyType)) else data
+    count = len(items)
+    if count == 0:
+      return sys.getsizeof(data)
+    if not isinstance(items, (list, tuple)):
+      items = list(items)
+    step = max(1, count // PayloadSize.SAMPLE)
+    sample = items[::step][:PayloadSize.SAMPLE]
+    size = sum(PayloadSize.sampled(item, depth - 1) for item in sample)
+    return sys.getsizeof(data) + size * count // len(sample)
+
 class Payload:
+  __slots__ = ('id', 'data', 'fromID', 'toID', 'fromIdx', 'toIdx', 'size')
+
   counter = 0
-  def __init__(self, data, istID, clone=None):
+  # Strategy measuring the data, see PayloadSize
+  measure = staticmethod(PayloadSize.sampled)
+
+  def __init__(self, data, istID, clone=None, size=None):
     self.id = clone.id if clone is not None else Payload.counter
-    self.data = data
+    # A view received from another component is sent again as plain data, that can be copied and pickled
+    self.data = Envelope.unwrap(data)
     self.fromID = istID
     self.toID = None
     self.fromIdx = None
     self.toIdx = None
+    # Declared by the producer, or else measured once when first needed
+    self.size = size
 
     Payload.counter += 1
 
   def getSize(self):
-    return sys.getsizeof(self.data)
+    if self.size is None:
+      self.size = Payload.measure(self.data)
+    return self.size
+
+class ListView(Sequence):
+  # Read-only view of a list, without copy
+  __slots__ = ('items',)
+
+  def __init__(self, items):
+    self.items = items
+
+  def __getitem__(self, index):
+    return self.items[index]
+
+  def __len__(self):
+    return len(self.items)
+
+  def __eq__(self, other):
+    return list(self.items) == list(other) if isinstance(other, (list, tuple, ListView)) else False
+
+  def __repr__(self):
+    return 'ListView(%r)' % (self.items,)
+
+class Envelope:
+  # Delivery of a payload to one target. The routing infos belong to the delivery, the data is shared
+  # by reference: when several targets get the same data, they get a read-only view and copy() it to change it.
+  __slots__ = ('id', 'raw', 'fromID', 'toID', 'fromIdx', 'toIdx', 'shared', 'size')
+
+  def __init__(self, payload, toID, fromIdx, toIdx, shared=False):
+    self.id = payload.id
+    self.raw = payload.raw if isinstance(payload, Envelope) else payload.data
+    self.fromID = payload.fromID
+    self.toID = toID
+    self.fromIdx = fromIdx
+    self.toIdx = toIdx
+    self.shared = shared
+    self.size = payload.size
+
+  @staticmethod
+  def view(data):
+    if isinstance(data, dict):
+      return MappingProxyType(data)
+    if isinstance(data, list):
+      return ListView(data)
+    if isinstance(data, bytearray):
+      return memoryview(data).toreadonly()
+    return data
+
+  @staticmethod
+  def plain(data):
+    # Mutable copy of data or of its view
+    if isinstance(data, MappingProxyType):
+      return dict(data)
+    if isinstance(data, ListView):
+      return list(data.items)
+    if isinstance(data, memoryview):
+      return bytearray(data)
+    return copy.copy(data)
+
+  @staticmethod
+  def unwrap(data):
+    # Plain data of a view, data itself otherwise
+    if isinstance(data, (MappingProxyType, ListView)) or (isinstance(data, memoryview) and data.readonly):
+      return Envelope.plain(data)
+    return data
+
+  @property
+  def data(self):
+    return Envelope.view(self.raw) if self.shared else self.raw
+
+  def copy(self, deep=False):
+    return copy.deepcopy(Envelope.unwrap(self.raw)) if deep else Envelope.plain(self.raw)
+
+  def getSize(self):
+    if self.size is None:
+      self.size = Payload.measure(self.raw)
+    return self.size
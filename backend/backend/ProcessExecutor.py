@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+import multiprocessing
+import importlib.util
+import zlib
+import time
+import os
+
+# Components created in the worker process, by module path and instance id
+proxies = {}
+
+class ProxyComponent:
+  # Stands for a Component in a worker process: the install function registers its handlers on it,
+  # and the calls of the handlers are recorded to be replayed by the Component in the flow process
+  def __init__(self, attrs):
+    self.events = {}
+    self.custom = {}
+    self.calls = []
+    self.update(attrs)
+
+  def update(self, attrs):
+    for key in attrs:
+      setattr(self, key, attrs[key])
+
+  def on(self, eventName, func):
+    self.events[eventName] = func
+
+  def emit(self, eventName, *args):
+    if eventName in self.events:
+      self.events[eventName](self, args)
+
+  def send(self, data, index=None, batch=False, size=None):
+    self.calls.append(('send', (data, index, batch, size)))
+
+  def throw(self, data):
+    self.send(data, 99)
+
+  def status(self, text='', color='gray'):
+    self.state['text'] = text
+    self.state['color'] = color
+    self.calls.append(('status', (text, color)))
+
+  def debug(self, data, style=None, group=None, id=None):
+    self.calls.append(('debug', (data, style, group, id)))
+
+  def error(self, error, parent=None):
+    self.calls.append(('error', (error, parent if isinstance(parent, str) else None)))
+
+def run(filepath, attrs, eventName, argsList):
+  # Calls recorded for each event, or the exception raised by the handler, with the wall and CPU
+  # nanoseconds of the handler
+  key = (filepath, attrs['id'])
+  if key not in proxies:
+    spec = importlib.util.spec_from_file_location('components', filepath)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    proxy = ProxyComponent(attrs)
+    mod.EXPORTS['install'](proxy)
+    proxies[key] = proxy
+  else:
+    proxies[key].update(attrs)
+
+  proxy = proxies[key]
+  results = []
+  for args in argsList:
+    proxy.calls = []
+    start = time.perf_counter_ns()
+    cpu = time.thread_time_ns()
+    try:
+      proxy.emit(eventName, *args)
+      calls = proxy.calls
+    except Exception as e:
+      calls = RuntimeError(str(e))
+    results.append((calls, time.perf_counter_ns() - start, time.thread_time_ns() - cpu))
+  return results
+
+class ProcessExecutor:
+  # Runs the handlers of the components with the 'process' executor in worker processes.
+  # A component always runs in the same worker, where its proxy keeps the state of its handlers.
+  def __init__(self, processes=None):
+    self.processes = processes if processes else os.cpu_count()
+    # One single process pool by worker, started when first needed
+    self.pools = [None] * self.processes
+    self.lock = Lock()
+
+  def index(self, component):
+    return zlib.crc32(component.id.encode('UTF-8')) % self.processes
+
+  def pool(self, index):
+    with self.lock:
+      if self.pools[index] is None:
+        # Worker processes are started, not forked from the threads of the flow
+        self.pools[index] = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+      return self.pools[index]
+
+  def map(self, component, eventName, argsList):
+    # Results of run() for each event in order, or the exception of the worker for all of them (not timed)
+    attrs = {
+      'id': component.id,
+      'name': component.name,
+      'options': component.options,
+      'state': component.state,
+      'variables': component.flow.variables
+    }
+    index = self.index(component)
+    pool = self.pool(index)
+    try:
+      return pool.submit(run, component.filepath(), attrs, eventName, argsList).result()
+    except BrokenProcessPool as e:
+      # The worker died, a new one is started for the next calls
+      with self.lock:
+        if self.pools[index] is pool:
+          self.pools[index] = None
+      return [(e, 0, None)] * len(argsList)
+    except Exception as e:
+      return [(e, 0, None)] * len(argsList)
+
+  def record(self, component, elapsed, results):
+    # Durations of the events like Component.emit records them: the handler time measured in the worker,
+    # plus an equal share of the time of the batch out of the handlers (transfer to and from the worker)
+    overhead = max(0, elapsed - sum(wall for calls, wall, cpu in results)) // len(results)
+    for calls, wall, cpu in results:
+      component.latency.record(wall + overhead)
+      if cpu is not None:
+        component.cpuTime.record(cpu)
+
+  def replay(self, component, result):
+    calls = result[0]
+    if isinstance(calls, Exception):
+      raise calls
+    for name, args in calls:
+      getattr(component, name)(*args)
+
+  def shutdown(self):
+    for pool in self.pools:
+      if pool is not None:
+        pool.shutdown(wait=False)
@@ -0,0 +1,122 @@
+from threading import Thread, Event
+from collections import Counter
+from .Component import Component
+import logging
+import time
+import sys
+import os
+
+class Profiler(Thread):
+  # Sampling profiler: the stacks of all the threads are read every interval, nothing runs in the profiled threads.
+  # A sample belongs to the component whose handler is running in the thread, found in the stack from the
+  # frames of Component.emit, so that a session can be scoped to one component or one tab.
+  SCOPES = ('process', 'tab', 'component')
+
+  INTERVAL = 0.01
+  DURATION = 10
+  MAX_DURATION = 300
+  # Functions listed in the report
+  TOP = 20
+  # Leaf functions of the threads waiting for work, not counted in the process scope: the reader threads of the
+  # clients block in recvInto, and the main thread of WSMain in the input() of its module
+  IDLE = {('threading.py', 'wait'), ('selectors.py', 'select'), ('queue.py', 'get'), ('socket.py', 'accept'), ('WSSendQueue.py', 'get'),
+    ('WSClient.py', 'recvInto'), ('WSMain.py', '<module>')}
+
+  def __init__(self, flow, client, scope='process', target=None, duration=DURATION, interval=INTERVAL, collapsed=False):
+    super().__init__(daemon=True)
+    self.flow = flow
+    self.client = client
+    self.scope = scope
+    self.target = target
+    self.duration = min(duration, Profiler.MAX_DURATION)
+    self.interval = interval
+    self.collapsed = collapsed
+    self.stopped = Event()
+
+    self.samples = 0
+    # Samples by stack (tuple of functions from the root), and by component id
+    self.stacks = Counter()
+    self.components = Counter()
+
+  @staticmethod
+  def label(code):
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+  def sample(self):
+    for ident, frame in sys._current_frames().items():
+      if ident == self.ident:
+        continue
+      leaf = frame.f_code
+      stack = []
+      component = None
+      while frame is not None:
+        if component is None and frame.f_code is Component.emit.__code__:
+          component = frame.f_locals.get('self')
+        stack.append(frame.f_code)
+        frame = frame.f_back
+
+      if self.scope == 'process':
+        if component is None and (os.path.basename(leaf.co_filename), leaf.co_name) in Profiler.IDLE:
+          continue
+      elif component is None or (self.scope == 'component' and component.id != self.target) or (self.scope == 'tab' and component.tab != self.target):
+        continue
+
+      self.samples += 1
+      self.stacks[tuple(reversed(stack))] += 1
+      if component is not None:
+        self.components[component.id] += 1
+
+  def run(self):
+    deadline = time.monotonic() + self.duration
+    while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+      try:
+        self.sample()
+      except Exception as e:
+        logging.error('Profiling sample failed: %s' % (str(e),))
+    self.flow.sendProfile(self)
+
+  def stop(self):
+    self.stopped.set()
+
+  def report(self):
+    # Functions by own and total samples, and samples by component
+    own = Counter()
+    total = Counter()
+    for stack, count in self.stacks.items():
+      own[stack[-1]] += count
+      for code in set(stack):
+        total[code] += count
+
+    top = [{
+      'function': code.co_name,
+      'file': code.co_filename,
+      'line': code.co_firstlineno,
+      'self': own[code],
+      'total': total[code]
+    } for code, count in own.most_common(Profiler.TOP)]
+
+    components = []
+    for id, count in self.components.most_common():
+      ist = self.flow.instances.get(id)
+      components.append({
+        'id': id,
+        'name': ist.name if ist is not None else '',
+        'tab': ist.tab if ist is not None else '',
+        'samples': count,
+        'share': round(count * 100 / max(self.samples, 1), 2)
+      })
+
+    return {
+      'scope': self.scope,
+      'target': self.target,
+      'interval': self.interval,
+      'samples': self.samples,
+      'top': top,
+      'components': components
+    }
+
+  def writeCollapsed(self, path):
+    # One line by stack for the flame graph tools: root;...;leaf count
+    with open(path, 'w') as file:
+      for stack, count in self.stacks.items():
+        file.write('%s %d\n' % (';'.join(Profiler.label(code) for code in stack), count))
@@ -0,0 +1,51 @@
+import urllib.parse
+import logging
+import json
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+class Protocol:
+  # Wire formats, chosen by the client with the 'protocol' parameter of the connection URL
+  QUOTED = 'quoted' # URL quoted JSON in text frames (legacy, default)
+  JSON = 'json'     # UTF-8 JSON in text frames
+  BINARY = 'binary' # MessagePack in binary frames
+
+  PROTOCOLS = (QUOTED, JSON, BINARY)
+
+  @staticmethod
+  def negotiate(params):
+    protocol = params.get('protocol', Protocol.QUOTED)
+    if protocol not in Protocol.PROTOCOLS:
+      logging.warn('Protocol unknown [%s] -> using %s...' % (protocol, Protocol.QUOTED))
+      return Protocol.QUOTED
+    if protocol == Protocol.BINARY and msgpack is None:
+      logging.warn('Binary protocol needs msgpack -> using %s...' % (Protocol.JSON,))
+      return Protocol.JSON
+    return protocol
+
+  @staticmethod
+  def decode(message, protocol):
+    if isinstance(message, (bytes, bytearray)):
+      if protocol != Protocol.BINARY:
+        raise ValueError('Binary message on a text protocol')
+      return msgpack.unpackb(message, raw=False)
+    if protocol == Protocol.QUOTED:
+      return json.loads(urllib.parse.unquote(message))
+    return json.loads(message)
+
+  @staticmethod
+  def pack(obj, default=None):
+    # Binary protocol frame opcode and payload of an object, without going through JSON
+    return 0x2, msgpack.packb(obj, use_bin_type=True, default=default)
+
+  @staticmethod
+  def encode(text, protocol):
+    # Encode a JSON message for a protocol, returns the frame opcode and the payload
+    if protocol == Protocol.BINARY:
+      return Protocol.pack(json.loads(text))
+    if protocol == Protocol.JSON:
+      return 0x1, text.encode('UTF-8')
+    return 0x1, urllib.parse.quote(text).encode('UTF-8')
@@ -0,0 +1,406 @@
+from threading import Thread, Condition, RLock, local
+from collections import deque, Counter
+import logging
+import heapq
+import time
+
+class Inbox:
+  # Deliveries waiting for one component, error port deliveries first
+  def __init__(self, component):
+    self.component = component
+    self.priority = deque()
+    self.normal = deque()
+    # Waiting in the ready queue or being processed by a worker
+    self.scheduled = False
+    # Arrival time and count of the remaining chunks of normal deliveries, for the window of the batches
+    self.arrivals = deque()
+    # Batch waiting for more deliveries, until the end of its window
+    self.waiting = False
+    self.deadline = 0
+    # Overflowing deliveries seen by the sample policy
+    self.sampled = 0
+    # Deliveries of held producers waiting for room in this inbox (producer inbox, payloads), in order
+    self.parked = deque()
+    # Inboxes holding deliveries parked by this component, with their count. While it is not empty at the
+    # end of its processing, the inbox is held: it stays scheduled without being in the ready queue.
+    self.waitingFor = Counter()
+    self.held = False
+
+  def __len__(self):
+    return len(self.priority) + len(self.normal)
+
+  @property
+  def since(self):
+    # Arrival of the oldest remaining normal delivery
+    return self.arrivals[0][0] if self.arrivals else time.monotonic()
+
+  def extend(self, payloads, priority):
+    if priority:
+      self.priority.extend(payloads)
+    else:
+      self.normal.extend(payloads)
+      self.arrivals.append([time.monotonic(), len(payloads)])
+
+  def popleft(self):
+    # Oldest normal delivery
+    self.arrivals[0][1] -= 1
+    if not self.arrivals[0][1]:
+      self.arrivals.popleft()
+    return self.normal.popleft()
+
+  def pop(self):
+    return self.priority.popleft() if self.priority else self.popleft()
+
+  def clear(self):
+    self.priority.clear()
+    self.normal.clear()
+    self.arrivals.clear()
+
+  def full(self, payloads, capacity):
+    # An empty inbox takes a delivery larger than its capacity
+    return len(self.normal) > 0 and len(self.normal) + len(payloads) > capacity
+
+class Scheduler:
+  # Deliveries are queued in the inbox of their target component and processed by a pool of workers.
+  # A component is processed by one worker at a time, so the deliveries of an edge keep their order.
+  # Without workers, the thread sending the data processes the deliveries in a loop instead of recursively.
+  # A worker never waits for room in a full inbox: the deliveries of its component are parked in the full
+  # inbox, and the component is held until they are queued, so the backpressure goes up the flow.
+
+  # Deliveries processed for a component before giving the worker to the next one
+  BURST = 32
+
+  # Default size and time window (seconds) of the batches of the components with a 'batch' handler
+  BATCH_COUNT = 100
+  BATCH_WINDOW = 0.05
+
+  # Overflow policies of the inboxes, error port deliveries are never refused
+  BLOCK = 'block'             # the producing component is held until there is room, other threads wait at most BLOCK_TIMEOUT seconds
+  DROP_NEWEST = 'drop-newest'
+  DROP_OLDEST = 'drop-oldest'
+  SAMPLE = 'sample'           # one overflowing delivery out of 'sample' replaces the oldest one
+
+  POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, SAMPLE)
+
+  QUEUE_CAPACITY = 1000
+  QUEUE_POLICY = BLOCK
+  QUEUE_SAMPLE = 10
+  BLOCK_TIMEOUT = 1.0
+
+  def __init__(self, flow, workers=4, capacity=QUEUE_CAPACITY, policy=QUEUE_POLICY):
+    if policy not in Scheduler.POLICIES:
+      raise ValueError('Unknown queue policy %s' % (policy,))
+    self.flow = flow
+    self.workers = workers
+    self.capacity = capacity
+    self.policy = policy
+    self.lock = RLock()
+    self.condition = Condition(self.lock)
+    # Notified when deliveries leave an inbox, for the blocked producers
+    self.space = Condition(self.lock)
+    # Ends of the windows of the waiting batches (deadline, sequence, inbox), watched by one timer thread
+    self.windows = Condition(self.lock)
+    self.deadlines = []
+    self.sequence = 0
+    self.timer = None
+    self.inboxes = {}
+    self.ready = deque()
+    self.running = True
+    self.local = local()
+
+    self.threads = []
+    for i in range(workers):
+      thread = Thread(target=self.run, name='scheduler-%d' % (i,), daemon=True)
+      thread.start()
+      self.threads.append(thread)
+
+  def deliver(self, component, payloads, priority=False):
+    dropped = 0
+    with self.condition:
+      if component.id not in self.inboxes:
+        self.inboxes[component.id] = Inbox(component)
+      inbox = self.inboxes[component.id]
+      producer = getattr(self.local, 'inbox', None)
+      if not priority and producer is not None and self.parks(inbox, producer, payloads):
+        inbox.parked.append((producer, payloads))
+        producer.waitingFor[inbox] += 1
+        self.flow.onGoing += len(payloads)
+        payloads = []
+      elif not priority:
+        payloads, dropped = self.admit(inbox, payloads)
+      if len(payloads):
+        self.queue(inbox, payloads, priority)
+      pending = len(inbox)
+
+    self.flow.updateTraffic(component.id, 'pending', pending)
+    if dropped:
+      self.flow.updateTraffic(component.id, 'dropped', None, messages=dropped)
+
+    if len(payloads) and self.workers == 0 and not getattr(self.local, 'draining', False):
+      self.drain()
+
+  def queue(self, inbox, payloads, priority):
+    inbox.extend(payloads, priority)
+    self.flow.onGoing += len(payloads)
+
+    if not inbox.scheduled:
+      inbox.scheduled = True
+      if priority:
+        self.ready.appendleft(inbox)
+      else:
+        self.ready.append(inbox)
+      self.condition.notify()
+    elif inbox.waiting and (priority or len(inbox) >= self.batchCount(inbox.component)):
+      # Batch complete before the end of its window
+      inbox.waiting = False
+      self.ready.append(inbox)
+      self.condition.notify()
+
+  def queueOptions(self, component):
+    options = component.queueOptions()
+    return (options.get('capacity', self.capacity), options.get('policy', self.policy), options.get('sample', Scheduler.QUEUE_SAMPLE))
+
+  def parks(self, inbox, producer, payloads):
+    # Whether the deliveries of the component processed by this thread wait for room in the inbox
+    capacity, policy, sample = self.queueOptions(inbox.component)
+    if policy != Scheduler.BLOCK or not (inbox.parked or inbox.full(payloads, capacity)):
+      return False
+    # The inbox would wait for the producer in a cycle of the flow: queued over the capacity
+    return not self.holds(inbox, producer)
+
+  def holds(self, inbox, producer):
+    # Whether inbox is the producer, or waits for room in it through held components
+    stack = [inbox]
+    seen = set()
+    while stack:
+      current = stack.pop()
+      if current is producer:
+        return True
+      if current not in seen:
+        seen.add(current)
+        stack.extend(current.waitingFor)
+    return False
+
+  def unpark(self, inbox):
+    # Parked deliveries queued while there is room, called with the lock held when deliveries leave the inbox
+    capacity = self.queueOptions(inbox.component)[0]
+    while inbox.parked and not inbox.full(inbox.parked[0][1], capacity):
+      producer, payloads = inbox.parked.popleft()
+      self.flow.onGoing -= len(payloads)
+      self.queue(inbox, payloads, False)
+      self.release(producer, inbox)
+
+  def release(self, producer, inbox):
+    producer.waitingFor[inbox] -= 1
+    if producer.waitingFor[inbox] == 0:
+      del producer.waitingFor[inbox]
+    if producer.held and not producer.waitingFor:
+      producer.held = False
+      if len(producer):
+        self.ready.append(producer)
+        self.condition.notify()
+      else:
+        producer.scheduled = False
+
+  def admit(self, inbox, payloads):
+    # Deliveries accepted in a full inbox, and the number of dropped ones
+    capacity, policy, sample = self.queueOptions(inbox.component)
+    if len(inbox.normal) + len(payloads) <= capacity:
+      return payloads, 0
+
+    if policy == Scheduler.BLOCK:
+      # Only threads out of the scheduler wait: without workers the producer is the consumer, and a
+      # worker queues over the capacity when parking its deliveries would close a cycle
+      if self.workers > 0 and getattr(self.local, 'inbox', None) is None:
+        deadline = time.monotonic() + Scheduler.BLOCK_TIMEOUT
+        while self.running and len(inbox.normal) + len(payloads) > capacity:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            logging.warn('Inbox of component [%s] still full -> queueing anyway...' % (inbox.component.id,))
+            break
+          self.space.wait(remaining)
+        if self.inboxes.get(inbox.component.id) is not inbox:
+          return [], len(payloads)
+      return payloads, 0
+
+    if policy == Scheduler.DROP_NEWEST:
+      room = max(0, capacity - len(inbox.normal))
+      return payloads[:room], len(payloads) - room
+
+    dropped = 0
+    if policy == Scheduler.SAMPLE:
+      room = max(0, capacity - len(inbox.normal))
+      accepted = payloads[:room]
+      for payload in payloads[room:]:
+        inbox.sampled += 1
+        if inbox.sampled % sample == 0:
+          accepted.append(payload)
+      dropped = len(payloads) - len(accepted)
+      payloads = accepted
+
+    # DROP_OLDEST, and room for the sampled deliveries
+    while inbox.normal and len(inbox.normal) + len(payloads) > capacity:
+      inbox.popleft()
+      self.flow.onGoing -= 1
+      dropped += 1
+    if len(payloads) > capacity:
+      dropped += len(payloads) - capacity
+      payloads = payloads[len(payloads) - capacity:]
+    return payloads, dropped
+
+  def pressure(self, component):
+    # How full the inbox of a component is, from 0 to 1
+    inbox = self.inboxes.get(component.id)
+    if inbox is None:
+      return 0
+    return min(1, len(inbox.normal) / max(1, self.queueOptions(component)[0]))
+
+  def remove(self, component):
+    with self.condition:
+      inbox = self.inboxes.pop(component.id, None)
+      if inbox is not None:
+        self.flow.onGoing -= len(inbox)
+        inbox.clear()
+        # Deliveries parked for the removed component are dropped, their producers go on
+        while inbox.parked:
+          producer, payloads = inbox.parked.popleft()
+          self.flow.onGoing -= len(payloads)
+          self.release(producer, inbox)
+        self.space.notify_all()
+
+  def batchCount(self, component):
+    return component.batchOptions().get('count', Scheduler.BATCH_COUNT)
+
+  def wait(self, inbox, deadline):
+    # Batch waiting for the end of its window, called with the lock held
+    inbox.waiting = True
+    inbox.deadline = deadline
+    self.sequence += 1
+    heapq.heappush(self.deadlines, (deadline, self.sequence, inbox))
+    if self.timer is None:
+      self.timer = Thread(target=self.runTimer, name='scheduler-timer', daemon=True)
+      self.timer.start()
+    self.windows.notify()
+
+  def runTimer(self):
+    while True:
+      with self.condition:
+        while self.running and (not self.deadlines or self.deadlines[0][0] > time.monotonic()):
+          self.windows.wait(self.deadlines[0][0] - time.monotonic() if self.deadlines else None)
+        if not self.running:
+          return
+        deadline, sequence, inbox = heapq.heappop(self.deadlines)
+        if inbox.deadline != deadline:
+          # Window of a batch already processed
+          continue
+      self.wake(inbox)
+
+  def wake(self, inbox):
+    # End of the window of a batch
+    with self.condition:
+      if not inbox.waiting:
+        return
+      inbox.waiting = False
+      self.ready.append(inbox)
+      self.condition.notify()
+
+    if self.workers == 0:
+      self.drain()
+
+  def drain(self):
+    self.local.draining = True
+    try:
+      while True:
+        with self.condition:
+          if not self.ready:
+            return
+          inbox = self.ready.popleft()
+        self.process(inbox)
+    finally:
+      self.local.draining = False
+
+  def run(self):
+    while True:
+      with self.condition:
+        while self.running and not self.ready:
+          self.condition.wait()
+        if not self.running:
+          return
+        inbox = self.ready.popleft()
+      self.process(inbox)
+
+  def process(self, inbox):
+    component = inbox.component
+    batched = 'batch' in component.events
+    with self.condition:
+      if not len(inbox):
+        # Emptied by remove()
+        inbox.scheduled = False
+        return
+      if batched:
+        # Wait for a full batch, or the end of the window of the oldest delivery
+        options = component.batchOptions()
+        deadline = inbox.since + options.get('window', Scheduler.BATCH_WINDOW)
+        if not inbox.priority and len(inbox) < self.batchCount(component) and deadline > time.monotonic():
+          self.wait(inbox, deadline)
+          return
+      count = self.batchCount(component) if batched else Scheduler.BURST
+      batch = [inbox.pop() for i in range(min(len(inbox), count))]
+      self.unpark(inbox)
+      self.space.notify_all()
+      pending = len(inbox)
+
+    self.flow.updateTraffic(component.id, 'pending', pending)
+
+    if batched:
+      # One event by input, in order of the first delivery of each input
+      inputs = {}
+      for payload in batch:
+        inputs.setdefault(payload.toIdx, []).append(payload)
+      events = [('batch', (payloads,), len(payloads)) for payloads in inputs.values()]
+    else:
+      events = [('data', (payload,), 1) for payload in batch]
+
+    # Deliveries sent by the handlers are parked by this inbox when their target is full
+    self.local.inbox = inbox
+    try:
+      # Handlers running in worker processes get the whole batch at once, results are replayed in order
+      results = None
+      if component.runsInProcess():
+        start = time.perf_counter_ns()
+        results = self.flow.processExecutor.map(component, events[0][0], [args for eventName, args, n in events])
+        if self.flow.timing:
+          self.flow.processExecutor.record(component, time.perf_counter_ns() - start, results)
+
+      for i, (eventName, args, n) in enumerate(events):
+        try:
+          if results is not None:
+            self.flow.processExecutor.replay(component, results[i])
+          else:
+            component.emit(eventName, *args)
+        except Exception as e:
+          logging.error('Exception in component [%s]: %s' % (component.id, e))
+
+        with self.condition:
+          self.flow.onGoing -= n
+          if self.flow.onGoing == 0:
+            self.flow.resetTraffic()
+    finally:
+      self.local.inbox = None
+
+    with self.condition:
+      if inbox.waitingFor:
+        # Held until its parked deliveries are queued, see release()
+        inbox.held = True
+      elif len(inbox):
+        self.ready.append(inbox)
+        self.condition.notify()
+      else:
+        inbox.scheduled = False
+
+  def stop(self):
+    with self.condition:
+      self.running = False
+      self.condition.notify_all()
+      self.space.notify_all()
+      self.windows.notify_all()
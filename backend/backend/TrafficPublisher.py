@@ -0,0 +1,20 @@
+from threading import Thread, Event
+import logging
+
+class TrafficPublisher(Thread):
+  # Sends the traffic of the flow at a fixed rate, components only count messages
+  def __init__(self, flow, interval=1.0):
+    super().__init__(daemon=True)
+    self.flow = flow
+    self.interval = interval
+    self.stopped = Event()
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      try:
+        self.flow.sendTrafficMessage()
+      except Exception as e:
+        logging.error('Traffic publishing failed: %s' % (str(e),))
+
+  def stop(self):
+    self.stopped.set()
@@ -0,0 +1,285 @@
+from threading import Lock, local
+from itertools import count
+from array import array
+import math
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def zeros(size, typecode='q'):
+  if numpy is not None:
+    return numpy.zeros(size, numpy.int64 if typecode == 'q' else numpy.float64)
+  return array(typecode, bytes(size * 8))
+
+def resized(values, size, typecode='q'):
+  # Copy of values, padded with zeros up to size
+  copy = zeros(size, typecode)
+  copy[:len(values)] = values[:size]
+  return copy
+
+def accumulate(total, values):
+  if not len(values):
+    return
+  if numpy is not None:
+    total[:len(values)] += numpy.frombuffer(values, numpy.int64)
+  else:
+    for i, value in enumerate(values):
+      total[i] += value
+
+def changed(current, previous, stride):
+  # Slots with a value different from the previous ones
+  if numpy is not None:
+    return set(numpy.nonzero((current != previous).reshape(-1, stride).any(axis=1))[0].tolist())
+  return set(i // stride for i in range(len(current)) if current[i] != previous[i])
+
+class TrafficShard:
+  # Counters written by some of the threads, only summed by the publisher
+  def __init__(self):
+    self.lock = Lock()
+    self.components = array('q')
+    self.ports = array('q')
+    self.edges = array('q')
+
+  @staticmethod
+  def reserve(values, size):
+    if len(values) < size:
+      values.frombytes(bytes((size - len(values)) * values.itemsize))
+    return values
+
+  def copy(self):
+    with self.lock:
+      return array('q', self.components), array('q', self.ports), array('q', self.edges)
+
+class TrafficStore:
+  # Traffic counters of the components, of their outputs and of the connections, in flat arrays of slots.
+  # Each thread writes in one of the shards, an update is applied in one shard under its lock, so that the
+  # sum of the shards is a consistent snapshot. Published values are deltas of snapshots: nothing is
+  # reset in the shards, and the EWMA rates are computed from the time between two publications.
+
+  # Counters of a component slot: bytes and messages received and sent, dropped messages
+  INPUT, OUTPUT, NI, NO, DROPPED = range(5)
+  STRIDE = 5
+  # Values of a component set by the last update
+  GAUGES = ('pending', 'duration', 'ci', 'co')
+  # Counters of an edge slot: messages and bytes
+  EDGE_STRIDE = 2
+
+  SHARDS = 8
+  # Time constant (seconds) of the rates, and smallest rate published
+  EWMA_WINDOW = 5.0
+  EWMA_EPSILON = 0.01
+
+  def __init__(self):
+    self.lock = Lock()
+    self.shards = [TrafficShard() for i in range(TrafficStore.SHARDS)]
+    self.next = count()
+    self.local = local()
+
+    # Slots by component id, output (id, index) and edge (from id, output, to id, input)
+    self.components = {}
+    self.ids = []
+    self.ports = {}
+    self.portsOf = []
+    self.edges = {}
+    self.edgeKeys = []
+    self.gauges = array('d')
+
+    # Counters at the last reset and at the last publication, their time and the rates
+    self.baseline = (zeros(0), zeros(0))
+    self.published = (zeros(0), zeros(0), zeros(0), zeros(0, 'd'))
+    self.time = time.monotonic()
+    self.rates = zeros(0, 'd')
+    self.edgeRates = zeros(0, 'd')
+
+  def shard(self):
+    shard = getattr(self.local, 'shard', None)
+    if shard is None:
+      shard = self.local.shard = self.shards[next(self.next) % TrafficStore.SHARDS]
+    return shard
+
+  def slot(self, id):
+    slot = self.components.get(id)
+    if slot is None:
+      with self.lock:
+        slot = self.components.get(id)
+        if slot is None:
+          slot = len(self.ids)
+          self.ids.append(id)
+          self.portsOf.append([])
+          self.gauges.frombytes(bytes(len(TrafficStore.GAUGES) * 8))
+          self.components[id] = slot
+    return slot
+
+  def port(self, id, index):
+    key = (id, index)
+    slot = self.ports.get(key)
+    if slot is None:
+      component = self.slot(id)
+      with self.lock:
+        slot = self.ports.get(key)
+        if slot is None:
+          slot = len(self.ports)
+          self.portsOf[component].append((index, slot))
+          self.ports[key] = slot
+    return slot
+
+  def edge(self, key):
+    slot = self.edges.get(key)
+    if slot is None:
+      with self.lock:
+        slot = self.edges.get(key)
+        if slot is None:
+          slot = len(self.edgeKeys)
+          self.edgeKeys.append(key)
+          self.edges[key] = slot
+    return slot
+
+  def output(self, id, index, size, messages):
+    base = self.slot(id) * TrafficStore.STRIDE
+    port = self.port(id, index) if index is not None else None
+    shard = self.shard()
+    with shard.lock:
+      counters = TrafficShard.reserve(shard.components, base + TrafficStore.STRIDE)
+      counters[base + TrafficStore.OUTPUT] += size
+      counters[base + TrafficStore.NO] += messages
+      if port is not None:
+        TrafficShard.reserve(shard.ports, port + 1)[port] += messages
+
+  def deliver(self, fromID, fromIdx, toID, toIdx, size, messages, counted=True):
+    # Messages of an edge, and inputs of its target when counted
+    base = self.slot(toID) * TrafficStore.STRIDE
+    edge = self.edge((fromID, fromIdx, toID, toIdx)) * TrafficStore.EDGE_STRIDE
+    shard = self.shard()
+    with shard.lock:
+      if counted:
+        counters = TrafficShard.reserve(shard.components, base + TrafficStore.STRIDE)
+        counters[base + TrafficStore.INPUT] += size
+        counters[base + TrafficStore.NI] += messages
+      edges = TrafficShard.reserve(shard.edges, edge + TrafficStore.EDGE_STRIDE)
+      edges[edge] += messages
+      edges[edge + 1] += size
+
+  def add(self, id, field, size, messages):
+    # Counters of a component alone: 'input', 'output' or 'dropped'
+    if field == 'output':
+      self.output(id, None, size, messages)
+      return
+    base = self.slot(id) * TrafficStore.STRIDE
+    shard = self.shard()
+    with shard.lock:
+      counters = TrafficShard.reserve(shard.components, base + TrafficStore.STRIDE)
+      if field == 'input':
+        counters[base + TrafficStore.INPUT] += size
+        counters[base + TrafficStore.NI] += messages
+      else:
+        counters[base + TrafficStore.DROPPED] += messages
+
+  def set(self, id, field, value):
+    index = self.slot(id) * len(TrafficStore.GAUGES) + TrafficStore.GAUGES.index(field)
+    # Under the lock of slot() and publish(), which replace the array of the gauges
+    with self.lock:
+      self.gauges[index] = value
+
+  def collect(self):
+    # Sum of the shards, and gauges
+    with self.lock:
+      components, ports, edges = len(self.ids), len(self.ports), len(self.edgeKeys)
+      gauges = resized(self.gauges, len(self.gauges), 'd')
+    totals = (zeros(components * TrafficStore.STRIDE), zeros(ports), zeros(edges * TrafficStore.EDGE_STRIDE))
+    for shard in self.shards:
+      for total, values in zip(totals, shard.copy()):
+        accumulate(total, values[:len(total)])
+    return totals + (gauges,)
+
+  def totals(self):
+    # Counters of each component since the start, with its gauges, and messages and bytes of each edge
+    components, ports, edges, gauges = self.collect()
+    items = {}
+    for slot, id in enumerate(self.ids[:len(components) // TrafficStore.STRIDE]):
+      base = slot * TrafficStore.STRIDE
+      item = { field: int(components[base + i]) for i, field in enumerate(('input', 'output', 'ni', 'no', 'dropped')) }
+      for i, field in enumerate(TrafficStore.GAUGES):
+        item[field] = gauges[slot * len(TrafficStore.GAUGES) + i]
+      items[id] = item
+    edgeItems = {}
+    for slot, key in enumerate(self.edgeKeys[:len(edges) // TrafficStore.EDGE_STRIDE]):
+      edgeItems[key] = (int(edges[slot * TrafficStore.EDGE_STRIDE]), int(edges[slot * TrafficStore.EDGE_STRIDE + 1]))
+    return items, edgeItems
+
+  def publish(self, full=False, reset=False):
+    # Body of the traffic message by component id and list of the edges, only with the changes unless full.
+    # Byte and message counts are since the last reset, 'ni', 'no' and 'no<index>' since the last publication.
+    now = time.monotonic()
+    elapsed = max(now - self.time, 1e-6)
+    alpha = 1 - math.exp(-elapsed / TrafficStore.EWMA_WINDOW)
+    self.time = now
+
+    current = self.collect()
+    components, ports, edges, gauges = current
+    previous = tuple(resized(values, len(latest), 'd' if i == 3 else 'q') for i, (values, latest) in enumerate(zip(self.published, current)))
+    baseline = tuple(resized(values, len(latest)) for values, latest in zip(self.baseline, (components, edges)))
+    self.rates = resized(self.rates, len(self.ids) * 4, 'd')
+    self.edgeRates = resized(self.edgeRates, len(self.edgeKeys) * 2, 'd')
+
+    if full:
+      slots = set(range(len(self.ids)))
+      edgeSlots = set(range(len(self.edgeKeys)))
+    else:
+      # Changed counters or gauges, and rates still decaying
+      slots = changed(components, previous[0], TrafficStore.STRIDE) | changed(gauges, previous[3], len(TrafficStore.GAUGES)) | changed(self.rates, zeros(len(self.rates), 'd'), 4)
+      edgeSlots = changed(edges, previous[2], TrafficStore.EDGE_STRIDE) | changed(self.edgeRates, zeros(len(self.edgeRates), 'd'), 2)
+
+    body = {}
+    for slot in sorted(slots):
+      base = slot * TrafficStore.STRIDE
+      # Rates of messages and bytes received and sent
+      deltas = [components[base + field] - previous[0][base + field] for field in (TrafficStore.NI, TrafficStore.NO, TrafficStore.INPUT, TrafficStore.OUTPUT)]
+      rates = []
+      for i, delta in enumerate(deltas):
+        rate = self.rates[slot * 4 + i] + alpha * (delta / elapsed - self.rates[slot * 4 + i])
+        self.rates[slot * 4 + i] = rate if rate >= TrafficStore.EWMA_EPSILON else 0
+        rates.append(round(float(self.rates[slot * 4 + i]), 2))
+
+      item = {
+        'input': int(components[base + TrafficStore.INPUT] - baseline[0][base + TrafficStore.INPUT]),
+        'output': int(components[base + TrafficStore.OUTPUT] - baseline[0][base + TrafficStore.OUTPUT]),
+        'ni': int(deltas[0]),
+        'no': int(deltas[1]),
+        'dropped': int(components[base + TrafficStore.DROPPED] - baseline[0][base + TrafficStore.DROPPED]),
+        'mi': rates[0],
+        'mo': rates[1],
+        'bi': rates[2],
+        'bo': rates[3]
+      }
+      for i, field in enumerate(TrafficStore.GAUGES):
+        value = gauges[slot * len(TrafficStore.GAUGES) + i]
+        item[field] = int(value) if value == int(value) else float(value)
+      for index, port in self.portsOf[slot]:
+        if port < len(ports):
+          item['no' + str(index)] = int(ports[port] - previous[1][port])
+      body[self.ids[slot]] = item
+
+    edgeList = []
+    for slot in sorted(edgeSlots):
+      base = slot * TrafficStore.EDGE_STRIDE
+      edge = { 'from': self.edgeKeys[slot][0], 'output': self.edgeKeys[slot][1], 'to': self.edgeKeys[slot][2], 'input': self.edgeKeys[slot][3] }
+      for i, field in enumerate(('messages', 'bytes')):
+        rate = self.edgeRates[base + i] + alpha * ((edges[base + i] - previous[2][base + i]) / elapsed - self.edgeRates[base + i])
+        self.edgeRates[base + i] = rate if rate >= TrafficStore.EWMA_EPSILON else 0
+        edge[field] = int(edges[base + i] - baseline[1][base + i])
+      edge['mps'] = round(float(self.edgeRates[base]), 2)
+      edge['bps'] = round(float(self.edgeRates[base + 1]), 2)
+      edgeList.append(edge)
+
+    # Messages sent since the last reset
+    total = int(sum(components[TrafficStore.NO::TrafficStore.STRIDE]) - sum(baseline[0][TrafficStore.NO::TrafficStore.STRIDE]))
+
+    self.published = current
+    if reset:
+      self.baseline = (components, edges)
+      with self.lock:
+        self.gauges = array('d', bytes(len(self.gauges) * 8))
+    return body, edgeList, total
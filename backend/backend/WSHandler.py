@@ -1,6 +1,6 @@
-import urllib.parse
+from .Protocol import Protocol
+from .Messages import *
 import logging
-import json
 import re
 
 class WSHandler:
@@ -9,28 +9,67 @@ class WSHandler:
     self._WSServer.setWSHandler(self)
     self.flow = flowInstance
 
-  def onConnect(self, conn, request):
+    # Chunks of the text messages being received, by client
+    self.messages = {}
+
+  @staticmethod
+  def params(request):
+    url = request.split('GET ')[1].split(' HTTP')[0]
+    return re.findall(r'([^?=&]+=[^&]*)', url)
+
+  def onHandshake(self, request, client):
+    # Protocol negotiated before the client is open: multicasts are encoded for it from then on
+    params = dict(p.split('=', 1) for p in WSHandler.params(request))
+    client.protocol = Protocol.negotiate(params)
+
+  def onConnect(self, conn, request, client=None):
     logging.info('--- NEW CLIENT CONNECTED ---')
     logging.info('- REQUEST: %s' % (request.rstrip(),))
     # Compute parameters
-    url = request.split('GET ')[1].split(' HTTP')[0]
-    params = re.findall(r'([^?=&]+=[^&]*)', url)
+    params = WSHandler.params(request)
     if len(params) > 0:
       logging.info('- PARAMS:')
       for p in params:
         logging.info('\t* ' + p[:p.index('=')] + (' = ' + p[p.index('=')+1:] if p.index('=') != len(p)-1 else ''))
     logging.info('----------------------------')
-    self.flow.onConnect()
+    params = dict(p.split('=', 1) for p in params)
+
+    # Acknowledge the protocol to the clients asking for one
+    if client is not None and 'protocol' in params:
+      MESSAGE_PROTOCOL['protocol'] = client.protocol
+      client.send(self.flow.formatMessage(MESSAGE_PROTOCOL, [client]))
+    self.flow.onConnect(client)
 
   def onMessage(self, message, client):
     logging.info('----- INCOMING MESSAGE -----')
     logging.info(message)
     logging.info('- DECODING...')
-    message = json.loads(urllib.parse.unquote(message))
+    message = Protocol.decode(message, client.protocol)
     logging.info('- MESSAGE: %s' % (message,))
     logging.info('----------------------------')
     self.flow.onMessage(message, client)
 
+  def onMessageChunk(self, opcode, chunk, fin, client):
+    # Binary messages are streamed to the flow during an upload, other messages are decoded once complete
+    if opcode == 0x2 and (client.protocol != Protocol.BINARY or client in self.flow.uploads):
+      self.flow.onUpload(chunk, fin, client)
+      return
+
+    if client not in self.messages:
+      self.messages[client] = []
+    if len(chunk):
+      self.messages[client].append(chunk)
+    if fin:
+      message = b''.join(self.messages.pop(client))
+      if opcode == 0x1:
+        try:
+          message = message.decode('UTF-8')
+        except UnicodeError:
+          client._WSController.kill(1007, b'Client text datas MUST be UTF-8 encoded.')
+          return
+      if len(message):
+        self.onMessage(message, client)
+
   def onSend(self, message):
     logging.info('----- SENDING  MESSAGE -----')
     logging.info(message)
@@ -38,4 +77,9 @@ class WSHandler:
 
   def onClose(self, conn):
     logging.info('----- CLOSE (WSCLIENT) -----')
+    for client in [c for c in self.messages if c.conn is conn]:
+      del self.messages[client]
+    # Upload not finished by the client
+    for client in [c for c in self.flow.uploads if c.conn is conn]:
+      del self.flow.uploads[client]
     self.flow.onClose()
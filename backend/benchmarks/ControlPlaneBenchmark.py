@@ -0,0 +1,369 @@
+"""
+  ControlPlaneBenchmark - Scale of the designer operations of Flow with large flows
+
+  Generates a component library and the .flow/instances and tabs files of a large flow in a temporary
+  folder, then times:
+    - the startup of the flow, without (cold) and with (warm) the component manifest
+    - the same startups with components not used by the flow added to the library, each sleeping at import
+      like a module importing a heavy dependency: only imported without the manifest
+    - selfRegisterComponent for the whole library
+    - the move of one node and the options change of one node
+    - an apply adding nodes, and the apply removing them
+    - save, and the write of the snapshot of the instances
+    - the designer snapshot sent to a new client, encoded for the json and quoted protocols
+
+  Usage (from the backend folder):
+    python benchmarks/ControlPlaneBenchmark.py [--instances 10000] [--tabs 50] [--library 300] [--add 1000]
+                                               [--edits 200] [--repeat 5] [--costly 50] [--import-cost 20] [--legacy]
+                                               [--output /tmp/ControlPlaneBenchmark.json] [--compare previous.json]
+"""
+
+import os, sys, json, time, random, shutil, logging, platform, tempfile, argparse, statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+logging.websocket = (lambda *argv: None)
+
+from backend.Messages import MESSAGE_DESIGNER
+from backend.Protocol import Protocol
+from backend.Journal import Journal
+from backend.Flow import Flow
+
+COMPONENT = '''def install(instance):
+  def onData(self, args):
+    self.send(args[0].data)
+  instance.on('data', onData)
+
+EXPORTS = {
+  'id': '%(prefix)s%(index)03d',
+  'title': 'Benchmark %(index)d',
+  'author': 'Benchmark',
+  'color': '#%(color)06x',
+  'icon': 'fa-cog',
+  'group': 'Group %(group)d',
+  'input': 1,
+  'output': %(outputs)d,
+  'options': { 'value': %(index)d, 'text': 'Option of component %(index)d' },
+  'readme': %(readme)r,
+  'html': %(html)r,
+  'install': install
+}
+'''
+
+class BenchmarkServer:
+  """Server of stub clients, keeping the messages sent to all of them
+  """
+  def __init__(self):
+    self.clients = []
+    self.messages = 0
+
+  def send(self, message):
+    self.messages += 1
+
+class BenchmarkClient:
+  """Client keeping the messages sent to it only
+  """
+  def __init__(self, protocol):
+    self.protocol = protocol
+    self.messages = []
+
+  def send(self, message):
+    self.messages.append(message)
+
+class BenchmarkEncoder:
+  """Encoder never called, frames are not built
+  """
+  def encode(self, opcode, data, mask=0, rsv1=0):
+    return data
+
+class BenchmarkFlow(Flow):
+  """Flow loading its component library from the generated folder instead of the backend one
+  """
+  library = None
+
+  def load(self):
+    self.componentsPath = BenchmarkFlow.library
+    super().load()
+
+def generate(root, instances, tabs, library, seed=0):
+  """Write a component library and the saved files of a flow with instances nodes in tabs tabs
+
+  Returns:
+    Folder of the library
+  """
+  rand = random.Random(seed)
+  components = os.path.join(root, 'components')
+  os.mkdir(components)
+  for i in range(library):
+    with open(os.path.join(components, 'bench%03d.py' % (i,)), 'w') as file:
+      file.write(COMPONENT % {
+        'prefix': 'bench',
+        'index': i,
+        'color': rand.randrange(0x1000000),
+        'group': i % 10,
+        'outputs': 1 + i % 3,
+        'readme': 'Readme of component %d. ' % (i,) * 40,
+        'html': '<div class="padding">Settings of component %d</div>' % (i,) * 10
+      })
+
+  os.mkdir(os.path.join(root, '.flow'))
+  with open(os.path.join(root, '.flow', 'tabs'), 'w') as file:
+    json.dump([{'id': 'tab%d' % (t,), 'name': 'Tab %d' % (t,), 'linker': 'tab-%d' % (t,), 'icon': 'fa-object-ungroup'} for t in range(tabs)], file)
+
+  nodes = []
+  perTab = max(1, instances // tabs)
+  for i in range(instances):
+    component = i % library
+    # Chains in each tab, with a fan out from one node out of ten
+    connections = {}
+    if (i + 1) % perTab != 0 and i + 1 < instances:
+      targets = [i + 1] + ([rand.randrange(i - i % perTab, min(instances, i - i % perTab + perTab)) for k in range(3)] if i % 10 == 0 else [])
+      connections['0'] = [{'id': 'node%d' % (t,), 'index': '0'} for t in targets]
+    nodes.append({
+      'id': 'node%d' % (i,),
+      'component': 'bench%03d' % (component,),
+      'x': (i % perTab) * 150 % 3000,
+      'y': (i % perTab) * 150 // 3000 * 100,
+      'state': {'text': '', 'color': ''},
+      'tab': 'tab%d' % (min(i // perTab, tabs - 1),),
+      'disabledio': {'input': [], 'output': []},
+      'connections': connections,
+      'name': 'Node %d' % (i,),
+      'color': '',
+      'icon': '',
+      'notes': '',
+      'options': {'value': i, 'text': 'Option of node %d' % (i,)}
+    })
+  with open(os.path.join(root, '.flow', 'instances'), 'w') as file:
+    json.dump(nodes, file)
+  return components
+
+def addCostly(components, count, cost):
+  """Write count components importing in cost milliseconds in the library
+
+  Returns:
+    Paths of the files written
+  """
+  paths = []
+  for i in range(count):
+    paths.append(os.path.join(components, 'costly%03d.py' % (i,)))
+    with open(paths[-1], 'w') as file:
+      # Stands for the import of a heavy dependency
+      file.write('import time\ntime.sleep(%r)\n\n' % (cost / 1e3,))
+      file.write(COMPONENT % {
+        'prefix': 'costly',
+        'index': i,
+        'color': 0,
+        'group': 0,
+        'outputs': 1,
+        'readme': '',
+        'html': ''
+      })
+  return paths
+
+def start(root, server):
+  """New flow on the saved files of root
+  """
+  # The designer database is shared by the flows of the process, a flow is created for each measure
+  MESSAGE_DESIGNER['database'] = []
+  return BenchmarkFlow(server, BenchmarkEncoder(), root, trafficInterval=3600, workers=0)
+
+def startup(root, repeat, cold):
+  """Time repeat startups of the flow, without the component manifest when cold
+
+  Returns:
+    Durations, and the flow of the last startup, not stopped
+  """
+  manifest = os.path.join(root, '.flow', 'manifest')
+  durations = []
+  flow = None
+  for i in range(repeat):
+    if flow is not None:
+      flow.stop()
+    if cold and os.path.exists(manifest):
+      os.remove(manifest)
+    begin = time.perf_counter()
+    flow = start(root, BenchmarkServer())
+    durations.append(time.perf_counter() - begin)
+  return durations, flow
+
+def summary(durations, **extra):
+  """Durations in milliseconds
+  """
+  result = {
+    'median': round(statistics.median(durations) * 1e3, 3),
+    'min': round(min(durations) * 1e3, 3),
+    'max': round(max(durations) * 1e3, 3),
+    'runs': len(durations)
+  }
+  result.update(extra)
+  return result
+
+def measure(root, args):
+  """Time the control plane operations on the generated flow
+
+  Returns:
+    Summary by operation
+  """
+  results = {}
+  rand = random.Random(1)
+
+  if args.costly:
+    # Every component of the generated library is used by the flow, so imported at startup anyway
+    paths = addCostly(BenchmarkFlow.library, args.costly, args.import_cost)
+    try:
+      durations, flow = startup(root, args.repeat, True)
+      flow.stop()
+      results['startupColdCostly'] = summary(durations, costly=args.costly)
+      durations, flow = startup(root, args.repeat, False)
+      flow.stop()
+      results['startupWarmCostly'] = summary(durations, costly=args.costly)
+    finally:
+      for path in paths:
+        os.remove(path)
+
+  durations, flow = startup(root, args.repeat, True)
+  flow.stop()
+  results['startupCold'] = summary(durations)
+
+  durations, flow = startup(root, args.repeat, False)
+  results['startupWarm'] = summary(durations, instances=len(flow.instances), components=len(flow.componentLibrary))
+
+  # Designer clients of the current protocol, and one of the legacy one with --legacy: it gets the whole designer on each change
+  server = flow._WSServer
+  server.clients = [BenchmarkClient(Protocol.JSON)] + ([BenchmarkClient(Protocol.QUOTED)] if args.legacy else [])
+  client = server.clients[0]
+
+  try:
+    files = sorted(f for f in os.listdir(BenchmarkFlow.library) if f.endswith('.py'))
+    modules = [(flow.importModule(os.path.join(BenchmarkFlow.library, f)), f) for f in files]
+    durations = []
+    for i in range(args.repeat):
+      begin = time.perf_counter()
+      for mod, file in modules:
+        flow.selfRegisterComponent(mod, file)
+      durations.append(time.perf_counter() - begin)
+    results['selfRegisterComponent'] = summary(durations, components=len(modules))
+
+    ids = list(flow.instances)
+    durations = []
+    for i in range(args.edits):
+      id = rand.choice(ids)
+      begin = time.perf_counter()
+      flow.applyChanges([{'type': 'mov', 'com': {'id': id, 'x': rand.randrange(3000), 'y': rand.randrange(3000)}}])
+      durations.append(time.perf_counter() - begin)
+    results['move'] = summary(durations)
+
+    durations = []
+    for i in range(args.edits):
+      id = rand.choice(ids)
+      begin = time.perf_counter()
+      flow.onMessage({'type': 'options', 'target': id, 'body': {'value': i, 'text': 'Changed option %d' % (i,), 'comname': 'Node %s' % (id,)}}, client)
+      durations.append(time.perf_counter() - begin)
+    results['options'] = summary(durations)
+
+    added, removed = [], []
+    library = sorted(flow.componentLibrary)
+    for r in range(args.repeat):
+      changes = [{'type': 'add', 'com': {
+        'id': 'added%d-%d' % (r, i),
+        'component': library[i % len(library)],
+        'x': i % 20 * 150,
+        'y': i // 20 * 100,
+        'state': {'text': '', 'color': ''},
+        'tab': 'tab0',
+        'disabledio': {'input': [], 'output': []},
+        'connections': {'0': [{'id': 'added%d-%d' % (r, i + 1), 'index': '0'}]} if i + 1 < args.add else {},
+        'options': {'value': i}
+      }} for i in range(args.add)]
+      begin = time.perf_counter()
+      flow.applyChanges(changes)
+      added.append(time.perf_counter() - begin)
+
+      changes = [{'type': 'rem', 'id': change['com']['id']} for change in changes]
+      begin = time.perf_counter()
+      flow.applyChanges(changes)
+      removed.append(time.perf_counter() - begin)
+    results['applyAdd'] = summary(added, nodes=args.add)
+    results['applyRemove'] = summary(removed, nodes=args.add)
+
+    durations = []
+    writes = []
+    for i in range(args.repeat):
+      begin = time.perf_counter()
+      flow.save()
+      durations.append(time.perf_counter() - begin)
+      # The snapshot is written by the journal thread, timed alone here
+      text = json.dumps([ist.save() for ist in flow.instances.values()])
+      begin = time.perf_counter()
+      Journal.writeAtomic(os.path.join(root, 'snapshot'), text)
+      writes.append(time.perf_counter() - begin)
+    results['save'] = summary(durations)
+    results['snapshotWrite'] = summary(writes, bytes=len(text))
+
+    for protocol in (Protocol.JSON, Protocol.QUOTED):
+      durations = []
+      encoded = []
+      for i in range(args.repeat):
+        newClient = BenchmarkClient(protocol)
+        begin = time.perf_counter()
+        flow.onConnect(newClient)
+        durations.append(time.perf_counter() - begin)
+        begin = time.perf_counter()
+        opcode, data = newClient.messages[0].payload(newClient)[1:]
+        encoded.append(time.perf_counter() - begin)
+      results['onConnect-' + protocol] = summary(durations)
+      results['snapshotEncode-' + protocol] = summary(encoded, bytes=len(data))
+  finally:
+    flow.stop()
+  return results
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--instances', help='Nodes of the generated flow', type=int, default=10000)
+  parser.add_argument('--tabs', help='Tabs of the generated flow', type=int, default=50)
+  parser.add_argument('--library', help='Components of the generated library', type=int, default=300)
+  parser.add_argument('--add', help='Nodes added by one apply', type=int, default=1000)
+  parser.add_argument('--edits', help='Single node moves and options changes', type=int, default=200)
+  parser.add_argument('--repeat', help='Runs of the other operations', type=int, default=5)
+  parser.add_argument('--costly', help='Components with a costly import added for the startups, 0 to skip them', type=int, default=50)
+  parser.add_argument('--import-cost', help='Import time of a costly component, in milliseconds', type=float, default=20)
+  parser.add_argument('--legacy', help='Connect a client of the legacy protocol, sent the whole designer on each change', action='store_true')
+  parser.add_argument('--output', help='JSON file of the results', default=os.path.join(tempfile.gettempdir(), 'ControlPlaneBenchmark.json'))
+  parser.add_argument('--compare', help='JSON file of previous results, to show the median ratios')
+  args = parser.parse_args()
+
+  logging.root.setLevel(logging.ERROR)
+
+  previous = {}
+  if args.compare:
+    with open(args.compare, 'r') as file:
+      previous = json.load(file)['results']
+
+  root = tempfile.mkdtemp(prefix='controlplanebenchmark-')
+  try:
+    BenchmarkFlow.library = generate(root, args.instances, args.tabs, args.library)
+    results = measure(root, args)
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+
+  print('%24s%14s%14s%14s%12s%10s' % ('operation', 'median (ms)', 'min (ms)', 'max (ms)', 'bytes', 'ratio'))
+  for operation, result in results.items():
+    old = previous.get(operation)
+    ratio = '%9.2fx' % (result['median'] / old['median']) if old and old['median'] else '%10s' % '-'
+    print('%24s%14.3f%14.3f%14.3f%12s%s' % (operation, result['median'], result['min'], result['max'], result.get('bytes', '-'), ratio))
+
+  with open(args.output, 'w') as file:
+    json.dump({
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'instances': args.instances,
+      'tabs': args.tabs,
+      'library': args.library,
+      'costly': args.costly,
+      'importCost': args.import_cost,
+      'legacy': args.legacy,
+      'results': results
+    }, file, indent=2)
+  print('Results written to %s' % (args.output,))
@@ -0,0 +1,239 @@
+"""
+  FlowBenchmark - Data plane throughput of Flow and Component, without the WebSocket server
+
+  Builds synthetic topologies of relay components in a Flow with a stub server, sends timestamped
+  payloads from their sources and measures, for each inbox capacity and payload size:
+    - messages and deliveries (handler calls) per second
+    - end to end and per hop latency
+    - peak traced memory and blocks still allocated after the run (second run, under tracemalloc)
+  The capacities are the default one of the scheduler, with its backpressure, and 0 for inboxes with
+  room for all the payloads of a run.
+
+  Usage (from the backend folder):
+    python benchmarks/FlowBenchmark.py [--topologies chain,fanout,fanin,diamond,errors] [--sizes 16,1024,65536]
+                                       [--messages 2000] [--depth 20] [--width 20] [--workers 0] [--capacities 1000,0]
+                                       [--output /tmp/FlowBenchmark.json] [--compare previous.json]
+"""
+
+import os, sys, gc, json, time, shutil, logging, platform, resource, tempfile, argparse, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+logging.websocket = (lambda *argv: None)
+
+from backend.Scheduler import Scheduler
+from backend.Histogram import Histogram
+from backend.Flow import Flow
+
+TOPOLOGIES = ('chain', 'fanout', 'fanin', 'diamond', 'errors')
+
+class BenchmarkServer:
+  """Server without clients: the messages of the flow are only counted
+  """
+  def __init__(self):
+    self.clients = []
+    self.messages = 0
+
+  def send(self, message):
+    self.messages += 1
+
+class BenchmarkEncoder:
+  """Encoder never called, there is no client to send frames to
+  """
+  def encode(self, opcode, data, mask=0, rsv1=0):
+    return data
+
+class BenchmarkFlow(Flow):
+  """Flow loading its component library from an empty temporary folder, the relay is registered directly
+  """
+  library = None
+
+  def load(self):
+    self.componentsPath = BenchmarkFlow.library
+    super().load()
+
+def install(instance):
+  """Relay: sends the data through its output, or its error output for the 'error' role.
+  Sinks count the payloads and record their latency from the send time carried with the data.
+  """
+  role = instance.options['role']
+  if role == 'sink':
+    instance.custom['count'] = 0
+    instance.custom['latency'] = Histogram()
+    def onData(self, args):
+      self.custom['latency'].record(time.perf_counter_ns() - args[0].data[0])
+      self.custom['count'] += 1
+  elif role == 'error':
+    def onData(self, args):
+      self.throw(args[0].data)
+  else:
+    def onData(self, args):
+      self.send(args[0].data)
+  instance.on('data', onData)
+
+RELAY = {
+  'id': 'benchmark-relay',
+  'component': 'benchmark-relay',
+  'name': 'Benchmark relay',
+  'color': '#000000',
+  'icon': '',
+  'input': 1,
+  'output': 1,
+  'options': {},
+  'fn': install,
+  'filename': 'benchmark-relay'
+}
+
+def node(id, role, targets=(), port='0'):
+  """Change adding a relay connected to targets
+  """
+  return {'type': 'add', 'com': {
+    'id': id,
+    'component': RELAY['id'],
+    'x': 0,
+    'y': 0,
+    'tab': 'benchmark',
+    'state': {'text': '', 'color': ''},
+    'disabledio': {'input': [], 'output': []},
+    'options': {'role': role},
+    'connections': {port: [{'id': target, 'index': '0'} for target in targets]} if targets else {}
+  }}
+
+def topology(name, depth, width):
+  """Changes building a topology, its sources, its sinks with the payloads expected by each one, and the hops of a payload
+  """
+  if name == 'chain':
+    changes = [node('src', 'relay', ['r1'])] + [node('r%d' % i, 'relay', ['r%d' % (i + 1) if i < depth else 'sink']) for i in range(1, depth + 1)]
+    return changes + [node('sink', 'sink')], ['src'], {'sink': 1}, depth + 1
+  if name == 'fanout':
+    sinks = ['sink%d' % i for i in range(width)]
+    return [node('src', 'relay', sinks)] + [node(sink, 'sink') for sink in sinks], ['src'], {sink: 1 for sink in sinks}, 1
+  if name == 'fanin':
+    sources = ['src%d' % i for i in range(width)]
+    return [node(src, 'relay', ['sink']) for src in sources] + [node('sink', 'sink')], sources, {'sink': 1}, 1
+  if name == 'diamond':
+    middles = ['m%d' % i for i in range(width)]
+    changes = [node('src', 'relay', middles)] + [node(m, 'relay', ['sink']) for m in middles]
+    return changes + [node('sink', 'sink')], ['src'], {'sink': width}, 2
+  if name == 'errors':
+    # Every hop after the source goes through the error output, delivered first by the scheduler
+    changes = [node('src', 'relay', ['e1'])] + [node('e%d' % i, 'error', ['e%d' % (i + 1) if i < depth else 'sink'], '99') for i in range(1, depth + 1)]
+    return changes + [node('sink', 'sink')], ['src'], {'sink': 1}, depth + 1
+  raise ValueError('Unknown topology %s' % (name,))
+
+def run(name, size, messages, depth, width, workers, capacity=0, traced=False, timeout=600):
+  """Send messages payloads of size bytes through a topology in a new Flow.
+  With a capacity of 0, the inboxes have room for all the payloads: the run measures the deliveries without the backpressure.
+
+  Returns:
+    Measures of the run
+  """
+  path = tempfile.mkdtemp(prefix='flowbenchmark-')
+  server = BenchmarkServer()
+  capacity = capacity or messages * max(width, 1)
+  flow = BenchmarkFlow(server, BenchmarkEncoder(), path, trafficInterval=3600, workers=workers, queueCapacity=capacity, timing=False)
+  try:
+    flow.registerComponent(dict(RELAY), RELAY['filename'] + '.py')
+    changes, sources, sinks, hops = topology(name, depth, width)
+    flow.applyChanges(changes)
+    sources = [flow.instances[id] for id in sources]
+    sinks = {flow.instances[id]: count * messages for id, count in sinks.items()}
+    blob = os.urandom(size)
+
+    gc.collect()
+    if traced:
+      tracemalloc.start()
+      start = tracemalloc.get_traced_memory()[0]
+    blocks = sys.getallocatedblocks()
+    begin = time.perf_counter()
+    for i in range(messages):
+      sources[i % len(sources)].send((time.perf_counter_ns(), blob))
+    deadline = begin + timeout
+    while any(sink.custom['count'] < count for sink, count in sinks.items()):
+      if time.perf_counter() > deadline:
+        raise TimeoutError('%s: payloads still missing after %d seconds' % (name, timeout))
+      time.sleep(0.001)
+    elapsed = time.perf_counter() - begin
+
+    result = {}
+    if traced:
+      result['peakMemory'] = tracemalloc.get_traced_memory()[1] - start
+      tracemalloc.stop()
+      gc.collect()
+      result['retainedBlocks'] = sys.getallocatedblocks() - blocks
+      return result
+
+    latency = Histogram()
+    for sink in sinks:
+      latency.merge(sink.custom['latency'])
+    return {
+      'seconds': round(elapsed, 6),
+      'messagesPerSecond': round(messages / elapsed, 1),
+      'deliveriesPerSecond': round(sum(sink.custom['count'] for sink in sinks) * hops / elapsed, 1),
+      'latency': {
+        'mean': round(latency.sum / max(latency.count, 1) / 1e3, 2),
+        'p50': round(latency.percentile(50) * 1e6, 2),
+        'p99': round(latency.percentile(99) * 1e6, 2)
+      },
+      'hopLatency': round(latency.sum / max(latency.count, 1) / 1e3 / hops, 2),
+      'hops': hops
+    }
+  finally:
+    flow.stop()
+    shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--topologies', help='Comma separated topologies among %s' % ','.join(TOPOLOGIES), default=','.join(TOPOLOGIES))
+  parser.add_argument('--sizes', help='Comma separated payload sizes in bytes', default='16,1024,65536')
+  parser.add_argument('--messages', help='Payloads sent by run', type=int, default=2000)
+  parser.add_argument('--depth', help='Relays of the chain and errors topologies', type=int, default=20)
+  parser.add_argument('--width', help='Branches of the fanout, fanin and diamond topologies', type=int, default=20)
+  parser.add_argument('--workers', help='Scheduler threads, 0 delivers in the sending thread', type=int, default=0)
+  parser.add_argument('--capacities', help='Comma separated inbox capacities of the components, 0 for room for all the payloads of a run', default='%d,0' % Scheduler.QUEUE_CAPACITY)
+  parser.add_argument('--no-memory', help='Skip the second run measuring the memory under tracemalloc', action='store_true')
+  parser.add_argument('--output', help='JSON file of the results', default=os.path.join(tempfile.gettempdir(), 'FlowBenchmark.json'))
+  parser.add_argument('--compare', help='JSON file of previous results, to show the throughput ratios')
+  args = parser.parse_args()
+
+  logging.root.setLevel(logging.ERROR)
+
+  previous = {}
+  if args.compare:
+    with open(args.compare, 'r') as file:
+      previous = {(r['topology'], r['size'], r.get('capacity', 0)): r for r in json.load(file)['results']}
+
+  BenchmarkFlow.library = tempfile.mkdtemp(prefix='flowbenchmark-components-')
+  results = []
+  print('%10s%10s%10s%14s%16s%12s%12s%12s%14s%10s' % ('topology', 'capacity', 'size', 'msg/s', 'deliveries/s', 'p50 (us)', 'p99 (us)', 'hop (us)', 'peak (KB)', 'ratio'))
+  try:
+    for name in args.topologies.split(','):
+      for capacity in [int(c) for c in args.capacities.split(',')]:
+        for size in [int(s) for s in args.sizes.split(',')]:
+          result = {'topology': name, 'capacity': capacity, 'size': size, 'messages': args.messages}
+          result.update(run(name, size, args.messages, args.depth, args.width, args.workers, capacity))
+          if not args.no_memory:
+            result.update(run(name, size, args.messages, args.depth, args.width, args.workers, capacity, traced=True))
+          results.append(result)
+
+          old = previous.get((name, size, capacity))
+          ratio = '%9.2fx' % (result['messagesPerSecond'] / old['messagesPerSecond']) if old else '%10s' % '-'
+          peak = '%.1f' % (result['peakMemory'] / 1024) if 'peakMemory' in result else '-'
+          print('%10s%10s%10d%14.0f%16.0f%12.1f%12.1f%12.2f%14s%s' % (name, capacity or '-', size, result['messagesPerSecond'], result['deliveriesPerSecond'],
+            result['latency']['p50'], result['latency']['p99'], result['hopLatency'], peak, ratio))
+  finally:
+    shutil.rmtree(BenchmarkFlow.library, ignore_errors=True)
+
+  with open(args.output, 'w') as file:
+    json.dump({
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'workers': args.workers,
+      'capacities': args.capacities,
+      'depth': args.depth,
+      'width': args.width,
+      'maxRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+      'results': results
+    }, file, indent=2)
+  print('Results written to %s' % (args.output,))
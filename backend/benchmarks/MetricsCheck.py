@@ -0,0 +1,243 @@
+"""
+  MetricsCheck - Check the /metrics endpoint against the Prometheus text format
+
+  Starts a MetricsServer on an ephemeral port over a small flow with a stub WebSocket server, sends
+  payloads through its relays, scrapes /metrics like a local Prometheus would and checks that:
+    - the content type is the text format 0.0.4, every line matches the grammar of the format
+    - every sample belongs to a family declared by # HELP and # TYPE before it, with no duplicate series
+    - counters and histograms are not negative, buckets are cumulative and end with +Inf equal to _count
+    - the counters of the relays match the payloads sent
+  With --url, only the format of a running endpoint is checked.
+
+  Usage (from the backend folder):
+    python benchmarks/MetricsCheck.py [--messages 100] [--url http://127.0.0.1:9100/metrics]
+"""
+
+import os, re, sys, math, shutil, logging, tempfile, argparse, urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+logging.websocket = (lambda *argv: None)
+
+from backend.MetricsServer import MetricsServer
+from backend.Flow import Flow
+
+NAME = r'[a-zA-Z_:][a-zA-Z0-9_:]*'
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+VALUE = r'[-+]?(?:[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?|Inf|NaN)'
+SAMPLE = re.compile(r'^(%s)(?:\{((?:%s)(?:,%s)*)?,?\})? (%s)(?: -?[0-9]+)?$' % (NAME, LABEL, LABEL, VALUE))
+COMMENT = re.compile(r'^# (HELP|TYPE) (%s) (.*)$' % (NAME,))
+LABELS = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\\n]|\\[\\"n])*)"')
+TYPES = ('counter', 'gauge', 'histogram', 'summary', 'untyped')
+
+class CheckServer:
+  """WebSocket server without clients, with the counters read by the metrics
+  """
+  def __init__(self):
+    self.clients = []
+    self.broadcastBytes = 0
+
+  def send(self, message):
+    pass
+
+  def dropped(self):
+    return 0
+
+class CheckEncoder:
+  """Encoder never called, there is no client to send frames to
+  """
+  def encode(self, opcode, data, mask=0, rsv1=0):
+    return data
+
+class CheckFlow(Flow):
+  """Flow loading its component library from an empty temporary folder, the relay is registered directly
+  """
+  library = None
+
+  def load(self):
+    self.componentsPath = CheckFlow.library
+    super().load()
+
+def install(instance):
+  """Relay to the output
+  """
+  def onData(self, args):
+    self.send(args[0].data)
+  instance.on('data', onData)
+
+RELAY = {
+  'id': 'check-relay',
+  'name': 'Check relay',
+  'color': '#000000',
+  'icon': '',
+  'input': 1,
+  'output': 1,
+  'options': {},
+  'fn': install,
+  'filename': 'check-relay'
+}
+
+def node(id, name, targets=()):
+  """Change adding a relay connected to targets
+  """
+  return {'type': 'add', 'com': {
+    'id': id,
+    'component': RELAY['id'],
+    'name': name,
+    'x': 0,
+    'y': 0,
+    'tab': 'check',
+    'state': {'text': '', 'color': ''},
+    'disabledio': {'input': [], 'output': []},
+    'options': {},
+    'connections': {'0': [{'id': target, 'index': '0'} for target in targets]} if targets else {}
+  }}
+
+def scrape(url):
+  """Content type and text of the endpoint
+  """
+  with urllib.request.urlopen(url, timeout=10) as response:
+    return response.headers.get('Content-Type'), response.read().decode('UTF-8')
+
+def parse(text):
+  """Families (name -> type) and samples (name, labels, value) of an exposition, and the errors found
+  """
+  errors = []
+  families = {}
+  helps = set()
+  samples = []
+  series = set()
+  if not text.endswith('\n'):
+    errors.append('Exposition not ending with a line feed')
+  for number, line in enumerate(text.split('\n')[:-1], 1):
+    comment = COMMENT.match(line)
+    if comment is not None:
+      kind, name, rest = comment.groups()
+      if kind == 'HELP':
+        if name in helps:
+          errors.append('%d: second HELP of %s' % (number, name))
+        helps.add(name)
+      elif rest not in TYPES:
+        errors.append('%d: unknown type %s of %s' % (number, rest, name))
+      elif name in families:
+        errors.append('%d: second TYPE of %s' % (number, name))
+      elif any(sample[0] in (name, name + '_bucket', name + '_sum', name + '_count') for sample in samples):
+        errors.append('%d: TYPE of %s after its samples' % (number, name))
+      else:
+        families[name] = rest
+      continue
+    if line.startswith('#'):
+      continue
+    sample = SAMPLE.match(line)
+    if sample is None:
+      errors.append('%d: not a valid sample line: %r' % (number, line))
+      continue
+    name, labels, value = sample.groups()
+    labels = dict(LABELS.findall(labels or ''))
+    family = name
+    for suffix in ('_bucket', '_sum', '_count'):
+      if name.endswith(suffix) and families.get(name[:-len(suffix)]) == 'histogram':
+        family = name[:-len(suffix)]
+    if family not in families:
+      errors.append('%d: sample of %s without TYPE' % (number, name))
+    key = (name, tuple(sorted(labels.items())))
+    if key in series:
+      errors.append('%d: duplicate series %s%s' % (number, name, labels))
+    series.add(key)
+    value = float(value)
+    if families.get(family) in ('counter', 'histogram') and not value >= 0:
+      errors.append('%d: negative %s %s' % (number, families[family], name))
+    samples.append((name, labels, value))
+  return families, samples, errors
+
+def checkHistograms(families, samples):
+  """Errors of the buckets of the histogram families
+  """
+  errors = []
+  for family in [name for name, type in families.items() if type == 'histogram']:
+    buckets = {}
+    counts = {}
+    for name, labels, value in samples:
+      key = tuple(sorted((k, v) for k, v in labels.items() if k != 'le'))
+      if name == family + '_bucket':
+        if 'le' not in labels:
+          errors.append('%s bucket without le' % (family,))
+          continue
+        buckets.setdefault(key, []).append((float(labels['le']), value))
+      elif name == family + '_count':
+        counts[key] = value
+    for key, bounds in buckets.items():
+      if [bound for bound, value in bounds] != sorted(bound for bound, value in bounds):
+        errors.append('%s%s: buckets not in order of their bounds' % (family, dict(key)))
+      if any(bounds[i][1] < bounds[i - 1][1] for i in range(1, len(bounds))):
+        errors.append('%s%s: buckets not cumulative' % (family, dict(key)))
+      if not math.isinf(bounds[-1][0]):
+        errors.append('%s%s: no +Inf bucket' % (family, dict(key)))
+      elif counts.get(key) != bounds[-1][1]:
+        errors.append('%s%s: +Inf bucket %s but _count %s' % (family, dict(key), bounds[-1][1], counts.get(key)))
+  return errors
+
+def check(url, counts=None):
+  """Scrape an endpoint and check its exposition, and the input counters of the components when given
+
+  Returns:
+    Errors found, the samples read
+  """
+  contentType, text = scrape(url)
+  errors = []
+  if contentType != MetricsServer.CONTENT_TYPE:
+    errors.append('Content type %s' % (contentType,))
+  families, samples, parseErrors = parse(text)
+  errors += parseErrors + checkHistograms(families, samples)
+  for id, expected in (counts or {}).items():
+    values = [value for name, labels, value in samples if name == 'flow_component_input_messages_total' and labels.get('component') == id]
+    if values != [expected]:
+      errors.append('flow_component_input_messages_total of %s: %s instead of %d' % (id, values, expected))
+  return errors, samples
+
+def run(messages):
+  """Check the endpoint of a MetricsServer on an ephemeral port over a chain of relays
+  """
+  path = tempfile.mkdtemp(prefix='metricscheck-')
+  flow = CheckFlow(CheckServer(), CheckEncoder(), path, trafficInterval=3600, workers=0)
+  metrics = None
+  try:
+    flow.registerComponent(dict(RELAY), RELAY['filename'] + '.py')
+    # Names to escape in the label values
+    flow.applyChanges([
+      node('src', 'Source "quoted"', ['relay']),
+      node('relay', 'Back\\slash', ['sink']),
+      node('sink', 'Line\nfeed')
+    ])
+    for i in range(messages):
+      flow.instances['src'].send(i)
+
+    metrics = MetricsServer(flow, flow._WSServer, '127.0.0.1', 0)
+    metrics.start()
+    return check('http://127.0.0.1:%d/metrics' % (metrics.http.server_address[1],), {'relay': messages, 'sink': messages})
+  finally:
+    if metrics is not None:
+      metrics.stop()
+    flow.stop()
+    shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--messages', help='Payloads sent through the relays', type=int, default=100)
+  parser.add_argument('--url', help='Endpoint of a running server to check instead')
+  args = parser.parse_args()
+
+  logging.root.setLevel(logging.ERROR)
+
+  if args.url:
+    errors, samples = check(args.url)
+  else:
+    CheckFlow.library = tempfile.mkdtemp(prefix='metricscheck-components-')
+    try:
+      errors, samples = run(args.messages)
+    finally:
+      shutil.rmtree(CheckFlow.library, ignore_errors=True)
+  for error in errors:
+    print(error)
+  print('%d samples, %d errors' % (len(samples), len(errors)))
+  sys.exit(1 if errors else 0)
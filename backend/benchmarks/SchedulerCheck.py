@@ -0,0 +1,193 @@
+"""
+  SchedulerCheck - Check the block policy of the inboxes with small capacities
+
+  Runs flows of relays where one slow sink receives from many branches (fan in and diamond), and a
+  cycle of two relays, with the block policy, a small inbox capacity and the scheduler workers, and
+  checks that:
+    - every payload reaches its sink before the timeout, the workers are never all blocked
+    - the inboxes fed by the workers never hold more deliveries than their capacity
+  The sources send from the main thread, which may wait for room like any thread out of the scheduler.
+  The deliveries of a cycle are queued over the capacity instead of holding its components for each other:
+  the cycle only has to end.
+
+  Usage (from the backend folder):
+    python benchmarks/SchedulerCheck.py [--messages 2000] [--width 5] [--capacity 20] [--workers 4] [--timeout 60]
+"""
+
+import os, sys, time, shutil, logging, tempfile, argparse, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+logging.websocket = (lambda *argv: None)
+
+from backend.Scheduler import Scheduler
+from backend.Flow import Flow
+
+class CheckServer:
+  """Server without clients
+  """
+  def __init__(self):
+    self.clients = []
+
+  def send(self, message):
+    pass
+
+class CheckEncoder:
+  """Encoder never called, there is no client to send frames to
+  """
+  def encode(self, opcode, data, mask=0, rsv1=0):
+    return data
+
+class CheckFlow(Flow):
+  """Flow loading its component library from an empty temporary folder
+  """
+  library = None
+
+  def load(self):
+    self.componentsPath = CheckFlow.library
+    super().load()
+
+def install(instance):
+  """Relay, slow sink counting the payloads, or loop relay sending its data back until its hop count is spent
+  """
+  role = instance.options['role']
+  if role == 'sink':
+    instance.custom['count'] = 0
+    def onData(self, args):
+      time.sleep(0.0002)
+      self.custom['count'] += 1
+  elif role == 'loop':
+    def onData(self, args):
+      hops = args[0].data
+      if hops > 0:
+        self.send(hops - 1, 0)
+      else:
+        self.send(None, 1)
+  else:
+    def onData(self, args):
+      self.send(args[0].data)
+  instance.on('data', onData)
+
+RELAY = {
+  'id': 'check-relay',
+  'name': 'Check relay',
+  'color': '#000000',
+  'icon': '',
+  'input': 1,
+  'output': 2,
+  'options': {},
+  'fn': install,
+  'filename': 'check-relay'
+}
+
+def node(id, role, targets=(), port='0', more=None):
+  """Change adding a relay connected to targets, and to more on its second output
+  """
+  connections = {port: [{'id': target, 'index': '0'} for target in targets]} if targets else {}
+  if more:
+    connections['1'] = [{'id': target, 'index': '0'} for target in more]
+  return {'type': 'add', 'com': {
+    'id': id,
+    'component': RELAY['id'],
+    'x': 0,
+    'y': 0,
+    'tab': 'check',
+    'state': {'text': '', 'color': ''},
+    'disabledio': {'input': [], 'output': []},
+    'options': {'role': role},
+    'connections': connections
+  }}
+
+def topology(name, width):
+  """Changes building a topology, its sources, the nodes they feed and the payloads expected by its sink for each payload sent
+  """
+  if name == 'fanin':
+    sources = ['src%d' % i for i in range(width)]
+    relays = ['r%d' % i for i in range(width)]
+    changes = [node(src, 'relay', [r]) for src, r in zip(sources, relays)] + [node(r, 'relay', ['sink']) for r in relays]
+    return changes + [node('sink', 'sink')], sources, relays, 1
+  if name == 'diamond':
+    middles = ['m%d' % i for i in range(width)]
+    changes = [node('src', 'relay', middles)] + [node(m, 'relay', ['sink']) for m in middles]
+    return changes + [node('sink', 'sink')], ['src'], middles, width
+  if name == 'cycle':
+    # a and b send the data to each other, then to the sink when its hop count is spent
+    changes = [node('src', 'relay', ['in']), node('in', 'relay', ['a']), node('a', 'loop', ['b'], more=['sink']), node('b', 'loop', ['a'], more=['sink'])]
+    return changes + [node('sink', 'sink')], ['src'], ['in'], 1
+  raise ValueError('Unknown topology %s' % (name,))
+
+def run(name, args):
+  """Send the payloads through a topology and watch the depth of the inboxes
+
+  Returns:
+    Errors found, seconds of the run and deepest inbox seen
+  """
+  path = tempfile.mkdtemp(prefix='schedulercheck-')
+  flow = CheckFlow(CheckServer(), CheckEncoder(), path, trafficInterval=3600, workers=args.workers,
+    queueCapacity=args.capacity, queuePolicy=Scheduler.BLOCK, timing=False)
+  errors = []
+  deepest = 0
+  stopped = threading.Event()
+  try:
+    flow.registerComponent(dict(RELAY), RELAY['filename'] + '.py')
+    changes, sources, fed, perMessage = topology(name, args.width)
+    flow.applyChanges(changes)
+    sink = flow.instances['sink']
+    expected = args.messages * perMessage
+
+    # Deliveries from the workers never overflow, the sources out of the scheduler may after BLOCK_TIMEOUT
+    watched = [id for id in flow.instances if id not in fed]
+    def watch():
+      nonlocal deepest
+      while not stopped.wait(0.0005):
+        for id in watched:
+          inbox = flow.scheduler.inboxes.get(id)
+          if inbox is not None:
+            deepest = max(deepest, len(inbox.normal))
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+
+    begin = time.perf_counter()
+    for i in range(args.messages):
+      flow.instances[sources[i % len(sources)]].send(10 if name == 'cycle' else i)
+    while sink.custom['count'] < expected:
+      if time.perf_counter() - begin > args.timeout:
+        errors.append('%s: %d payloads out of %d after %d seconds' % (name, sink.custom['count'], expected, args.timeout))
+        break
+      time.sleep(0.001)
+    elapsed = time.perf_counter() - begin
+    stopped.set()
+    watcher.join()
+    if deepest > args.capacity and name != 'cycle':
+      errors.append('%s: %d deliveries in an inbox of capacity %d' % (name, deepest, args.capacity))
+    return errors, elapsed, deepest
+  finally:
+    stopped.set()
+    flow.stop()
+    shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--topologies', help='Comma separated topologies among fanin,diamond,cycle', default='fanin,diamond,cycle')
+  parser.add_argument('--messages', help='Payloads sent by run', type=int, default=2000)
+  parser.add_argument('--width', help='Branches of the fan in and diamond topologies', type=int, default=5)
+  parser.add_argument('--capacity', help='Inbox capacity of the components', type=int, default=20)
+  parser.add_argument('--workers', help='Scheduler threads', type=int, default=4)
+  parser.add_argument('--timeout', help='Seconds waited for the payloads of a run', type=float, default=60)
+  args = parser.parse_args()
+
+  logging.root.setLevel(logging.ERROR)
+
+  CheckFlow.library = tempfile.mkdtemp(prefix='schedulercheck-components-')
+  errors = []
+  try:
+    for name in args.topologies.split(','):
+      found, elapsed, deepest = run(name, args)
+      errors += found
+      print('%10s%10.2fs%10.0f msg/s   deepest inbox %d/%d' % (name, elapsed, args.messages / elapsed, deepest, args.capacity))
+  finally:
+    shutil.rmtree(CheckFlow.library, ignore_errors=True)
+
+  for error in errors:
+    print(error)
+  sys.exit(1 if errors else 0)
@@ -0,0 +1,472 @@
+"""
+  WSLoadBenchmark - Load test of a running server with simulated designer clients
+
+  Opens N masked WebSocket connections to a server on localhost, then some of the clients (editors)
+  replay designer traffic: apply (node moves), options, variables and event messages. Measures:
+    - handshake time, and time until the designer is received
+    - broadcast fan-out latency: from an apply to its patch (or designer) on every client
+    - bandwidth received and sent by each client
+    - CPU and memory of the server process, sampled with psutil
+
+  The harness adds its own nodes to the flow and removes them at the end, the variables of the flow
+  are restored. Latencies include the time the harness takes to read the frames of all its clients:
+  with many clients, check that its own process is not saturated (its CPU time is reported).
+
+  Usage (from the backend folder), with a server started with --max-clients larger than the clients, and
+  with -a or a --backlog large enough for the concurrent handshakes:
+    python benchmarks/WSLoadBenchmark.py [--port 5001] [--clients 100] [--editors 5] [--rate 10] [--duration 10]
+                                         [--protocol json] [--mix apply=4,options=2,variables=1,event=1]
+                                         [--pid SERVERPID] [--output /tmp/WSLoadBenchmark.json] [--compare previous.json]
+"""
+
+import os, sys, json, time, base64, random, struct, asyncio, logging, platform, tempfile, argparse, statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+logging.websocket = (lambda *argv: None)
+
+import psutil
+
+from websocket.WSEncoder import WSEncoder
+from backend.Protocol import Protocol
+
+MESSAGES = ('apply', 'options', 'variables', 'event')
+
+class LoadClient:
+  """Designer session over one masked WebSocket connection
+  """
+  def __init__(self, harness, index):
+    self.harness = harness
+    self.index = index
+    self.encoder = WSEncoder()
+    self.reader = None
+    self.writer = None
+    self.task = None
+    self.handshake = None
+    self.designer = None
+    self.designerReceived = asyncio.Event()
+    self.bytesReceived = 0
+    self.bytesSent = 0
+    self.received = {}
+    # Messages that could not be decoded, or without the fields of their type
+    self.protocolErrors = 0
+    # Last x seen for each node of the harness, moves are only counted once
+    self.positions = {}
+
+  async def connect(self, host, port, protocol):
+    """Open the connection and read the handshake response
+    """
+    begin = time.perf_counter()
+    self.reader, self.writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode('UTF-8')
+    self.writer.write(('GET /?protocol=%s HTTP/1.1\r\n'
+      'Host: %s:%d\r\n'
+      'Origin: http://%s\r\n'
+      'Upgrade: websocket\r\n'
+      'Connection: Upgrade\r\n'
+      'Sec-WebSocket-Key: %s\r\n'
+      'Sec-WebSocket-Version: 13\r\n\r\n' % (protocol, host, port, host, key)).encode('UTF-8'))
+    response = await self.reader.readuntil(b'\r\n\r\n')
+    if not response.startswith(b'HTTP/1.1 101'):
+      raise ConnectionError('Handshake refused: %s' % (response.split(b'\r\n')[0].decode('UTF-8', 'replace'),))
+    self.handshake = time.perf_counter() - begin
+    self.connected = time.perf_counter()
+    self.task = asyncio.ensure_future(self.read())
+
+  async def frame(self):
+    """Next frame from the server: fin, opcode and payload
+    """
+    b1, b2 = await self.reader.readexactly(2)
+    length = b2 & 0x7f
+    size = 2
+    if length == 126:
+      length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+      size += 2
+    elif length == 127:
+      length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+      size += 8
+    if b2 & 0x80:
+      await self.reader.readexactly(4)
+      size += 4
+    payload = await self.reader.readexactly(length) if length else b''
+    self.bytesReceived += size + length
+    return b1 >> 7, b1 & 0x0f, payload
+
+  async def read(self):
+    """Decode the messages of the server until the connection is closed, skipping the invalid ones
+    """
+    chunks = []
+    opcode = 0x1
+    try:
+      while True:
+        fin, frameOpcode, payload = await self.frame()
+        if frameOpcode == 0x8:
+          return
+        if frameOpcode == 0x9:
+          await self.send(payload, 0xA)
+          continue
+        if frameOpcode in (0x1, 0x2):
+          opcode = frameOpcode
+        elif frameOpcode != 0x0:
+          continue
+        chunks.append(payload)
+        if fin:
+          data = b''.join(chunks)
+          chunks = []
+          try:
+            message = Protocol.decode(data.decode('UTF-8') if opcode == 0x1 else data, self.harness.protocol)
+            if not isinstance(message, dict):
+              raise ValueError('Message is not an object')
+            self.onMessage(message)
+          except (ValueError, KeyError, TypeError):
+            # Counted, the next messages are still read
+            self.protocolErrors += 1
+    except (asyncio.IncompleteReadError, ConnectionError):
+      return
+
+  def onMessage(self, message):
+    now = time.perf_counter()
+    type = message.get('type', message.get('event', ''))
+    self.received[type] = self.received.get(type, 0) + 1
+    if type == 'designer':
+      if self.designer is None:
+        self.designer = now - self.connected
+        self.designerReceived.set()
+      self.harness.designer = message
+      # Clients of the legacy protocol get the whole designer instead of the patches
+      for com in message.get('components', []):
+        self.harness.added.add(com['id'])
+        self.moved(com['id'], com['x'], now)
+    elif type == 'designer-patch':
+      for change in message.get('changes', []):
+        if change['op'] == 'mov':
+          self.moved(change['id'], change['x'], now)
+        elif change['op'] == 'add':
+          self.harness.added.add(change['com']['id'])
+    elif type == 'variables':
+      self.harness.variables = message.get('body', '')
+
+  def moved(self, id, x, now):
+    # x of the nodes of the harness is the sequence number of the move
+    if id not in self.harness.nodes or self.positions.get(id) == x:
+      return
+    self.positions[id] = x
+    sent = self.harness.moves.get(x)
+    if sent is not None:
+      self.harness.latencies.append(now - sent)
+      self.harness.arrivals.setdefault(x, []).append(now)
+
+  async def send(self, data, opcode=None):
+    """Send a message (dict) in the protocol of the harness, or raw data with an opcode, masked
+    """
+    if opcode is None:
+      opcode, data = Protocol.encode(json.dumps(data), self.harness.protocol)
+    frame = self.encoder.encode(opcode, data if len(data) else b' ', mask=1)
+    self.bytesSent += len(frame)
+    self.writer.write(frame)
+    await self.writer.drain()
+
+  async def close(self):
+    try:
+      await self.send(struct.pack('!H', 1000), 0x8)
+      self.writer.close()
+    except (ConnectionError, RuntimeError):
+      pass
+    if self.task is not None:
+      try:
+        await asyncio.wait_for(self.task, 2)
+      except asyncio.TimeoutError:
+        self.task.cancel()
+
+class LoadHarness:
+  """Clients, designer traffic and measures of one load test
+  """
+  def __init__(self, args):
+    self.args = args
+    self.protocol = args.protocol
+    self.rand = random.Random(args.seed)
+    self.clients = []
+    self.failures = 0
+    self.designer = None
+    self.variables = None
+    # Nodes of the harness, added ones seen in the patches, moves (sequence -> send time) and arrivals
+    self.nodes = ['loadtest-%d-%d' % (os.getpid(), i) for i in range(args.nodes)]
+    self.added = set()
+    self.sequence = 1000000
+    self.moves = {}
+    self.arrivals = {}
+    self.latencies = []
+    self.sent = dict((type, 0) for type in MESSAGES)
+    self.samples = []
+    self.server = psutil.Process(args.pid) if args.pid else LoadHarness.serverProcess(args.port)
+
+  @staticmethod
+  def serverProcess(port):
+    """Process listening on the port, None when not found
+    """
+    try:
+      for conn in psutil.net_connections(kind='tcp'):
+        if conn.laddr and conn.laddr.port == port and conn.status == psutil.CONN_LISTEN and conn.pid:
+          return psutil.Process(conn.pid)
+    except (psutil.AccessDenied, psutil.NoSuchProcess):
+      pass
+    return None
+
+  async def sample(self, stopped):
+    """CPU and memory of the server until stopped
+    """
+    if self.server is None:
+      return
+    self.server.cpu_percent()
+    while not stopped.is_set():
+      try:
+        await asyncio.wait_for(stopped.wait(), self.args.sample_interval)
+      except asyncio.TimeoutError:
+        pass
+      try:
+        self.samples.append((time.perf_counter(), self.server.cpu_percent(), self.server.memory_info().rss, self.server.num_threads()))
+      except psutil.NoSuchProcess:
+        return
+
+  async def open(self, index, semaphore):
+    client = LoadClient(self, index)
+    async with semaphore:
+      try:
+        await asyncio.wait_for(client.connect(self.args.host, self.args.port, self.protocol), self.args.timeout)
+        await asyncio.wait_for(client.designerReceived.wait(), self.args.timeout)
+      except (OSError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        self.failures += 1
+        logging.warning('Client %d failed: %s' % (index, e))
+        if client.writer is not None:
+          await client.close()
+        return
+    self.clients.append(client)
+
+  def mix(self):
+    weights = dict((type, 0) for type in MESSAGES)
+    for part in self.args.mix.split(','):
+      type, weight = part.split('=')
+      if type not in weights:
+        raise ValueError('Unknown message type %s' % (type,))
+      weights[type] = float(weight)
+    return list(weights), list(weights.values())
+
+  def message(self, type):
+    """Next message of a type, targeting the nodes of the harness
+    """
+    node = self.rand.choice(self.nodes)
+    self.sequence += 1
+    if type == 'apply':
+      self.moves[self.sequence] = time.perf_counter()
+      return {'type': 'apply', 'body': [{'type': 'mov', 'com': {'id': node, 'x': self.sequence, 'y': 0}}]}
+    if type == 'options':
+      return {'type': 'options', 'target': node, 'body': {'loadtest': self.sequence}}
+    if type == 'variables':
+      return {'type': 'variables', 'body': '%s\nloadtest (number): %d' % (self.variables or '', self.sequence)}
+    return {'event': self.args.event, 'target': node}
+
+  async def edit(self, client, types, weights, deadline):
+    """Traffic of one editor, at rate messages per second
+    """
+    interval = 1 / self.args.rate
+    next = time.perf_counter() + self.rand.random() * interval
+    while next < deadline:
+      await asyncio.sleep(max(0, next - time.perf_counter()))
+      type = self.rand.choices(types, weights)[0]
+      try:
+        await client.send(self.message(type))
+      except ConnectionError:
+        return
+      self.sent[type] += 1
+      next += interval
+
+  async def setup(self):
+    """Add the nodes of the harness and keep the variables of the flow
+    """
+    first = self.clients[0]
+    await first.send({'type': 'getvariables'})
+    database = self.designer.get('database', []) if self.designer else []
+    component = self.args.component or (database[0]['id'] if len(database) else None)
+    if component is None:
+      raise RuntimeError('No component in the library of the server, the nodes of the harness can not be added')
+    await first.send({'type': 'apply', 'body': [{'type': 'add', 'com': {
+      'id': id,
+      'component': component,
+      'x': 0,
+      'y': 0,
+      'state': {'text': '', 'color': ''},
+      'tab': self.args.tab,
+      'disabledio': {'input': [], 'output': []},
+      'connections': {},
+      'options': {}
+    }} for id in self.nodes]})
+    deadline = time.perf_counter() + self.args.timeout
+    while (self.variables is None or not self.added.issuperset(self.nodes)) and time.perf_counter() < deadline:
+      await asyncio.sleep(0.01)
+    if not self.added.issuperset(self.nodes):
+      raise RuntimeError('Nodes of the harness not added by the server (component %s)' % (component,))
+
+  async def teardown(self):
+    first = self.clients[0]
+    try:
+      await first.send({'type': 'apply', 'body': [{'type': 'rem', 'id': id} for id in self.nodes]})
+      if self.variables is not None:
+        await first.send({'type': 'variables', 'body': self.variables})
+    except ConnectionError as e:
+      logging.warning('Nodes of the harness not removed, server gone: %s' % (e,))
+
+  async def run(self):
+    stopped = asyncio.Event()
+    sampler = asyncio.ensure_future(self.sample(stopped))
+    harness = psutil.Process(os.getpid())
+    harnessCPU = sum(harness.cpu_times()[:2])
+
+    semaphore = asyncio.Semaphore(self.args.concurrency)
+    begin = time.perf_counter()
+    await asyncio.gather(*[self.open(i, semaphore) for i in range(self.args.clients)])
+    connecting = time.perf_counter() - begin
+    # Connections reset by the server after their handshake
+    self.failures += sum(1 for client in self.clients if client.task.done())
+    self.clients = [client for client in self.clients if not client.task.done()]
+    if not len(self.clients):
+      raise RuntimeError('No client connected to %s:%d' % (self.args.host, self.args.port))
+
+    try:
+      await self.setup()
+      types, weights = self.mix()
+      begin = time.perf_counter()
+      counters = [(client.bytesReceived, client.bytesSent) for client in self.clients]
+      editors = self.clients[:self.args.editors]
+      await asyncio.gather(*[self.edit(client, types, weights, begin + self.args.duration) for client in editors])
+      # Patches of the last moves, still on their way to the clients
+      deadline = time.perf_counter() + self.args.timeout
+      while len(self.latencies) < len(self.moves) * len(self.clients) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+      elapsed = time.perf_counter() - begin
+      bandwidth = [((client.bytesReceived - received) / elapsed, (client.bytesSent - sent) / elapsed) for client, (received, sent) in zip(self.clients, counters)]
+      await self.teardown()
+    finally:
+      for client in self.clients:
+        await client.close()
+      stopped.set()
+      await sampler
+    return self.report(connecting, elapsed, bandwidth, sum(harness.cpu_times()[:2]) - harnessCPU)
+
+  @staticmethod
+  def distribution(values, scale=1e3):
+    """Percentiles of values, in milliseconds by default
+    """
+    if not len(values):
+      return {'count': 0}
+    values = sorted(values)
+    def percentile(p):
+      return round(values[min(len(values) - 1, int(len(values) * p / 100))] * scale, 3)
+    return {
+      'count': len(values),
+      'mean': round(statistics.mean(values) * scale, 3),
+      'p50': percentile(50),
+      'p95': percentile(95),
+      'p99': percentile(99),
+      'max': round(values[-1] * scale, 3)
+    }
+
+  def report(self, connecting, elapsed, bandwidth, harnessCPU):
+    received = {}
+    for client in self.clients:
+      for type, count in client.received.items():
+        received[type] = received.get(type, 0) + count
+    arrivals = [max(times) - min(times) for times in self.arrivals.values()]
+    result = {
+      'clients': len(self.clients),
+      'failures': self.failures,
+      'connecting': round(connecting, 3),
+      'duration': round(elapsed, 3),
+      'handshake': LoadHarness.distribution([client.handshake for client in self.clients]),
+      'designer': LoadHarness.distribution([client.designer for client in self.clients]),
+      'fanout': LoadHarness.distribution(self.latencies),
+      # Time between the first and the last client receiving the same move
+      'spread': LoadHarness.distribution(arrivals),
+      # Moves received by all the clients, out of the moves sent
+      'delivered': round(len(self.latencies) / max(1, len(self.moves) * len(self.clients)), 4),
+      'sent': self.sent,
+      'received': received,
+      'protocolErrors': sum(client.protocolErrors for client in self.clients),
+      'bandwidth': {
+        'in': LoadHarness.distribution([b[0] for b in bandwidth], 1 / 1024),
+        'out': LoadHarness.distribution([b[1] for b in bandwidth], 1 / 1024)
+      },
+      'harnessCPU': round(harnessCPU, 3)
+    }
+    if len(self.samples):
+      result['server'] = {
+        'pid': self.server.pid,
+        'cpu': LoadHarness.distribution([s[1] for s in self.samples], 1),
+        'rss': LoadHarness.distribution([s[2] for s in self.samples], 1 / 2 ** 20),
+        'threads': max(s[3] for s in self.samples)
+      }
+    return result
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--host', help='Address of the server, default is 127.0.0.1', default='127.0.0.1')
+  parser.add_argument('--port', help='Port of the server', type=int, default=5001)
+  parser.add_argument('--pid', help='Process of the server, found from the port by default', type=int)
+  parser.add_argument('--clients', help='Connections opened', type=int, default=100)
+  parser.add_argument('--concurrency', help='Handshakes in progress at the same time', type=int, default=50)
+  parser.add_argument('--editors', help='Clients sending designer traffic', type=int, default=5)
+  parser.add_argument('--rate', help='Messages per second sent by each editor', type=float, default=10)
+  parser.add_argument('--duration', help='Seconds of designer traffic', type=float, default=10)
+  parser.add_argument('--mix', help='Weights of the messages sent among %s' % ','.join(MESSAGES), default='apply=4,options=2,variables=1,event=1')
+  parser.add_argument('--protocol', help='Protocol of the clients', choices=Protocol.PROTOCOLS, default=Protocol.JSON)
+  parser.add_argument('--nodes', help='Nodes added by the harness, targets of the traffic', type=int, default=5)
+  parser.add_argument('--component', help='Component of the nodes of the harness, the first of the library by default')
+  parser.add_argument('--tab', help='Tab of the nodes of the harness', default='loadtest')
+  parser.add_argument('--event', help='Event sent to the nodes of the harness', default='click')
+  parser.add_argument('--timeout', help='Seconds waited for a handshake, the designer or the setup', type=float, default=10)
+  parser.add_argument('--sample-interval', help='Seconds between two samples of the server CPU and memory', type=float, default=0.5)
+  parser.add_argument('--seed', help='Seed of the traffic', type=int, default=0)
+  parser.add_argument('--output', help='JSON file of the results', default=os.path.join(tempfile.gettempdir(), 'WSLoadBenchmark.json'))
+  parser.add_argument('--compare', help='JSON file of previous results, to show the fan-out latency ratios')
+  args = parser.parse_args()
+
+  if args.host not in ('127.0.0.1', 'localhost', '::1'):
+    parser.error('The load test only runs against a server on localhost')
+  if args.protocol == Protocol.BINARY and Protocol.negotiate({'protocol': Protocol.BINARY}) != Protocol.BINARY:
+    parser.error('The binary protocol needs msgpack')
+  args.editors = min(args.editors, args.clients)
+
+  result = asyncio.run(LoadHarness(args).run())
+
+  previous = None
+  if args.compare:
+    with open(args.compare, 'r') as file:
+      previous = json.load(file)['results']
+
+  print('%d clients (%d failed), %.1fs measured, %s messages sent, %d protocol errors' % (result['clients'], result['failures'], result['duration'],
+    sum(result['sent'].values()), result['protocolErrors']))
+  print('%16s%10s%10s%10s%10s%10s%10s' % ('', 'mean', 'p50', 'p95', 'p99', 'max', 'ratio'))
+  for name, unit in (('handshake', 'ms'), ('designer', 'ms'), ('fanout', 'ms'), ('spread', 'ms')):
+    values = result[name]
+    if not values['count']:
+      continue
+    old = previous[name] if previous is not None and previous[name]['count'] else None
+    ratio = '%9.2fx' % (values['p50'] / old['p50']) if old and old['p50'] else '%10s' % '-'
+    print('%16s' % ('%s (%s)' % (name, unit)) + ''.join('%10.2f' % values[k] for k in ('mean', 'p50', 'p95', 'p99', 'max')) + ratio)
+  for direction in ('in', 'out'):
+    values = result['bandwidth'][direction]
+    print('%16s' % ('%s (KB/s)' % (direction,)) + ''.join('%10.2f' % values[k] for k in ('mean', 'p50', 'p95', 'p99', 'max')))
+  if 'server' in result:
+    for name, unit in (('cpu', '%'), ('rss', 'MB')):
+      values = result['server'][name]
+      print('%16s' % ('server %s (%s)' % (name, unit)) + ''.join('%10.2f' % values[k] for k in ('mean', 'p50', 'p95', 'p99', 'max')))
+  print('Moves delivered to all the clients: %.2f%%, harness CPU: %.2fs' % (result['delivered'] * 100, result['harnessCPU']))
+
+  with open(args.output, 'w') as file:
+    json.dump({
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'arguments': vars(args),
+      'results': result
+    }, file, indent=2)
+  print('Results written to %s' % (args.output,))
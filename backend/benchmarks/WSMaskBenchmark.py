@@ -0,0 +1,70 @@
+"""
+  WSMaskBenchmark - Compare the WSMask engine with the historical byte per byte loop
+
+  Usage (from the backend folder):
+    python benchmarks/WSMaskBenchmark.py [--sizes 125,4096,1048576] [--repeat 5]
+"""
+
+import os, sys, array, timeit, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from websocket.WSMask import WSMask, numpy
+
+def loopMask(mask_key, bytes):
+  """Historical implementation of WSEncoder.mask and WSDecoder.unmask
+  """
+  m = array.array('B', mask_key)
+  j = array.array('B', bytes)
+  for i in range(len(j)):
+    j[i] ^= m[i % 4]
+  return j.tobytes()
+
+def integerMask(mask_key, bytes):
+  """WSMask without its NumPy path
+  """
+  saved, WSMask.NUMPY_THRESHOLD = WSMask.NUMPY_THRESHOLD, float('inf')
+  try:
+    return WSMask.apply(mask_key, bytes)
+  finally:
+    WSMask.NUMPY_THRESHOLD = saved
+
+def numpyMask(mask_key, bytes):
+  """WSMask forced on its NumPy path
+  """
+  return WSMask.applyNumpy(mask_key, bytes, len(bytes))
+
+def measure(func, mask_key, data, repeat):
+  """Best time of one call, in milliseconds
+  """
+  number = max(1, int(2 ** 20 / max(len(data), 1)))
+  return min(timeit.repeat(lambda: func(mask_key, data), number=number, repeat=repeat)) / number * 1000
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--sizes', help='Comma separated payload sizes in bytes', default='125,4096,65536,1048576,8388608')
+  parser.add_argument('--repeat', help='Number of measures kept for each size (best is shown)', type=int, default=5)
+  parser.add_argument('--max-loop-size', help='Largest payload measured with the byte per byte loop', type=int, default=1 << 20)
+  args = parser.parse_args()
+
+  engines = [('loop', loopMask), ('integer', integerMask)]
+  if numpy is not None:
+    engines.append(('numpy', numpyMask))
+
+  mask_key = os.urandom(4)
+  print('%12s' % 'size' + ''.join('%14s' % (name + ' (ms)') for name, _ in engines) + '%10s' % 'speedup')
+  for size in [int(s) for s in args.sizes.split(',')]:
+    data = os.urandom(size)
+    expected = loopMask(mask_key, data) if size <= args.max_loop_size else None
+    results = []
+    for name, func in engines:
+      if name == 'loop' and expected is None:
+        results.append(None)
+        continue
+      if expected is not None and func(mask_key, data) != expected:
+        raise AssertionError('%s engine gives a wrong result for %d bytes' % (name, size))
+      results.append(measure(func, mask_key, data, args.repeat if name != 'loop' else 1))
+
+    best = min(r for r in results[1:])
+    speedup = '%9.0fx' % (results[0] / best) if results[0] is not None else '%10s' % '-'
+    print('%12d' % size + ''.join('%14s' % ('%.4f' % r if r is not None else '-') for r in results) + speedup)
@@ -0,0 +1,202 @@
+"""
+  WSAsyncClient - WebSocket Client running on an asyncio event loop
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import asyncio, logging
+from .WSClient import *
+
+class WSAsyncClient(WSClient):
+  """Socket control for a given client, driven by the WSAsyncServer event loop
+
+  The client keeps the WSClient interface used by WSController and the
+  WSHandler callbacks, only the socket reads are coroutines. The controller
+  and the WSHandler callbacks run in the handler threads of the server, the
+  next frame is read once they are done. Sends can be done from any thread,
+  the send queue is written by a writer coroutine.
+  """
+
+  def __init__(self, _WSServer):
+    """Constructor
+
+    Arguments:
+        _WSServer {WSAsyncServer} -- WebSocket Server object attached to client
+    """
+    super().__init__(_WSServer)
+    self.reader = None
+    self.writer = None
+    # Set when the writer coroutine has something to do
+    self.writable = None
+
+  async def read(self, bufsize):
+    """Read exactly an amount of bytes
+
+    Arguments:
+        bufsize {int} -- Buffer size to fill
+    """
+    if not self.hasStatus('OPEN'):
+      return b''
+    try:
+      return await self.reader.readexactly(bufsize)
+    except (asyncio.IncompleteReadError, ConnectionError):
+      logging.websocket('Client left', repr(self.conn))
+      self._WSServer.remove(self)
+      self.close()
+      return b''
+
+  async def readlineheader(self):
+    """Read data until line return
+
+    Returns:
+      Unicode string
+    """
+    try:
+      line = await self.reader.readline()
+    except (ValueError, ConnectionError):
+      raise ValueError('Invalid line in header.')
+    if not line:
+      self.close()
+      return ''
+    return line.decode('UTF-8')
+
+  async def handshake(self):
+    """Send handshake according to RFC
+    """
+    headers = {}
+    # Ignore first line with GET
+    getRequest = await self.readlineheader()
+    while self.hasStatus('CONNECTING'):
+      line = await self.readlineheader()
+      if not self.hasStatus('CONNECTING'):
+        raise ValueError('Client left.')
+      if self.parseHeaderLine(line, headers):
+        break
+
+    self.send(self.acceptHandshake(headers))
+
+    return getRequest
+
+  async def handle(self, reader, writer):
+    """Handle incoming datas
+
+    Arguments:
+        reader {asyncio.StreamReader} -- Stream to read the client datas from
+        writer {asyncio.StreamWriter} -- Stream to write the client datas to
+    """
+    self.reader = reader
+    self.writer = writer
+    self.conn = writer.get_extra_info('socket')
+    self.addr = writer.get_extra_info('peername')
+    self.writable = asyncio.Event()
+    self.setStatus('CONNECTING')
+    asyncio.get_running_loop().create_task(self.writeLoop())
+    try:
+      try:
+        getRequest = await self.handshake()
+      except (ValueError, UnicodeError) as error:
+        self._WSServer.remove(self)
+        self.close()
+        logging.websocket('Client rejected:', str(error))
+        return
+
+      _WSDecoder = WSDecoder(self._WSServer.maxmessagesize)
+      _WSHandler = self._WSServer._WSHandler
+      # Settings of the client read from the request before any multicast can reach it
+      if _WSHandler is not None and hasattr(_WSHandler, 'onHandshake'):
+        await self._WSServer.callHandler(_WSHandler.onHandshake, getRequest, self)
+      self.setStatus('OPEN')
+      if _WSHandler is not None:
+        await self._WSServer.callHandler(_WSHandler.onConnect, self.conn, getRequest, self)
+      while self.hasStatus('OPEN'):
+        try:
+          async for ctrl, data in _WSDecoder.decodeAsync(self):
+            logging.websocket('--- INCOMING DATAS ---')
+            await self._WSServer.callHandler(self._WSController.run, ctrl, data)
+        except ValueError as e:
+          closing_code, message = (1000, e)
+          parts = str(e).split('|')
+          if len(parts) == 2:
+            closing_code = int(parts[0])
+            message = parts[1]
+          if self.hasStatus('OPEN'):
+            self._WSController.kill(closing_code, ('WSDecoder::' + str(message)).encode('UTF-8'))
+          break
+    except Exception as error:
+      logging.error('Client handling failed, disconnecting %s: %s' % (repr(self.addr), str(error)))
+      self.writer.transport.abort()
+    finally:
+      # Whatever ended the connection, the client leaves the server
+      self._WSServer.remove(self)
+      if not self.hasStatus('CLOSED'):
+        self.close()
+
+  def send(self, bytes):
+    """Queue a unicast frame, from any thread
+
+    Arguments:
+        bytes {bytes|WSMessage} -- Bytes to send, or message to encode for this client
+    """
+    if not self.hasStatus('CLOSED'):
+      if self.queue.put(bytes):
+        self._WSServer.callSoon(self.writable.set)
+      else:
+        self._WSServer.callSoon(self.abort)
+
+  async def writeLoop(self):
+    """Writer of the client: write the queued frames, several at a time, until the queue is closed
+
+    Frames are encoded on the loop thread, in sending order, as compression
+    with context takeover depends on the previous messages.
+    """
+    while True:
+      batch = self.queue.get(block=False)
+      if not batch:
+        if self.queue.closed:
+          break
+        self.writable.clear()
+        await self.writable.wait()
+        continue
+      self.writer.writelines([self.frame(bytes) for bytes in batch])
+      try:
+        await self.writer.drain()
+      except ConnectionError as error:
+        logging.websocket('Sending failed:', repr(self.conn), str(error))
+        self._WSServer.remove(self)
+        self.queue.close(clear=True)
+        break
+      logging.websocket('--- END  UNICAST ---')
+    self.writer.close()
+
+  def abort(self):
+    """Disconnect a client which does not read its messages fast enough, from the loop thread
+    """
+    logging.websocket('Send queue full, disconnecting client:', repr(self.conn))
+    self._WSServer.remove(self)
+    self.queue.close(clear=True)
+    self.writer.transport.abort()
+
+  def close(self):
+    """Close connection, once the queued frames are written
+    """
+    if self._WSServer._WSHandler is not None:
+      future = self._WSServer.callHandler(self._WSServer._WSHandler.onClose, self.conn)
+      if future is not None:
+        future.add_done_callback(self._WSServer.handlerDone)
+    logging.websocket(repr(self.conn))
+    if not self.hasStatus('CLOSED'):
+      self.setStatus('CLOSED')
+      self.queue.close()
+      self._WSServer.callSoon(self.writable.set)
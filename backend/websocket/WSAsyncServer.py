@@ -0,0 +1,191 @@
+"""
+  WSAsyncServer - WebSocket Server running on an asyncio event loop
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import asyncio, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .WSAsyncClient import *
+
+class WSAsyncServer(threading.Thread):
+  """WebSocket Server Class, serving all the clients from one asyncio event loop
+
+  Same interface as WSServer (setWSHandler, start, send, stop, remove), so it
+  can be used in place of it. The loop runs in the server thread. The WSHandler
+  callbacks may block (flow deliveries, files, HTTP requests): they run in a
+  pool of threads, one at a time for each client, so that the loop keeps
+  serving the other connections.
+  """
+  def __init__(self, host='localhost', port=9999, maxclients=10000, backlog=128, maxmessagesize=WSSettings.MAX_MESSAGE_SIZE, compression=True, sendqueuesize=WSSettings.SEND_QUEUE_SIZE, sendpolicy=WSSettings.SEND_POLICY, handlerthreads=WSSettings.HANDLER_THREADS):
+    super().__init__()
+    self.clients = []
+    self.loop = None
+    self.server = None
+    self.loopThread = None
+    self.listening = False
+    self._WSHandler = None
+    self.host = host
+    self.port = port
+    self.maxclients = maxclients
+    self.backlog = backlog
+    self.maxmessagesize = maxmessagesize
+    self.compression = compression
+    self.sendqueuesize = sendqueuesize
+    self.sendpolicy = sendpolicy
+    self.executor = ThreadPoolExecutor(handlerthreads, thread_name_prefix='wshandler')
+    # Statistics: bytes of the frames multicast to the clients, messages dropped by the send queues of the clients gone
+    self.broadcastBytes = 0
+    self.droppedFrames = 0
+
+  def setWSHandler(self, handler):
+    self._WSHandler = handler
+
+  def run(self):
+    """Start server and run the event loop until stop() is called
+    """
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+    self.loopThread = threading.get_ident()
+    self.server = self.loop.run_until_complete(asyncio.start_server(
+      self.accept, self.host, self.port, backlog=self.backlog, reuse_address=True))
+    self.listening = True
+    try:
+      self.loop.run_forever()
+    finally:
+      self.loop.close()
+
+  async def accept(self, reader, writer):
+    """Handle a new connection
+
+    Arguments:
+        reader {asyncio.StreamReader} -- Stream to read the client datas from
+        writer {asyncio.StreamWriter} -- Stream to write the client datas to
+    """
+    logging.websocket('New client host/address:', writer.get_extra_info('peername'))
+    if len(self.clients) >= self.maxclients:
+      logging.websocket ('Too much clients - connection refused:', repr(writer.get_extra_info('socket')))
+      writer.close()
+      return
+
+    _WSClient = WSAsyncClient(self)
+    self.clients.append(_WSClient)
+    logging.websocket ('Total clients:', len(self.clients))
+    await _WSClient.handle(reader, writer)
+
+  def callSoon(self, callback, *args):
+    """Run a callback on the event loop
+
+    Called directly when already on the loop thread, else scheduled in a thread safe way.
+
+    Arguments:
+        callback {function} -- Function to call
+    """
+    if threading.get_ident() == self.loopThread:
+      callback(*args)
+    elif self.loop is not None and not self.loop.is_closed():
+      self.loop.call_soon_threadsafe(callback, *args)
+
+  def callHandler(self, callback, *args):
+    """Run a WSHandler callback in the handler threads
+
+    From the loop thread, the callback is run in the handler threads and a future of its result is
+    returned, to await before the next callback of the client. Else it is called directly.
+
+    Arguments:
+        callback {function} -- WSHandler method to call
+    """
+    if threading.get_ident() == self.loopThread:
+      return self.loop.run_in_executor(self.executor, callback, *args)
+    callback(*args)
+
+  @staticmethod
+  def handlerDone(future):
+    """Log the failure of a callback nobody awaits
+
+    Arguments:
+        future {asyncio.Future} -- Result of the callback
+    """
+    if not future.cancelled() and future.exception() is not None:
+      logging.error('WSHandler callback failed: %s' % (str(future.exception()),))
+
+  def send(self, bytes):
+    """Send a multicast frame, from any thread
+
+    Arguments:
+        bytes {bytes} -- Bytes to send
+    """
+    self.callSoon(self.multicast, bytes)
+
+  def multicast(self, bytes):
+    """Send a frame to all clients, from the loop thread
+
+    Arguments:
+        bytes {bytes} -- Bytes to send
+    """
+    logging.websocket('--- SEND MULTICAST ---')
+    logging.websocket(repr(bytes))
+    if isinstance(bytes, WSMessage):
+      # Counted when encoded for each client
+      bytes.multicast = True
+    sent = 0
+    for _WSClient in list(self.clients):
+      # Clients still in handshake get the state on connection
+      if _WSClient.hasStatus('OPEN'):
+        _WSClient.send(bytes)
+        sent += 1
+    if not isinstance(bytes, WSMessage):
+      self.countBroadcast(sent * len(bytes))
+    logging.websocket('multicast send finished')
+
+  def stop(self):
+    """Stop all clients
+    """
+    self.listening = False
+    self.callSoon(self.shutdown)
+
+  def shutdown(self):
+    """Close all clients and the listening socket, then stop the loop
+    """
+    while len(self.clients):
+      self.clients.pop()._WSController.kill()
+    if self.server is not None:
+      self.server.close()
+    self.executor.shutdown(wait=False)
+    self.loop.call_soon(self.loop.stop)
+    logging.websocket('--- THAT\'S ALL FOLKS ---')
+
+  def countBroadcast(self, size):
+    """Count bytes multicast to the clients
+
+    Arguments:
+        size {int} -- Bytes of the frames sent
+    """
+    self.broadcastBytes += size
+
+  def dropped(self):
+    """Messages dropped by the send queues, of all the clients since the start
+
+    Returns:
+      Number of messages
+    """
+    return self.droppedFrames + sum(_WSClient.queue.dropped for _WSClient in list(self.clients))
+
+  def remove(self, _WSClient):
+    if _WSClient in self.clients:
+      logging.websocket('Client left:', repr(_WSClient.conn))
+      self.clients.remove(_WSClient)
+      self.droppedFrames += _WSClient.queue.dropped
@@ -21,11 +21,14 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
-import threading, hashlib, base64, logging
+import threading, socket, hashlib, base64, logging
 from .WSSettings import *
 
 from .WSDecoder import *
 from .WSController import *
+from .WSDeflate import *
+from .WSMessage import *
+from .WSSendQueue import *
 
 class WSClient:
   """Socket control for a given client
@@ -50,6 +53,23 @@ class WSClient:
     self.addr = ''
     self.setStatus('CLOSED')
     self._WSController = WSController(self)
+
+    # Receive buffer, allocated when the connection is handled.
+    # Bytes between start and end are received but not read yet.
+    self.buffer = None
+    self.view = None
+    self.start = 0
+    self.end = 0
+
+    # Negotiated permessage-deflate compression, None if not used
+    self.deflate = None
+
+    # Application protocol, set by the WSHandler during the handshake
+    self.protocol = None
+
+    # Messages waiting to be written. Only the writer of the client encodes
+    # and writes frames, so they go out in the order they were compressed.
+    self.queue = WSSendQueue(_WSServer.sendqueuesize, _WSServer.sendpolicy)
     
   def setStatus(self, status=''):
     """Set current connection status
@@ -71,31 +91,88 @@ class WSClient:
     return False
 
   def receive(self, bufsize):
-    """Real socket bytes reception
-    
+    """Real socket bytes reception, at least bufsize bytes are buffered on success
+
+    Unread bytes are moved at the beginning of the buffer when there is not
+    enough room after them, then the buffer is filled with recv_into: one
+    call can receive several frames.
+
     Arguments:
-        bufsize {int} -- Buffer size to return
+        bufsize {int} -- Amount of bytes to have in the buffer (at most the buffer size)
+
+    Returns:
+      True if the bytes are buffered, False if the client left
     """
-    bytes = self.conn.recv(bufsize) # Receive byte string
-    if not bytes:
-      logging.websocket('Client left', repr(self.conn))
-      self._WSServer.remove(self)
-      self.close()
-      return b''
-    return bytes
+    if self.end - self.start >= bufsize:
+      return True
+
+    if self.start + bufsize > len(self.buffer):
+      pending = self.end - self.start
+      self.buffer[:pending] = bytes(self.view[self.start:self.end])
+      self.start = 0
+      self.end = pending
+
+    while self.end - self.start < bufsize:
+      received = self.recvInto(self.view[self.end:])
+      if not received:
+        logging.websocket('Client left', repr(self.conn))
+        self._WSServer.remove(self)
+        self.close()
+        return False
+      self.end += received
+    return True
+
+  def recvInto(self, view):
+    """Receive bytes into a buffer view
+
+    Arguments:
+        view {memoryview} -- Buffer to fill
+
+    Returns:
+      Number of bytes received, 0 if the client left or the writer shut the socket down
+    """
+    try:
+      return self.conn.recv_into(view)
+    except OSError:
+      return 0
 
   def read(self, bufsize):
     """Try to head an amount of bytes
-    
+
+    Small reads return a view on the receive buffer, only valid until the
+    next read. Reads larger than the buffer are received into their own
+    bytearray, without intermediate copies.
+
     Arguments:
         bufsize {int} -- Buffer size to fill
+
+    Returns:
+      Bytes-like object, empty if the client left
     """
-    remaining = bufsize
-    bytes = b''
-    while remaining and self.hasStatus('OPEN'):
-      bytes += self.receive(remaining)
-      remaining = bufsize - len(bytes)
-    return bytes
+    if not self.hasStatus('OPEN'):
+      return b''
+
+    if bufsize <= len(self.buffer):
+      if not self.receive(bufsize):
+        return b''
+      view = self.view[self.start:self.start + bufsize]
+      self.start += bufsize
+      return view
+
+    data = bytearray(bufsize)
+    dataView = memoryview(data)
+    filled = self.end - self.start
+    dataView[:filled] = self.view[self.start:self.end]
+    self.start = self.end = 0
+    while filled < bufsize:
+      received = self.recvInto(dataView[filled:])
+      if not received:
+        logging.websocket('Client left', repr(self.conn))
+        self._WSServer.remove(self)
+        self.close()
+        return b''
+      filled += received
+    return data
 
   def readlineheader(self):
     """Read data until line return
@@ -103,47 +180,65 @@ class WSClient:
     Returns:
       Unicode string
     """
-    line = ''
-    while self.hasStatus('CONNECTING') and len(line) < 1024:
-      c = self.receive(1).decode('UTF-8')
-      line += c
-      if c == '\n':
-        break
+    searched = 0
+    while self.hasStatus('CONNECTING'):
+      index = self.buffer.find(b'\n', self.start + searched, self.end)
+      if index != -1:
+        line = self.view[self.start:index + 1]
+        self.start = index + 1
+        return str(line, 'UTF-8')
 
-    return line
+      searched = self.end - self.start
+      if searched >= 1024:
+        line = self.view[self.start:self.start + 1024]
+        self.start += 1024
+        return str(line, 'UTF-8')
+      if not self.receive(searched + 1):
+        return ''
+    return ''
 
-  def handshake(self):
-    """Send handshake according to RFC
+  def parseHeaderLine(self, line, headers):
+    """Parse one handshake header line into the headers dictionnary
+
+    Arguments:
+        line {string} -- Header line, as read from the socket
+        headers {dict} -- Headers already parsed
+
+    Returns:
+      True if the line is the end of the header, else False
     """
-    headers = {}
-    # Ignore first line with GET
-    getRequest = self.readlineheader()
-    while self.hasStatus('CONNECTING'):
-      if len(headers) > 64:
-        raise ValueError('Header too long.')
-      line = self.readlineheader()
-      if not self.hasStatus('CONNECTING'):
-        raise ValueError('Client left.')
-      if len(line) == 0 or len(line) == 1024:
-        raise ValueError('Invalid line in header.')
-      if line == '\r\n':
-        break
-      # Take care with strip !
-      # >>> import string;string.whitespace
-      # '\t\n\x0b\x0c\r'
-      line = line.strip()
-      # Take care with split !
-      # >>> a='key1:value1:key2:value2';a.split(':',1)
-      # ['key1', 'value1:key2:value2']
-      kv = line.split(':', 1)
-      if len(kv) == 2:
-        key, value = kv
-        k = key.strip().lower()
-        v = value.strip()
-        headers[k] = v
-      else:
-        raise ValueError('Invalid header key/value.')
+    if len(headers) > 64:
+      raise ValueError('Header too long.')
+    if len(line) == 0 or len(line) >= 1024:
+      raise ValueError('Invalid line in header.')
+    if line == '\r\n':
+      return True
+    # Take care with strip !
+    # >>> import string;string.whitespace
+    # '\t\n\x0b\x0c\r'
+    line = line.strip()
+    # Take care with split !
+    # >>> a='key1:value1:key2:value2';a.split(':',1)
+    # ['key1', 'value1:key2:value2']
+    kv = line.split(':', 1)
+    if len(kv) == 2:
+      key, value = kv
+      k = key.strip().lower()
+      v = value.strip()
+      headers[k] = v
+    else:
+      raise ValueError('Invalid header key/value.')
+    return False
+
+  def acceptHandshake(self, headers):
+    """Check received headers and build the handshake response
+
+    Arguments:
+        headers {dict} -- Headers parsed from the client request
 
+    Returns:
+      Response bytes to send to the client
+    """
     if not len(headers):
       raise ValueError('Reading headers failed.')
     if not 'sec-websocket-version' in headers:
@@ -171,13 +266,33 @@ class WSClient:
          'Sec-WebSocket-Origin: %s\r\n'
          'Sec-WebSocket-Location: ws://%s\r\n'
          'Sec-WebSocket-Accept: %s\r\n'
-         'Sec-WebSocket-Version: %s\r\n'
-         '\r\n') % (headers['origin'], headers['host'], accept, headers['sec-websocket-version'])
+         'Sec-WebSocket-Version: %s\r\n') % (headers['origin'], headers['host'], accept, headers['sec-websocket-version'])
+
+    if self._WSServer.compression:
+      self.deflate = WSDeflate.negotiate(headers.get('sec-websocket-extensions'))
+      if self.deflate is not None:
+        bytes += 'Sec-WebSocket-Extensions: %s\r\n' % (self.deflate.response(),)
+    bytes += '\r\n'
 
     logging.websocket('--- HANDSHAKE ---')
     logging.websocket(bytes)
     logging.websocket('-----------------')
-    self.send(bytes.encode('UTF-8'))
+    return bytes.encode('UTF-8')
+
+  def handshake(self):
+    """Send handshake according to RFC
+    """
+    headers = {}
+    # Ignore first line with GET
+    getRequest = self.readlineheader()
+    while self.hasStatus('CONNECTING'):
+      line = self.readlineheader()
+      if not self.hasStatus('CONNECTING'):
+        raise ValueError('Client left.')
+      if self.parseHeaderLine(line, headers):
+        break
+
+    self.send(self.acceptHandshake(headers))
 
     return getRequest
 
@@ -190,7 +305,12 @@ class WSClient:
     """
     self.conn = conn
     self.addr = addr
+    self.buffer = bytearray(WSSettings.RECEIVE_BUFFER_SIZE)
+    self.view = memoryview(self.buffer)
+    self.start = 0
+    self.end = 0
     self.setStatus('CONNECTING')
+    threading.Thread(target=self.writeLoop, daemon=True).start()
     try:
       getRequest = self.handshake()
     except ValueError as error:
@@ -198,13 +318,18 @@ class WSClient:
       self.close()
       raise ValueError('Client rejected: ' + str(error))
     else:
-      _WSDecoder = WSDecoder()
+      _WSDecoder = WSDecoder(self._WSServer.maxmessagesize)
+      # Settings of the client read from the request before any multicast can reach it
+      if self._WSServer._WSHandler is not None and hasattr(self._WSServer._WSHandler, 'onHandshake'):
+        self._WSServer._WSHandler.onHandshake(getRequest, self)
       self.setStatus('OPEN')
       if self._WSServer._WSHandler is not None:
-        self._WSServer._WSHandler.onConnect(self.conn, getRequest)
+        self._WSServer._WSHandler.onConnect(self.conn, getRequest, self)
       while self.hasStatus('OPEN'):
         try:
-          ctrl, data = _WSDecoder.decode(self)
+          for ctrl, data in _WSDecoder.decode(self):
+            logging.websocket('--- INCOMING DATAS ---')
+            self._WSController.run(ctrl, data)
         except ValueError as e:
           closing_code, message = (1000, e)
           parts = str(e).split('|')
@@ -214,34 +339,91 @@ class WSClient:
           if self.hasStatus('OPEN'):
             self._WSController.kill(closing_code, ('WSDecoder::' + str(message)).encode('UTF-8'))
           break
-        else:
-          logging.websocket('--- INCOMING DATAS ---')
-          self._WSController.run(ctrl, data)
 
   def send(self, bytes):
-    """Send a unicast frame
-    
+    """Queue a unicast frame, from any thread
+
     Arguments:
-        bytes {bytes} -- Bytes to send
+        bytes {bytes|WSMessage} -- Bytes to send, or message to encode for this client
     """
     if not self.hasStatus('CLOSED'):
-      logging.websocket('--- SEND UNICAST ---')
-      logging.websocket(repr(self.conn))
-      logging.websocket(repr(bytes), '[', str(len(bytes)), ']')
-      if self._WSServer._WSHandler is not None:
-        self._WSServer._WSHandler.onSend(bytes)
-      lock = threading.Lock()
-      lock.acquire()
-      self.conn.send(bytes)
-      lock.release()
-      logging.websocket('--- END  UNICAST ---')
+      if not self.queue.put(bytes):
+        self.abort()
+
+  def frame(self, bytes):
+    """Encode a queued message for this client
+
+    Arguments:
+        bytes {bytes|WSMessage} -- Bytes to send, or message to encode for this client
+    """
+    if isinstance(bytes, WSMessage):
+      multicast = bytes.multicast
+      bytes = bytes.frame(self)
+      if multicast:
+        self._WSServer.countBroadcast(len(bytes))
+    logging.websocket('--- SEND UNICAST ---')
+    logging.websocket(repr(self.conn))
+    logging.websocket(repr(bytes), '[', str(len(bytes)), ']')
+    if self._WSServer._WSHandler is not None:
+      self._WSServer._WSHandler.onSend(bytes)
+    return bytes
+
+  def writeLoop(self):
+    """Writer of the client: write the queued frames, several at a time, until the queue is closed
+    """
+    while True:
+      batch = self.queue.get()
+      if not batch:
+        break
+      try:
+        self.write([self.frame(bytes) for bytes in batch])
+      except OSError as error:
+        logging.websocket('Sending failed:', repr(self.conn), str(error))
+        self._WSServer.remove(self)
+        self.queue.close(clear=True)
+        break
+    self.shutdown()
+
+  def write(self, frames):
+    """Send frames with as few syscalls as possible
+
+    Arguments:
+        frames {list} -- Frames to send
+    """
+    while frames:
+      sent = self.conn.sendmsg(frames)
+      i = 0
+      while i < len(frames) and sent >= len(frames[i]):
+        sent -= len(frames[i])
+        i += 1
+      frames = frames[i:]
+      if frames and sent:
+        frames[0] = memoryview(frames[0])[sent:]
+    logging.websocket('--- END  UNICAST ---')
+
+  def abort(self):
+    """Disconnect a client which does not read its messages fast enough
+    """
+    logging.websocket('Send queue full, disconnecting client:', repr(self.conn))
+    self._WSServer.remove(self)
+    self.queue.close(clear=True)
+    self.shutdown()
+
+  def shutdown(self):
+    """Shutdown and close the socket, the reader sees the connection end
+    """
+    try:
+      self.conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    self.conn.close()
 
   def close(self):
-    """Close connection
+    """Close connection, once the queued frames are written
     """
     if self._WSServer._WSHandler is not None:
       self._WSServer._WSHandler.onClose(self.conn)
     logging.websocket(repr(self.conn))
     if not self.hasStatus('CLOSED'):
       self.setStatus('CLOSED')
-      self.conn.close()
\ No newline at end of file
+      self.queue.close()
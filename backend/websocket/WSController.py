@@ -20,7 +20,7 @@
   License along with this library; if not, write to the Free Software
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
-import logging
+import logging, zlib
 from .WSSettings import *
 from .WSEncoder import *
 
@@ -29,7 +29,15 @@ class WSController:
 
   OPCODE USED:
   1000: NORMAL_CLOSURE
+  1002: PROTOCOL_ERROR
+  1007: INVALID_PAYLOAD
+  1009: MESSAGE_TOO_BIG
   1011: UNEXPECTED_CONDITION_ENCOUNTERED_ON_SERVER
+
+  Data frames come in chunks from WSDecoder. If the handler has an
+  onMessageChunk(opcode, chunk, fin, client) method, the chunks are handed
+  to it as they arrive. Otherwise the fragments are reassembled, and the
+  message is given to onMessage (text) or onBinary (binary) once complete.
   """
   def __init__(self, _WSClient):
     """Constructor
@@ -39,6 +47,12 @@ class WSController:
     """
     self._WSClient = _WSClient
 
+    # Message being received (opcode of its first frame, chunks, size and compression)
+    self.messageOpcode = None
+    self.messageParts = []
+    self.messageSize = 0
+    self.messageCompressed = False
+
   def array_shift(self, bytes, n):
     """Pop n bytes
     
@@ -62,12 +76,17 @@ class WSController:
     logging.websocket(repr(self._WSClient.conn))
     _WSEncoder = WSEncoder()
 
+    # RSV1 is only allowed on the first frame of a message, when compression is negotiated
+    if ctrl['rsv2'] or ctrl['rsv3'] or (ctrl['rsv1'] and (ctrl['opcode'] not in (0x1, 0x2) or self._WSClient.deflate is None)):
+      self.kill(1002, b'Reserved bits MUST be 0.')
+      return
+
     # CONTROLS
     if ctrl['opcode'] == 0x9: # PING
       logging.websocket('--- PING FRAME --- ')
       logging.websocket(repr(self._WSClient.conn))
       try:
-        bytes = _WSEncoder.pong('Application data')
+        bytes = _WSEncoder.pong(b'Application data', mask=0)
       except ValueError as error:
         self._WSClient._WSServer.remove(self._WSClient)
         self.kill(1011, 'WSEncoder error: ' + str(error))
@@ -104,22 +123,109 @@ class WSController:
     if ctrl['opcode'] == 0x1: # TEXT
       logging.websocket('--- TEXT FRAME ---')
       logging.websocket(repr(self._WSClient.conn))
-      if len(data):
-        try:
-          # Handle message if possible
-          if self._WSClient._WSServer._WSHandler is not None:
-            self._WSClient._WSServer._WSHandler.onMessage(data, self._WSClient)
-        except ValueError as error:
-          self._WSClient._WSServer.remove(self._WSClient)
-          self.kill(1011, ('WSEncoder error: ' + str(error)).encode('UTF-8'))
+      self.receive(ctrl, data)
 
     if ctrl['opcode'] == 0x0: # CONTINUATION
       logging.websocket('--- CONTINUATION FRAME ---', repr(self._WSClient.conn))
-      pass
+      self.receive(ctrl, data)
 
     if ctrl['opcode'] == 0x2: # BINARY
       logging.websocket('--- BINARY FRAME ---', repr(self._WSClient.conn))
-      pass
+      self.receive(ctrl, data)
+
+  def receive(self, ctrl, data):
+    """Handle a chunk of a data frame
+
+    Arguments:
+        ctrl {ctrl} -- Control dictionnary for data
+        data {bytes} -- Unmasked chunk of the frame payload
+    """
+    if ctrl['offset'] == 0:
+      if ctrl['opcode'] == 0x0 and self.messageOpcode is None:
+        self.kill(1002, b'Continuation frame without message.')
+        return
+      if ctrl['opcode'] != 0x0:
+        if self.messageOpcode is not None:
+          self.kill(1002, b'Fragmented message not finished.')
+          return
+        self.messageOpcode = ctrl['opcode']
+        self.messageCompressed = ctrl['rsv1'] == 1
+
+    opcode = self.messageOpcode
+    fin = ctrl['fin'] and ctrl['last']
+    maxSize = self._WSClient._WSServer.maxmessagesize
+
+    if self.messageCompressed:
+      try:
+        data = self._WSClient.deflate.decompress(data, fin, maxSize - self.messageSize)
+      except ValueError:
+        self.reset()
+        self.kill(1009, b'Message too big.')
+        return
+      except zlib.error:
+        self.reset()
+        self.kill(1007, b'Invalid compressed data.')
+        return
+
+    self.messageSize += len(data)
+    if self.messageSize > maxSize:
+      self.reset()
+      self.kill(1009, b'Message too big.')
+      return
+    _WSHandler = self._WSClient._WSServer._WSHandler
+    streaming = _WSHandler is not None and hasattr(_WSHandler, 'onMessageChunk')
+
+    if not streaming and len(data):
+      self.messageParts.append(data)
+    if not fin:
+      if streaming and len(data):
+        self.handle(_WSHandler.onMessageChunk, opcode, data, False, self._WSClient)
+      return
+
+    parts = self.messageParts
+    self.reset()
+    if _WSHandler is None:
+      return
+
+    # Streaming handler, no reassembly
+    if streaming:
+      self.handle(_WSHandler.onMessageChunk, opcode, data, True, self._WSClient)
+      return
+
+    message = b''.join(parts)
+    if opcode == 0x1:
+      try:
+        message = message.decode('UTF-8')
+      except UnicodeError:
+        self.kill(1007, b'Client text datas MUST be UTF-8 encoded.')
+        return
+      if len(message):
+        # Handle message if possible
+        self.handle(_WSHandler.onMessage, message, self._WSClient)
+    elif hasattr(_WSHandler, 'onBinary'):
+      self.handle(_WSHandler.onBinary, message, self._WSClient)
+    else:
+      logging.websocket('Binary message not handled, dropping...')
+
+  def handle(self, callback, *args):
+    """Call a handler callback, close the connection if it fails
+
+    Arguments:
+        callback {function} -- WSHandler method to call
+    """
+    try:
+      callback(*args)
+    except ValueError as error:
+      self._WSClient._WSServer.remove(self._WSClient)
+      self.kill(1011, ('WSEncoder error: ' + str(error)).encode('UTF-8'))
+
+  def reset(self):
+    """Forget the message being received
+    """
+    self.messageOpcode = None
+    self.messageParts = []
+    self.messageSize = 0
+    self.messageCompressed = False
 
   def ping(self):
     """Send a ping
@@ -128,7 +234,7 @@ class WSController:
     if self._WSClient.hasStatus('OPEN'):
       _WSEncoder = WSEncoder()
       try:
-        bytes = _WSEncoder.ping(b'Application data')
+        bytes = _WSEncoder.ping(b'Application data', mask=0)
       except ValueError as error:
         self._WSClient._WSServer.remove(self._WSClient)
         self.kill(1011, 'WSEncoder error: ' + str(error))
@@ -157,7 +263,7 @@ class WSController:
       logging.websocket('Error:', error)
       logging.websocket(repr(self._WSClient.conn))
       try:
-        bytes = _WSEncoder.close(data)
+        bytes = _WSEncoder.close(data, mask=0)
       except ValueError as error:
         self._WSClient.close()
       else:
@@ -21,18 +21,33 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
-import struct, array, logging
+import struct, logging
 from .WSSettings import *
+from .WSMask import *
 
 class WSDecoder:
   """Class to decode data frames, according to http://tools.ietf.org/html/rfc6455
+
+  Frames are decoded on the fly: the payload is unmasked and handed over in
+  chunks of at most WSSettings.RECEIVE_BUFFER_SIZE bytes, so a large frame is
+  never held in memory at once. Control dictionnaries carry the position of
+  the chunk in the payload ('offset') and whether it is the last one ('last').
   """
 
+  def __init__(self, maxMessageSize=WSSettings.MAX_MESSAGE_SIZE):
+    """Constructor
+
+    Keyword Arguments:
+        maxMessageSize {int} -- Largest payload accepted for a frame (default: {WSSettings.MAX_MESSAGE_SIZE})
+    """
+    self.maxMessageSize = maxMessageSize
+    self.chunkSize = WSSettings.RECEIVE_BUFFER_SIZE
+
   ## Decode on the fly data from WSClient
   #  @param _WSClient WebSocket Client - we use the read() function to get data bytes
 
   def decode(self,_WSClient):
-    """Decode on the fly data from WSClient
+    """Decode on the fly data from WSClient, yield the unmasked payload chunks of one frame
     
     Arguments:
         _WSClient {WSClient} -- WebSocket Client
@@ -57,16 +72,82 @@ class WSDecoder:
 
     OPCODES USED FOR ERRORS:
     1002: PROTOCOL_ERROR
-    1003: UNSUPPORTED_DATA_TYPE
-    1007: INVALID_PAYLOAD
+    1009: MESSAGE_TOO_BIG
     1011: UNEXPECTED_CONDITION_ENCOUTERED_ON_SERVER
     """
 
+    # decode first and second bytes
+    b = _WSClient.read(2)
+    if len(b) < 2:
+      raise ValueError('1011|Reading first bytes failed.')
+    ctrl, length = self.decodeHeader(b)
+
+    # decode extended data length (without mask size) and mask key at once
+    extended = self.extendedLength(length)
+    b = _WSClient.read(extended + 4)
+    if len(b) < extended + 4:
+      raise ValueError('1011|Reading length and mask key failed.')
+    if extended:
+      length = self.decodeLength(length, b[:extended])
+    mask_key = bytes(b[extended:])
+    self.checkLength(ctrl, length)
+
+    # read the payload chunk by chunk
+    offset = 0
+    while True:
+      size = min(length - offset, self.chunkSize)
+      data = _WSClient.read(size) if size else b''
+      if len(data) < size:
+        raise ValueError('1011|Reading data failed.')
+      yield self.decodeChunk(ctrl, mask_key, data, offset, length)
+      offset += size
+      if offset == length:
+        return
+
+  async def decodeAsync(self, _WSClient):
+    """Decode on the fly data from an asyncio WSClient, yield the unmasked payload chunks of one frame
+
+    Same as decode(), but awaits the read() coroutine of the client.
+
+    Arguments:
+        _WSClient {WSAsyncClient} -- WebSocket Client
+    """
+    b = await _WSClient.read(2)
+    if len(b) < 2:
+      raise ValueError('1011|Reading first bytes failed.')
+    ctrl, length = self.decodeHeader(b)
+
+    extended = self.extendedLength(length)
+    b = await _WSClient.read(extended + 4)
+    if len(b) < extended + 4:
+      raise ValueError('1011|Reading length and mask key failed.')
+    if extended:
+      length = self.decodeLength(length, b[:extended])
+    mask_key = b[extended:]
+    self.checkLength(ctrl, length)
+
+    offset = 0
+    while True:
+      size = min(length - offset, self.chunkSize)
+      data = await _WSClient.read(size) if size else b''
+      if len(data) < size:
+        raise ValueError('1011|Reading data failed.')
+      yield self.decodeChunk(ctrl, mask_key, data, offset, length)
+      offset += size
+      if offset == length:
+        return
+
+  def decodeHeader(self, b):
+    """Decode the two first bytes of a frame
+
+    Arguments:
+        b {bytes} -- First two bytes of the frame
+
+    Returns:
+      Control dictionnary and the 7 bits payload length
+    """
     # decode first byte
-    b = _WSClient.read(1)
-    if not len(b):
-      raise ValueError('1011|Reading first byte failed.')
-    b1 = ord(b)
+    b1 = b[0]
     fin = b1 >> 7 & 1
     rsv1 = b1 >> 6 & 1
     rsv2 = b1 >> 5 & 1
@@ -76,59 +157,76 @@ class WSDecoder:
       raise ValueError('1002|Wrong opcode.')
 
     # decode second byte
-    b = _WSClient.read(1)
-    if not len(b):
-      raise ValueError('1011|Reading second byte failed.')
-    b2 = ord(b)
+    b2 = b[1]
     mask = b2 >> 7 & 1
     if mask != 0x1:
       raise ValueError('1002|Client datas MUST be masked.')
 
+    ctrl = {
+      'fin': fin,
+      'opcode': opcode,
+      'rsv1': rsv1,
+      'rsv2': rsv2,
+      'rsv3': rsv3,
+    }
+
     # decode data length (without mask size)
-    length = b2 & 0x7f
+    return ctrl, b2 & 0x7f
+
+  def extendedLength(self, length):
+    """Number of extended payload length bytes following the two first bytes
 
+    Arguments:
+        length {int} -- 7 bits payload length
+    """
+    if length == 0x7e:
+      return 2
+    if length == 0x7f:
+      return 8
+    return 0
+
+  def decodeLength(self, length, b):
+    """Decode extended payload length
+
+    Arguments:
+        length {int} -- 7 bits payload length (126 or 127)
+        b {bytes} -- Extended payload length bytes
+    """
     # RFC : If length is 126, the following 2 bytes must be interpreted as a 16-bit unsigned integer
     # are the payload length
     if length == 0x7e:
-      b = _WSClient.read(2)
-      if not len(b):
-        raise ValueError('1011|Reading length failed.')
-      length_bytes = b
-      length = struct.unpack("!H", length_bytes)[0]
+      return struct.unpack("!H", b)[0]
 
     # RFC : If length is 127, the following 8 bytes must be interpreted as a 64-bit unsigned integer (the
-      # most significant bit MUST be 0) are the payload length
-    elif length == 0x7f:
-      b = _WSClient.read(8)
-      if not len(b):
-        raise ValueError('1011|Reading length failed.')
-      length_bytes = b
-      length = struct.unpack("!Q", length_bytes)[0]
-
-    # decode mask key
-    mask_key = _WSClient.read(4)
-    if not len(mask_key):
-      raise ValueError('1011|Reading mask key failed.')
-
-    # Note: we are trying here to read exactly the data amount, so we don't need MESSAGE_TOO_BIG
-    data = _WSClient.read(length)
-    if not len(data):
-      raise ValueError('1011|Reading data failed.')
-    data = self.unmask(mask_key, data)
-
-    if opcode == 0x1:
-      try:
-          data = data.decode('utf-8')
-      except UnicodeError:
-          raise ValueError('1003|Client text datas MUST be UTF-8 encoded.')
+    # most significant bit MUST be 0) are the payload length
+    return struct.unpack("!Q", b)[0]
 
-    ctrl = {
-      'fin': fin,
-      'opcode': opcode,
-      'rsv1': rsv1,
-      'rsv2': rsv2,
-      'rsv3': rsv3,
-    }
+  def checkLength(self, ctrl, length):
+    """Check the payload length of a frame before reading it
+
+    Arguments:
+        ctrl {dict} -- Control dictionnary of the frame
+        length {int} -- Payload length
+    """
+    if ctrl['opcode'] >= 0x8:
+      if length > 125 or not ctrl['fin']:
+        raise ValueError('1002|Control frames MUST NOT be fragmented.')
+    elif length > self.maxMessageSize:
+      raise ValueError('1009|Message too big.')
+
+  def decodeChunk(self, ctrl, mask_key, data, offset, length):
+    """Unmask a payload chunk
+
+    Arguments:
+        ctrl {dict} -- Control dictionnary of the frame
+        mask_key {4 bytes} -- Mask key
+        data {bytes-like} -- Masked chunk
+        offset {int} -- Position of the chunk in the payload
+        length {int} -- Payload length
+    """
+    ctrl['offset'] = offset
+    ctrl['last'] = offset + len(data) == length
+    data = self.unmask(mask_key, data, offset)
 
     logging.websocket('After decode:', repr(ctrl), repr(data))
 
@@ -137,17 +235,16 @@ class WSDecoder:
   ## Unmask datas
   #  @param mask_key Mask key (always 4 bytes long)
   #  @param bytes Data bytes to unmask
+  #  @param offset Position of the bytes in the payload
 
-  def unmask(self, mask_key, bytes):
+  def unmask(self, mask_key, bytes, offset=0):
     """Unmask datas
     
     Arguments:
         mask_key {4 bytes} -- Mask key
         bytes {bytes} -- Data bytes to unmask
+
+    Keyword Arguments:
+        offset {int} -- Position of the bytes in the payload (default: {0})
     """
-    # new byte[i] = old byte[i] XOR mask_key[i%4]
-    m = array.array('B', mask_key)
-    j = array.array('B', bytes)
-    for i in range(len(j)):
-      j[i] ^= m[i % 4]
-    return j.tostring()
+    return WSMask.apply(mask_key, bytes, offset)
@@ -0,0 +1,147 @@
+"""
+  WSDeflate - permessage-deflate extension, according to https://tools.ietf.org/html/rfc7692
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import zlib, logging
+from .WSSettings import *
+
+class WSDeflate:
+  """Compression state negotiated with one client
+
+  Without server context takeover (the default, see WSSettings), each message
+  is compressed on its own: the compressed frame only depends on the message
+  and the window size, so a multicast message is compressed once for all the
+  clients sharing the same parameters (see the key attribute).
+  """
+
+  NAME = 'permessage-deflate'
+  TAIL = b'\x00\x00\xff\xff'
+
+  def __init__(self, contextTakeover=True, windowBits=15, requestedWindowBits=False):
+    """Constructor
+
+    Keyword Arguments:
+        contextTakeover {bool} -- Whether the server keeps its compression context between messages (default: {True})
+        windowBits {int} -- Base two logarithm of the server compression window (default: {15})
+        requestedWindowBits {bool} -- Whether the client asked for server_max_window_bits (default: {False})
+    """
+    self.contextTakeover = contextTakeover
+    self.windowBits = windowBits
+    self.requestedWindowBits = requestedWindowBits
+    self.compressor = self.newCompressor() if contextTakeover else None
+    # Client may always use context takeover, keep the decompression context
+    self.decompressor = zlib.decompressobj(-15)
+    # Messages compressed without context can be shared between clients with the same key
+    self.key = None if contextTakeover else ('deflate', windowBits)
+
+  @staticmethod
+  def negotiate(header):
+    """Accept the first valid permessage-deflate offer of a Sec-WebSocket-Extensions header
+
+    Arguments:
+        header {string} -- Value of the Sec-WebSocket-Extensions header
+
+    Returns:
+      WSDeflate object, or None if no offer can be accepted
+    """
+    if not header:
+      return None
+
+    for offer in header.split(','):
+      parts = [p.strip() for p in offer.split(';')]
+      if parts[0].lower() != WSDeflate.NAME:
+        continue
+
+      params = {}
+      valid = True
+      for p in parts[1:]:
+        kv = p.split('=', 1)
+        key = kv[0].strip().lower()
+        value = kv[1].strip().strip('"') if len(kv) == 2 else None
+        if key in params or key not in ('server_no_context_takeover', 'client_no_context_takeover', 'server_max_window_bits', 'client_max_window_bits'):
+          valid = False
+          break
+        params[key] = value
+
+      windowBits = WSSettings.DEFLATE_WINDOW_BITS
+      if 'server_max_window_bits' in params:
+        value = params['server_max_window_bits']
+        # zlib can not compress with a 256 bytes window
+        if value is None or not value.isdigit() or not 9 <= int(value) <= 15:
+          valid = False
+        else:
+          windowBits = min(windowBits, int(value))
+      if 'client_max_window_bits' in params and params['client_max_window_bits'] is not None:
+        value = params['client_max_window_bits']
+        if not value.isdigit() or not 8 <= int(value) <= 15:
+          valid = False
+      if not valid:
+        logging.websocket('Invalid permessage-deflate offer, skipping:', offer)
+        continue
+
+      contextTakeover = WSSettings.DEFLATE_CONTEXT_TAKEOVER and 'server_no_context_takeover' not in params
+      return WSDeflate(contextTakeover, windowBits, 'server_max_window_bits' in params)
+
+    return None
+
+  def response(self):
+    """Value of the Sec-WebSocket-Extensions header accepting the offer
+    """
+    response = WSDeflate.NAME
+    if not self.contextTakeover:
+      response += '; server_no_context_takeover'
+    if self.requestedWindowBits:
+      response += '; server_max_window_bits=%d' % (self.windowBits,)
+    return response
+
+  def newCompressor(self):
+    """Raw deflate compressor with the negotiated window
+    """
+    return zlib.compressobj(WSSettings.DEFLATE_LEVEL, zlib.DEFLATED, -self.windowBits)
+
+  def compress(self, data):
+    """Compress a whole message payload
+
+    Arguments:
+        data {bytes} -- Message payload
+
+    Returns:
+      Compressed payload, without the 0x00 0x00 0xff 0xff tail
+    """
+    compressor = self.compressor if self.contextTakeover else self.newCompressor()
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    if data.endswith(WSDeflate.TAIL):
+      data = data[:-4]
+    return data
+
+  def decompress(self, data, fin, maxLength):
+    """Decompress a chunk of a compressed message
+
+    Arguments:
+        data {bytes} -- Compressed chunk
+        fin {bool} -- Whether the chunk is the last one of the message
+        maxLength {int} -- Largest decompressed size accepted
+
+    Returns:
+      Decompressed chunk
+    """
+    if fin:
+      data = bytes(data) + WSDeflate.TAIL
+    out = self.decompressor.decompress(data, maxLength + 1)
+    if len(out) > maxLength or self.decompressor.unconsumed_tail:
+      raise ValueError('1009|Message too big.')
+    return out
@@ -21,8 +21,10 @@
   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 """
 
-import struct, array, math, random, logging
+import struct, os, logging
 from .WSSettings import *
+from .WSMask import *
+from .WSMessage import *
 
 class WSEncoder:
   """Class to encode data frames, according to http://tools.ietf.org/html/rfc6455
@@ -56,6 +58,18 @@ class WSEncoder:
     """
     return self.encode(0x1, data, fin, mask)
 
+  def message(self, data='', opcode=0x1):
+    """Build a message to send to one or several clients
+
+    Unlike the other shortcuts, the frames are encoded when sent, according to
+    what each client negotiated (compression).
+
+    Keyword Arguments:
+        data {string} -- UTF-8 text or binary datas to send. (default: {''})
+        opcode {hex} -- Operation code according to RFC. (default: {0x1})
+    """
+    return WSMessage(self, opcode, data)
+
   def binary(self, data=b'', fin=1, mask=1):
     """Shortcut to encode binary datas
     
@@ -104,15 +118,14 @@ class WSEncoder:
         data {str} -- UTF-8 text to send (default: {''})
         fin {bit} -- Bit which define if the frame is the last one (default: {1})
         mask {bit} -- Bit which define if datas must be masked or not (default: {1})
-        rsv1 {bit} -- Reserved bit for future usage. Do not use. (default: {0})
+        rsv1 {bit} -- Reserved bit, set on compressed messages (permessage-deflate). (default: {0})
         rsv2 {bit} -- Reserved bit for future usage. Do not use. (default: {0})
         rsv3 {bit} -- Reserved bit for future usage. Do not use. (default: {0})
     """
     if not opcode in WSSettings.OPCODES:
       raise ValueError('Unknown opcode key')
 
-    if opcode >= 0x8: # Control frames
-      mask = 0x1
+    if opcode >= 0x8: # Control frames can not be fragmented
       fin = 0x1
 
     if opcode == 0x1:
@@ -120,7 +133,7 @@ class WSEncoder:
     else:
       logging.websocket('Before encode:', repr(data))
 
-    if opcode == 0x1:
+    if opcode == 0x1 and isinstance(data, str):
       try:
         data = data.encode('UTF-8')
       except UnicodeError:
@@ -145,8 +158,7 @@ class WSEncoder:
     mask_key = b''
     if mask:
       # Build a random mask key (4 bytes string)
-      for i in range(4):
-        mask_key += chr(int(math.floor(random.random() * 256))).encode('UTF-8')
+      mask_key = os.urandom(4)
 
     logging.websocket('Mask_key:', repr(mask_key))
 
@@ -156,11 +168,11 @@ class WSEncoder:
       raise ValueError('No data given.')
 
     if length < 126:
-      bytes += chr((mask << 7) | length).encode('UTF-8')
+      bytes += struct.pack('!B', (mask << 7) | length)
     elif length < (1 << 16): # 65536
-      bytes += chr((mask << 7) | 0x7e).encode('UTF-8') + struct.pack('!H', length)
+      bytes += struct.pack('!BH', (mask << 7) | 0x7e, length)
     elif length < (1 << 63): # 9223372036854775808
-      bytes += chr((mask << 7) | 0x7f).encode('UTF-8') + struct.pack('!Q', length)
+      bytes += struct.pack('!BQ', (mask << 7) | 0x7f, length)
     else:
       raise ValueError('Frame too large')
 
@@ -184,8 +196,4 @@ class WSEncoder:
         mask_key {4 bytes} -- Mask key
         bytes {bytes} -- Data bytes to mask
     """
-    m = array.array('B', mask_key)
-    j = array.array('B', bytes)
-    for i in range(len(j)):
-      j[i] ^= m[i % 4]
-    return j.tostring()
\ No newline at end of file
+    return WSMask.apply(mask_key, bytes)
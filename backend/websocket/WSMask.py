@@ -0,0 +1,80 @@
+"""
+  WSMask - WebSocket payload masking
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+class WSMask:
+  """Mask and unmask payloads, according to http://tools.ietf.org/html/rfc6455#section-5.3
+
+  new byte[i] = old byte[i] XOR mask_key[(offset + i) % 4]
+
+  The XOR is done on the whole buffer at once, as one big integer, instead of
+  byte per byte in the interpreter. If NumPy is installed, large buffers are
+  XORed 32 bits words at a time with it.
+  """
+
+  # Payloads from this size are handled by NumPy, when available
+  NUMPY_THRESHOLD = 1 << 12
+
+  @staticmethod
+  def apply(mask_key, data, offset=0):
+    """Mask (or unmask, it is the same operation) datas
+
+    Arguments:
+        mask_key {4 bytes} -- Mask key
+        data {bytes-like} -- Data bytes to mask
+
+    Keyword Arguments:
+        offset {int} -- Position of the data in the frame payload, for chunked payloads (default: {0})
+
+    Returns:
+      Masked bytes
+    """
+    length = len(data)
+    if not length:
+      return b''
+
+    shift = offset % 4
+    if shift:
+      mask_key = mask_key[shift:] + mask_key[:shift]
+
+    if numpy is not None and length >= WSMask.NUMPY_THRESHOLD:
+      return WSMask.applyNumpy(mask_key, data, length)
+
+    key = (mask_key * ((length + 3) >> 2))[:length]
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(key, 'little')).to_bytes(length, 'little')
+
+  @staticmethod
+  def applyNumpy(mask_key, data, length):
+    """Mask datas with NumPy, 32 bits words at a time
+
+    Arguments:
+        mask_key {4 bytes} -- Mask key, already rotated to the data offset
+        data {bytes-like} -- Data bytes to mask
+        length {int} -- Length of data
+    """
+    out = numpy.frombuffer(data, dtype=numpy.uint8).copy()
+    words = length >> 2
+    view = out[:words << 2].view(numpy.uint32)
+    view ^= numpy.frombuffer(bytes(mask_key), dtype=numpy.uint32)[0]
+    for i in range(words << 2, length):
+      out[i] ^= mask_key[i & 3]
+    return out.tobytes()
@@ -0,0 +1,78 @@
+"""
+  WSMessage - Message to send to one or several clients
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+from .WSSettings import *
+
+class WSMessage:
+  """Message to send, encoded into a frame for each client
+
+  The frame depends on what the client negotiated (compression). Frames
+  that do not depend on a per-client state are encoded once and reused, so
+  a multicast message is compressed once for all the clients.
+  """
+
+  def __init__(self, encoder, opcode, data):
+    """Constructor
+
+    Arguments:
+        encoder {WSEncoder} -- Encoder used to build the frames
+        opcode {hex} -- Operation code according to RFC
+        data {str|bytes} -- Message payload
+    """
+    self.encoder = encoder
+    self.opcode = opcode
+    self.data = data.encode('UTF-8') if isinstance(data, str) else data
+    self.frames = {}
+    # Messages with the same key supersede each other in a full send queue (see WSSendQueue)
+    self.key = None
+    # Sent to all the clients, its frames are counted in the broadcast bytes of the server
+    self.multicast = False
+
+  def payload(self, _WSClient):
+    """Payload to send to a client
+
+    Arguments:
+        _WSClient {WSClient} -- Client the message is sent to
+
+    Returns:
+      Variant key (clients with the same key get the same payload), opcode and payload bytes
+    """
+    return None, self.opcode, self.data
+
+  def frame(self, _WSClient):
+    """Encoded frame for a client
+
+    Arguments:
+        _WSClient {WSClient} -- Client the message is sent to
+    """
+    variant, opcode, data = self.payload(_WSClient)
+
+    deflate = _WSClient.deflate
+    if deflate is not None and len(data) >= WSSettings.DEFLATE_MIN_SIZE:
+      if deflate.key is None:
+        # Compression context of the client, nothing to share
+        return self.encoder.encode(opcode, deflate.compress(data), mask=0, rsv1=1)
+      key = (variant, deflate.key)
+      if key not in self.frames:
+        self.frames[key] = self.encoder.encode(opcode, deflate.compress(data), mask=0, rsv1=1)
+      return self.frames[key]
+
+    key = (variant, None)
+    if key not in self.frames:
+      self.frames[key] = self.encoder.encode(opcode, data, mask=0)
+    return self.frames[key]
@@ -0,0 +1,128 @@
+"""
+  WSSendQueue - Bounded queue of the messages waiting to be written to a client
+
+  This library is free software; you can redistribute it and/or
+  modify it under the terms of the GNU Lesser General Public
+  License as published by the Free Software Foundation; either
+  version 2.1 of the License, or (at your option) any later version.
+
+  This library is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+  Lesser General Public License for more details.
+
+  You should have received a copy of the GNU Lesser General Public
+  License along with this library; if not, write to the Free Software
+  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+"""
+
+import collections, threading
+from .WSSettings import *
+
+class WSSendQueue:
+  """Bounded queue of the messages waiting to be written to a client
+
+  Senders never block: when the queue is full, the overflow policy applies.
+  DROP_OLDEST: the oldest queued message is dropped.
+  COALESCE: an older queued message with the same key (message type) is
+            dropped, the new one replaces it. Falls back to DROP_OLDEST.
+  DISCONNECT: the message is refused, the client is too slow and must be
+              disconnected.
+  """
+
+  DROP_OLDEST = 'drop-oldest'
+  COALESCE = 'coalesce'
+  DISCONNECT = 'disconnect'
+
+  POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+  def __init__(self, maxsize=WSSettings.SEND_QUEUE_SIZE, policy=WSSettings.SEND_POLICY):
+    """Constructor
+
+    Keyword Arguments:
+        maxsize {int} -- Max number of queued messages (default: {WSSettings.SEND_QUEUE_SIZE})
+        policy {string} -- Overflow policy (default: {WSSettings.SEND_POLICY})
+    """
+    if policy not in WSSendQueue.POLICIES:
+      raise ValueError('Unknown send queue policy %s' % (policy,))
+    self.items = collections.deque()
+    self.maxsize = maxsize
+    self.policy = policy
+    self.condition = threading.Condition()
+    self.closed = False
+    # Number of messages dropped by the overflow policy
+    self.dropped = 0
+
+  def put(self, item):
+    """Queue a message
+
+    Arguments:
+        item {bytes|WSMessage} -- Message to queue, WSMessage key is used to coalesce
+
+    Returns:
+      False if the message is refused by the DISCONNECT policy, else True
+    """
+    with self.condition:
+      if self.closed:
+        return True
+
+      if len(self.items) >= self.maxsize:
+        if self.policy == WSSendQueue.DISCONNECT:
+          return False
+        self.dropped += 1
+        if not (self.policy == WSSendQueue.COALESCE and self.coalesce(getattr(item, 'key', None))):
+          self.items.popleft()
+
+      self.items.append(item)
+      self.condition.notify()
+    return True
+
+  def coalesce(self, key):
+    """Drop the oldest queued message with a given key
+
+    Arguments:
+        key {hashable} -- Message key
+
+    Returns:
+      True if a message was dropped
+    """
+    if key is None:
+      return False
+    for i, queued in enumerate(self.items):
+      if getattr(queued, 'key', None) == key:
+        del self.items[i]
+        return True
+    return False
+
+  def get(self, count=WSSettings.SEND_BATCH_SIZE, block=True):
+    """Take the oldest queued messages
+
+    Keyword Arguments:
+        count {int} -- Max number of messages to take (default: {WSSettings.SEND_BATCH_SIZE})
+        block {bool} -- Wait for a message if the queue is empty (default: {True})
+
+    Returns:
+      List of messages, empty once the queue is closed and drained
+    """
+    with self.condition:
+      while block and not self.items and not self.closed:
+        self.condition.wait()
+      batch = []
+      while self.items and len(batch) < count:
+        batch.append(self.items.popleft())
+      return batch
+
+  def close(self, clear=False):
+    """Refuse new messages, the queued ones are still given by get()
+
+    Keyword Arguments:
+        clear {bool} -- Drop the queued messages too (default: {False})
+    """
+    with self.condition:
+      self.closed = True
+      if clear:
+        self.items.clear()
+      self.condition.notify_all()
+
+  def __len__(self):
+    return len(self.items)
@@ -28,7 +28,7 @@ from .WSClient import *
 class WSServer(threading.Thread):
   """WebSocket Server Class
   """
-  def __init__(self, host='localhost', port=9999, maxclients=20):
+  def __init__(self, host='localhost', port=9999, maxclients=20, backlog=1, maxmessagesize=WSSettings.MAX_MESSAGE_SIZE, compression=True, sendqueuesize=WSSettings.SEND_QUEUE_SIZE, sendpolicy=WSSettings.SEND_POLICY):
     super().__init__()
     self.clients = []
     self.s = ''
@@ -37,6 +37,15 @@ class WSServer(threading.Thread):
     self.host = host
     self.port = port
     self.maxclients = maxclients
+    self.backlog = backlog
+    self.maxmessagesize = maxmessagesize
+    self.compression = compression
+    self.sendqueuesize = sendqueuesize
+    self.sendpolicy = sendpolicy
+    # Statistics: bytes of the frames multicast to the clients, messages dropped by the send queues of the clients gone
+    self.broadcastBytes = 0
+    self.droppedFrames = 0
+    self.statsLock = threading.Lock()
 
   def setWSHandler(self, handler):
     self._WSHandler = handler
@@ -48,11 +57,16 @@ class WSServer(threading.Thread):
         host {str} -- WebSocket server or ip to join. (default: {'localhost'})
         port {int} -- Port to join. (default: {9999})
         maxclients {int} -- Max clients which can connect at the same time. (default: {20})
+        backlog {int} -- Number of pending connections the socket can queue. (default: {1})
+        maxmessagesize {int} -- Largest message accepted from a client, in bytes. (default: {WSSettings.MAX_MESSAGE_SIZE})
+        compression {bool} -- Accept permessage-deflate compression offers. (default: {True})
+        sendqueuesize {int} -- Max number of messages waiting to be written to a client. (default: {WSSettings.SEND_QUEUE_SIZE})
+        sendpolicy {string} -- What to do when the queue of a client is full, see WSSendQueue. (default: {WSSettings.SEND_POLICY})
     """
     self.s = socket.socket()
     self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     self.s.bind((self.host, self.port))
-    self.s.listen(1)
+    self.s.listen(self.backlog)
     self.listening = True
     while self.listening:
       conn, addr = self.s.accept()
@@ -74,8 +88,17 @@ class WSServer(threading.Thread):
     """
     logging.websocket('--- SEND MULTICAST ---')
     logging.websocket(repr(bytes))
-    for _WSClient in self.clients:
-      _WSClient.send(bytes)
+    if isinstance(bytes, WSMessage):
+      # Counted when encoded for each client
+      bytes.multicast = True
+    sent = 0
+    for _WSClient in list(self.clients):
+      # Clients still in handshake get the state on connection
+      if _WSClient.hasStatus('OPEN'):
+        _WSClient.send(bytes)
+        sent += 1
+    if not isinstance(bytes, WSMessage):
+      self.countBroadcast(sent * len(bytes))
     logging.websocket('multicast send finished')
 
   def stop(self):
@@ -87,10 +110,29 @@ class WSServer(threading.Thread):
     self.s.close()
     logging.websocket('--- THAT\'S ALL FOLKS ---')
 
+  def countBroadcast(self, size):
+    """Count bytes multicast to the clients
+
+    Arguments:
+        size {int} -- Bytes of the frames sent
+    """
+    with self.statsLock:
+      self.broadcastBytes += size
+
+  def dropped(self):
+    """Messages dropped by the send queues, of all the clients since the start
+
+    Returns:
+      Number of messages
+    """
+    return self.droppedFrames + sum(_WSClient.queue.dropped for _WSClient in list(self.clients))
+
   def remove(self, _WSClient):
     if _WSClient in self.clients:
       logging.websocket('Client left:', repr(_WSClient.conn))
       self.clients.remove(_WSClient)
+      with self.statsLock:
+        self.droppedFrames += _WSClient.queue.dropped
 
 if __name__ == '__main__':
   server = WSServer()
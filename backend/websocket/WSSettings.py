@@ -35,6 +35,30 @@ class WSSettings:
 
   OPCODES = (CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG)
 
+  # Size of the receive buffer of each client
+  RECEIVE_BUFFER_SIZE = 65536
+
+  # Largest message accepted from a client, fragments included
+  MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+  # permessage-deflate compression (RFC 7692)
+  # Without server context takeover, multicast messages are compressed once for all clients
+  DEFLATE_CONTEXT_TAKEOVER = False
+  DEFLATE_WINDOW_BITS = 15
+  DEFLATE_LEVEL = 6
+  # Smaller messages are sent uncompressed
+  DEFLATE_MIN_SIZE = 256
+
+  # Outgoing messages of each client, written by its writer
+  # Overflow policy: 'drop-oldest', 'coalesce' (replace the queued message of the same type) or 'disconnect'
+  SEND_QUEUE_SIZE = 1024
+  SEND_POLICY = 'coalesce'
+  # Most frames written with one syscall
+  SEND_BATCH_SIZE = 64
+
+  # Threads running the WSHandler callbacks of the clients of the asyncio server, out of its event loop
+  HANDLER_THREADS = 8
+
   # Closing frame status codes.
   NORMAL_CLOSURE =  1000 # \x03\xe8
   ENDPOINT_IS_GOING_AWAY =  1001 # \x03\xe9